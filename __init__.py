@@ -1 +1,7 @@
-from .DSB_efd060071a1711f0b40cf83441a96bd5 import DSB_efd060071a1711f0b40cf83441a96bd5
+try:
+    from .DSB_efd060071a1711f0b40cf83441a96bd5 import DSB_efd060071a1711f0b40cf83441a96bd5
+except ModuleNotFoundError as e:
+    # Worker processes import this package by its plugin name to find their entry points, in a plain Python
+    #  interpreter without Dragonfly's modules. They don't need the plugin class.
+    if not (e.name or "").startswith("ORS"):
+        raise
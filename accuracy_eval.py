@@ -1,7 +1,14 @@
+import argparse
+import json
+import os
+
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.ticker import MaxNLocator
+from scipy import sparse
+from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+from scipy.spatial import cKDTree
 
 GROUND_TRUTH_PATH = "data/cell1_roi5_ground_truth_smoothed.csv"
 DSB_PATH = "data/cell1_roi5_automatic.csv"
@@ -21,22 +28,59 @@ def find_nearest_neighbors(gt_pts: np.ndarray, dsb_pts: np.ndarray):
         indices: int array of shape (n_dsb,)
         distances: float array of same shape
     """
-    n = dsb_pts.shape[0]
-    indices = np.empty(n, dtype=int)
-    distances = np.empty(n, dtype=float)
+    if len(gt_pts) == 0:
+        return np.zeros(len(dsb_pts), dtype=int), np.full(len(dsb_pts), np.inf)
+
+    distances, indices = cKDTree(gt_pts).query(dsb_pts)
+    return indices.astype(int), distances
+
 
-    for i, pt in enumerate(dsb_pts):
-        deltas = gt_pts - pt
-        dist2 = np.einsum("ij,ij->i", deltas, deltas)
-        j = np.argmin(dist2)
-        indices[i] = j
-        distances[i] = np.sqrt(dist2[j])
+def match_one_to_one(gt_pts: np.ndarray, dsb_pts: np.ndarray, max_dist: float):
+    """
+    Optimal one-to-one matching of DSB points to GT points. Minimizes the summed distance of the matched pairs plus
+    max_dist for every point left unmatched, so no GT spine is matched to more than one DSB head. Only pairs closer than
+    max_dist are considered, which keeps the distance graph sparse.
+    Returns:
+        indices: int array of shape (n_dsb,), -1 where the DSB point is unmatched
+        distances: float array of same shape, inf where the DSB point is unmatched
+    """
+    n_dsb, n_gt = len(dsb_pts), len(gt_pts)
+    indices = np.full(n_dsb, -1, dtype=int)
+    distances = np.full(n_dsb, np.inf)
+
+    if n_dsb == 0 or n_gt == 0:
+        return indices, distances
+
+    pairs = cKDTree(dsb_pts).sparse_distance_matrix(cKDTree(gt_pts), max_dist, output_type="coo_matrix")
+    rows, cols, dists = pairs.row, pairs.col, pairs.data
+
+    # Square graph that always has a perfect matching:
+    #   DSB point i -> GT point j (the close pairs), or -> its own "unmatched" node with cost max_dist
+    #   GT point j -> its own "unmatched" node with cost max_dist
+    #   The "unmatched" nodes of a matched pair (i, j) are left over, so they are joined by a zero-cost edge
+    # Every weight is shifted up by 1 because the matching needs non-zero weights. Every perfect matching has
+    #  n_dsb + n_gt edges, so the shift doesn't change which one is optimal.
+    size = n_dsb + n_gt
+    graph_rows = np.concatenate((rows, np.arange(n_dsb), n_dsb + np.arange(n_gt), n_dsb + cols))
+    graph_cols = np.concatenate((cols, n_gt + np.arange(n_dsb), np.arange(n_gt), n_gt + rows))
+    weights = np.concatenate((dists, np.full(size, max_dist), np.zeros(len(rows)))) + 1
+
+    graph = sparse.csr_matrix((weights, (graph_rows, graph_cols)), shape=(size, size))
+    row_ind, col_ind = min_weight_full_bipartite_matching(graph)
+
+    matched = (row_ind < n_dsb) & (col_ind < n_gt)
+    dsb_idx, gt_idx = row_ind[matched], col_ind[matched]
+    indices[dsb_idx] = gt_idx
+    distances[dsb_idx] = np.linalg.norm(dsb_pts[dsb_idx] - gt_pts[gt_idx], axis=1)
 
     return indices, distances
 
 
-def merge_ground_truth(gt: pd.DataFrame, dsb: pd.DataFrame, max_dist: float = 500.0):
-    """Match each DSB spine to the nearest GT spine and merge volumes/C.O.M., filtering out outliers."""
+def merge_ground_truth(gt: pd.DataFrame, dsb: pd.DataFrame, max_dist: float = 500.0, one_to_one: bool = False):
+    """
+    Match each DSB spine to the nearest GT spine and merge volumes/C.O.M., filtering out outliers.
+    If one_to_one is set, each GT spine is matched to at most one DSB spine (see match_one_to_one).
+    """
     # Column names
     dsb_coords = ["Head Centroid X (nm)", "Head Centroid Y (nm)", "Head Centroid Z (nm)"]
     gt_coords = ["com_x", "com_y", "com_z"]
@@ -44,18 +88,22 @@ def merge_ground_truth(gt: pd.DataFrame, dsb: pd.DataFrame, max_dist: float = 50
     gt_pts = gt[gt_coords].to_numpy(dtype=float)
     dsb_pts = dsb[dsb_coords].to_numpy(dtype=float)
 
-    idxs, dists = find_nearest_neighbors(gt_pts, dsb_pts)
+    if one_to_one:
+        idxs, dists = match_one_to_one(gt_pts, dsb_pts, max_dist)
+    else:
+        idxs, dists = find_nearest_neighbors(gt_pts, dsb_pts)
+
+    # Filter out matches farther than threshold
+    keep = dists < max_dist
+    idxs, dists = idxs[keep], dists[keep]
 
     # Build merged columns
-    merged = dsb.copy()
+    merged = dsb[keep].reset_index(drop=True)
     merged["GT_name"] = gt.loc[idxs, "name"].values
     merged["GT_volume"] = gt.loc[idxs, "volume"].values
     merged[["GT_com_x", "GT_com_y", "GT_com_z"]] = gt_pts[idxs]
     merged["distance_nm"] = dists
 
-    # Filter out matches farther than threshold
-    merged = merged[merged["distance_nm"] < max_dist].reset_index(drop=True)
-
     # Volume differences
     merged["volume_diff"] = merged["Head Volume (μm³)"] - merged["GT_volume"]
     merged["volume_percent_diff"] = (
@@ -65,7 +113,16 @@ def merge_ground_truth(gt: pd.DataFrame, dsb: pd.DataFrame, max_dist: float = 50
     return merged
 
 
-def plot_histogram(data: pd.Series, title: str, x_label: str, bins: int = 50):
+def show_or_save(save_path: str = None):
+    """Show the current figure, or write it to save_path and close it."""
+    if save_path is None:
+        plt.show()
+    else:
+        plt.savefig(save_path, dpi=150, bbox_inches="tight")
+        plt.close()
+
+
+def plot_histogram(data: pd.Series, title: str, x_label: str, bins: int = 50, save_path: str = None):
     plt.figure()
     plt.hist(data, bins=bins)
     plt.title(title)
@@ -73,10 +130,11 @@ def plot_histogram(data: pd.Series, title: str, x_label: str, bins: int = 50):
     ax = plt.gca()  # Get current axes
     ax.yaxis.set_major_locator(MaxNLocator(integer=True))  # Integer y-axis
     plt.ylabel("Count")
-    plt.show()
+    show_or_save(save_path)
 
 
-def plot_scatter_with_identity(x: pd.Series, y: pd.Series, xlabel: str, ylabel: str, title: str):
+def plot_scatter_with_identity(x: pd.Series, y: pd.Series, xlabel: str, ylabel: str, title: str,
+                               save_path: str = None):
     plt.figure()
     plt.scatter(x, y, alpha=0.7)
     mn, mx = min(x.min(), y.min()), max(x.max(), y.max())
@@ -84,10 +142,10 @@ def plot_scatter_with_identity(x: pd.Series, y: pd.Series, xlabel: str, ylabel:
     plt.title(title)
     plt.xlabel(xlabel)
     plt.ylabel(ylabel)
-    plt.show()
+    show_or_save(save_path)
 
 
-def plot_bland_altman(x: pd.Series, y: pd.Series, labels=None):
+def plot_bland_altman(x: pd.Series, y: pd.Series, labels=None, save_path: str = None):
     """
     Creates a Bland–Altman plot comparing x & y.
     If labels is provided, it's a sequence of text labels for each point.
@@ -106,25 +164,69 @@ def plot_bland_altman(x: pd.Series, y: pd.Series, labels=None):
     plt.title("Bland–Altman Plot of DSB Accuracy")
     plt.xlabel("Mean Volume (μm³)")
     plt.ylabel("Volume Difference (DSB - GT) (μm³)")
-    plt.show()
+    show_or_save(save_path)
+
+
+def compute_metrics(gt: pd.DataFrame, dsb: pd.DataFrame, merged: pd.DataFrame) -> dict:
+    """Summary statistics of a merged DSB/GT table."""
+    abs_percent = merged["volume_percent_diff"].abs()
+    has_matches = len(merged) > 0
+    return {
+        "gt_spines": len(gt),
+        "dsb_heads": len(dsb),
+        "matched_heads": len(merged),
+        "matched_gt_spines": int(merged["GT_name"].nunique()),
+        "precision": len(merged) / len(dsb) if len(dsb) else None,
+        "recall": merged["GT_name"].nunique() / len(gt) if len(gt) else None,
+        "mean_distance_nm": float(merged["distance_nm"].mean()) if has_matches else None,
+        "mean_volume_diff": float(merged["volume_diff"].mean()) if has_matches else None,
+        "median_abs_volume_percent_diff": float(abs_percent.median()) if has_matches else None,
+        "mean_abs_volume_percent_diff": float(abs_percent.mean()) if has_matches else None,
+    }
 
 
 def main():
-    gt_df, dsb_df = load_data(GROUND_TRUTH_PATH, DSB_PATH)
-    merged = merge_ground_truth(gt_df, dsb_df)
+    parser = argparse.ArgumentParser(description="Compare DSB head volumes against ground truth.")
+    parser.add_argument("--gt", default=GROUND_TRUTH_PATH, help="Ground truth CSV (name, volume, com_x/y/z)")
+    parser.add_argument("--dsb", default=DSB_PATH, help="DSB output CSV")
+    parser.add_argument("--max-dist", type=float, default=500.0, help="Maximum match distance in nm")
+    parser.add_argument("--one-to-one", action="store_true", help="Match each GT spine to at most one DSB head")
+    parser.add_argument("--output-dir", help="Write metrics, the merged table and plots here instead of showing them")
+    args = parser.parse_args()
+
+    save_dir = args.output_dir
+    if save_dir is not None:
+        plt.switch_backend("Agg")
+        os.makedirs(save_dir, exist_ok=True)
+
+    def save_path(name: str):
+        return os.path.join(save_dir, name) if save_dir is not None else None
+
+    gt_df, dsb_df = load_data(args.gt, args.dsb)
+    merged = merge_ground_truth(gt_df, dsb_df, max_dist=args.max_dist, one_to_one=args.one_to_one)
+
+    metrics = compute_metrics(gt_df, dsb_df, merged)
+    print(json.dumps(metrics, indent=2))
+
+    if save_dir is not None:
+        with open(save_path("metrics.json"), "w") as f:
+            json.dump(metrics, f, indent=2)
+        merged.to_csv(save_path("merged.csv"), index=False)
 
     # Histograms
     plot_histogram(
         merged["volume_percent_diff"],
         title="Volume % Difference (DSB vs GT)",
         x_label="Percent Difference (%)",
-        bins=15
+        bins=15,
+        save_path=save_path("volume_percent_diff.png")
     )
     plot_histogram(
         merged["volume_diff"],
         title="Volume Difference (DSB – GT) μm³",
         x_label="Difference (μm³)",
-        bins=15
+        bins=15,
+        save_path=save_path("volume_diff.png")
     )
 
     # Scatter DSB vs GT
@@ -133,7 +235,8 @@ def main():
         merged["Head Volume (μm³)"],
         xlabel="Ground Truth Volume (μm³)",
         ylabel="DSB Volume (μm³)",
-        title="DSB vs Ground Truth Head Volume"
+        title="DSB vs Ground Truth Head Volume",
+        save_path=save_path("dsb_vs_gt_volume.png")
     )
 
     # Bland–Altman
@@ -143,7 +246,8 @@ def main():
         labels=[
             # f"{row.GT_name}, idx {row['Head Index']}"
             # for _, row in merged.iterrows()
-        ]
+        ],
+        save_path=save_path("bland_altman.png")
     )
 
 
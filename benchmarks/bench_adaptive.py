@@ -0,0 +1,110 @@
+"""
+Compares adaptive neck detection (NeckParams(adaptive=True)) against the default fixed sampling on a synthetic
+dendrite: rays cast, wall time, how far the neck points move and how close the head volumes are to the known synthetic
+volumes. The default mode draws its head rays at random, so it is also run twice to show how much its own neck points
+vary between runs.
+
+Run from the repository root with:
+    python -m benchmarks.bench_adaptive
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+import ncollpyde
+
+from benchmarks.bench_stages import SPINE_FILTER, head_volume_accuracy
+from benchmarks.synthetic import make_dendrite
+from pipeline.beheading import polyline_utils, spine_analysis
+from pipeline.preprocessing.skeletonization import skeletonize_mesh
+
+rays_cast = 0
+
+
+def count_rays(intersections):
+    """Wraps ncollpyde.Volume.intersections to count the rays cast."""
+
+    def wrapper(self, sources, targets, *args, **kwargs):
+        global rays_cast
+        rays_cast += len(sources)
+        return intersections(self, sources, targets, *args, **kwargs)
+
+    return wrapper
+
+
+def detect_necks(spine_skeletons, mesh, params) -> tuple[list, float, int]:
+    """
+    :return: ((neck point 3D, neck tangent, neck point 1D) of each spine, wall time in seconds, rays cast)
+    """
+
+    global rays_cast
+    rays_cast = 0
+
+    start = time.perf_counter()
+    necks = [
+        spine_analysis.compute_neck_point_and_tangent(spine_skeleton, mesh, params)
+        for spine_skeleton in spine_skeletons
+    ]
+
+    return necks, time.perf_counter() - start, rays_cast
+
+
+def median_volume_error(dendrite, necks) -> float:
+    heads = [spine_analysis.behead(dendrite.mesh, point, tangent) for point, tangent, _ in necks]
+    return head_volume_accuracy(dendrite, heads)["median_abs_volume_error"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--spines", type=int, default=20, help="Number of spines on the synthetic dendrite")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tolerance", type=float, default=30,
+                        help="Fail if the median neck point moves by more than this many nm")
+    parser.add_argument("--coarse-factor", type=int, default=spine_analysis.NeckParams.coarse_factor)
+    parser.add_argument("--min-rays", type=int, default=spine_analysis.NeckParams.min_rays)
+    parser.add_argument("--ray-tolerance", type=float, default=spine_analysis.NeckParams.ray_tolerance)
+    args = parser.parse_args()
+
+    ncollpyde.Volume.intersections = count_rays(ncollpyde.Volume.intersections)
+
+    dendrite = make_dendrite(n_spines=args.spines, seed=args.seed)
+    table = polyline_utils.build_segment_table(skeletonize_mesh(dendrite.mesh))
+    spine_skeletons = [table.polylines[i] for i in table.select(**SPINE_FILTER)]
+
+    exact = spine_analysis.NeckParams()
+    adaptive = spine_analysis.NeckParams(
+        adaptive=True, coarse_factor=args.coarse_factor, min_rays=args.min_rays, ray_tolerance=args.ray_tolerance
+    )
+
+    # Build the ray casting BVH up front so that neither mode is charged for it
+    spine_analysis.skel_helper.collision_volume(dendrite.mesh)
+
+    exact_necks, exact_time, exact_rays = detect_necks(spine_skeletons, dendrite.mesh, exact)
+    repeat_necks, _, _ = detect_necks(spine_skeletons, dendrite.mesh, exact)
+    adaptive_necks, adaptive_time, adaptive_rays = detect_necks(spine_skeletons, dendrite.mesh, adaptive)
+    adaptive_repeat, _, _ = detect_necks(spine_skeletons, dendrite.mesh, adaptive)
+
+    exact_1d, repeat_1d, adaptive_1d, adaptive_repeat_1d = (
+        np.array([neck[2] for neck in necks]) for necks in (exact_necks, repeat_necks, adaptive_necks, adaptive_repeat)
+    )
+    jitter = np.abs(repeat_1d - exact_1d)
+    error = np.abs(adaptive_1d - exact_1d)
+
+    print(f"{len(spine_skeletons)} spines")
+    print(f"Fixed sampling: {exact_rays:9d} rays {exact_time:7.2f} s")
+    print(f"Adaptive:       {adaptive_rays:9d} rays {adaptive_time:7.2f} s  "
+          f"({exact_rays / adaptive_rays:.1f}x fewer rays, {exact_time / adaptive_time:.1f}x faster)")
+    print(f"Fixed sampling run to run:   median {np.median(jitter):6.1f} nm, max {jitter.max():6.1f} nm")
+    print(f"Adaptive vs fixed sampling:  median {np.median(error):6.1f} nm, max {error.max():6.1f} nm")
+    print(f"Adaptive is deterministic: {np.array_equal(adaptive_1d, adaptive_repeat_1d)}")
+    print(f"Median head volume error:    fixed sampling {median_volume_error(dendrite, exact_necks):.1%}, "
+          f"adaptive {median_volume_error(dendrite, adaptive_necks):.1%}")
+
+    if np.median(error) > args.tolerance:
+        sys.exit(f"The median neck point moved by more than {args.tolerance} nm")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Cold-start import budget for the plugin. Imports the plugin modules in a fresh interpreter with `python -X importtime`,
+prints the slowest imports, and exits with an error if the import takes longer than the budget or pulls in any of the
+heavy packages that should only be loaded on first use.
+
+Outside of Dragonfly only the pipeline modules can be imported. Run this with Dragonfly's Python (where ORSModel and
+PyQt6 are available) and --plugin to also import the main form, which is what opening the DSB window does.
+
+Run from the repository root with:
+    python -m benchmarks.bench_cold_start
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Packages that take seconds to import and are only needed once a preprocessing file is loaded or run
+HEAVY_MODULES = ["trimesh", "pyvista", "pyvistaqt", "vtk", "scipy", "sklearn", "skeletor", "ncollpyde", "numba", "embreex"]
+
+PIPELINE_MODULES = [
+    "pipeline.payload",
+    "pipeline.results",
+    "pipeline.service",
+    "pipeline.shared_mesh",
+    "pipeline.telemetry",
+    "pipeline.processes",
+    "pipeline.beheading.bulk",
+    "pipeline.beheading.geometry",
+    "pipeline.beheading.polyline_utils",
+    "pipeline.beheading.skel_helper",
+    "pipeline.beheading.spine_analysis",
+    "pipeline.preprocessing.childprocess",
+    "pipeline.preprocessing.memorybudget",
+]
+
+# Imports the repository as a package the same way Dragonfly does, then the main form
+PLUGIN_IMPORT = f"""
+import importlib, importlib.util, sys
+spec = importlib.util.spec_from_file_location(
+    "dsb_plugin", {os.path.join(ROOT, "__init__.py")!r}, submodule_search_locations=[{ROOT!r}]
+)
+module = importlib.util.module_from_spec(spec)
+sys.modules["dsb_plugin"] = module
+spec.loader.exec_module(module)
+importlib.import_module("dsb_plugin.mainformdsb")
+"""
+
+# Runs in the child interpreter. Prints the wall time of the import and the heavy modules that were loaded as JSON on
+#  the last line of stdout.
+CHILD_TEMPLATE = """
+import json, sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+{imports}
+elapsed = time.perf_counter() - start
+heavy = sorted(name for name in {heavy!r} if name in sys.modules)
+print(json.dumps({{"seconds": elapsed, "heavy": heavy}}))
+"""
+
+
+def parse_importtime(stderr: str) -> list[tuple[float, str]]:
+    """
+    Parses the output of `python -X importtime`.
+
+    :param stderr: The standard error of the child interpreter
+    :return: (cumulative seconds, module name) for each top-level import, slowest first
+    """
+
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit() or name.startswith("  "):
+            continue  # The header line, or a nested import already counted in its parent's cumulative time
+
+        entries.append((int(cumulative) / 1e6, name.strip()))
+
+    return sorted(entries, reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget", type=float, default=1.0, help="Maximum import time in seconds")
+    parser.add_argument("--plugin", action="store_true", help="Also import the main form (requires Dragonfly)")
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest imports to print")
+    args = parser.parse_args()
+
+    imports = "\n".join(f"import {module}" for module in PIPELINE_MODULES)
+    if args.plugin:
+        imports += "\n" + PLUGIN_IMPORT
+
+    child = CHILD_TEMPLATE.format(root=ROOT, imports=imports, heavy=HEAVY_MODULES)
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", child], capture_output=True, text=True, cwd=ROOT)
+
+    if proc.returncode != 0:
+        print(proc.stderr[-2000:], file=sys.stderr)
+        sys.exit(f"Importing the plugin failed with exit code {proc.returncode}")
+
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+
+    print("Slowest top-level imports:")
+    for seconds, name in parse_importtime(proc.stderr)[:args.top]:
+        print(f"  {seconds:7.3f} s  {name}")
+
+    print(f"Cold import: {result['seconds']:.3f} s (budget {args.budget:.3f} s)")
+
+    failures = []
+    if result["seconds"] > args.budget:
+        failures.append(f"cold import took {result['seconds']:.3f} s, over the {args.budget:.3f} s budget")
+    if result["heavy"]:
+        failures.append(f"heavy modules imported at start-up: {', '.join(result['heavy'])}")
+
+    if failures:
+        sys.exit("FAIL: " + "; ".join(failures))
+
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Measures the confidence scores (confidence.score_spines) on a synthetic dendrite with a PSD on every head. Every
+skeleton branch is scored, including the ones that aren't spines: wall time with and without cached radius profiles,
+the scores of spines and of other branches, and how far the neck points of the spines auto-accepted at the threshold
+are from the known synthetic necks, compared with the spines left for review.
+
+Run from the repository root with:
+    python -m benchmarks.bench_confidence
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+import trimesh
+
+from benchmarks.bench_cross_section import neck_errors
+from benchmarks.synthetic import make_dendrite
+from pipeline.beheading import confidence, polyline_utils, profile_cache, spine_analysis
+from pipeline.preprocessing.skeletonization import skeletonize_mesh
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--spines", type=int, default=20, help="Number of spines on the synthetic dendrite")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--threshold", type=float, default=confidence.DEFAULT_THRESHOLD)
+    parser.add_argument("--engine", default="rays", choices=spine_analysis.ENGINES,
+                        help="The engine the neck points are found with")
+    args = parser.parse_args()
+
+    dendrite = make_dendrite(n_spines=args.spines, seed=args.seed)
+    table = polyline_utils.build_segment_table(skeletonize_mesh(dendrite.mesh))
+    branches = table.select(min_length=0, max_length=np.inf, min_nodes=2, max_nodes=np.inf, radius_threshold=np.inf)
+
+    psds = trimesh.util.concatenate([
+        trimesh.creation.icosphere(radius=50).apply_translation(spine.head_center + spine.direction * spine.head_radius)
+        for spine in dendrite.spines
+    ])
+
+    params = spine_analysis.NeckParams(engine=args.engine)
+    spine_analysis.skel_helper.collision_volume(dendrite.mesh)  # So that the first run isn't charged for its BVH
+
+    with profile_cache.ProfileCache("synthetic") as cache:
+        start = time.perf_counter()
+        scored = confidence.score_spines(branches, table, dendrite.mesh, psds, cache, params)
+        cold_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        confidence.score_spines(branches, table, dendrite.mesh, psds, cache, params)
+        cached_seconds = time.perf_counter() - start
+
+    # A branch is a spine if its tip is in a synthetic head
+    centers = np.array([spine.head_center for spine in dendrite.spines])
+    radii = np.array([spine.head_radius for spine in dendrite.spines])
+    is_spine = np.array([
+        (np.linalg.norm(centers - table.polylines[spine.spine_idx][0], axis=1) < radii + 60).any() for spine in scored
+    ])
+
+    scores = np.array([spine.score for spine in scored])
+    accepted = np.array([spine.neck is not None and spine.score >= args.threshold for spine in scored])
+    errors = np.array([
+        neck_errors(dendrite, [spine.neck])[0] if spine.neck is not None else np.nan for spine in scored
+    ])
+
+    print(f"{len(scored)} branches, {is_spine.sum()} of them spines, neck points from the {args.engine} engine")
+    print(f"Scoring: {cold_seconds:.2f} s, {cached_seconds:.2f} s with the radius profiles cached")
+    print(f"Scores of spines: {np.array2string(np.sort(scores[is_spine])[::-1], precision=2)}")
+    print(f"Scores of other branches: {np.array2string(np.sort(scores[~is_spine])[::-1], precision=2)}")
+
+    print(f"At threshold {args.threshold}: {accepted.sum()} auto-accepted, {(~accepted).sum()} left for review "
+          f"({accepted.mean():.0%} fewer spines to visit)")
+    print(f"{'spines':<14} {'count':>6} {'median neck err nm':>19} {'max neck err nm':>16}")
+    for name, group in (("auto-accepted", accepted), ("for review", ~accepted & is_spine)):
+        # Branches too short to profile have no neck point
+        group_errors = errors[group & np.isfinite(errors)]
+        if len(group_errors):
+            print(f"{name:<14} {group.sum():6d} {np.median(group_errors):19.1f} {group_errors.max():16.1f}")
+
+    concerns = {}
+    for spine in scored:
+        for concern in spine.concerns:
+            concerns[concern] = concerns.get(concern, 0) + 1
+    print("Concerns: " + ", ".join(f"{concern} ({count})" for concern, count in sorted(concerns.items())))
+
+    if (accepted & ~is_spine).any():
+        sys.exit("A branch that isn't a spine was auto-accepted")
+
+
+if __name__ == "__main__":
+    main()
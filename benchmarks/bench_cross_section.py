@@ -0,0 +1,95 @@
+"""
+Compares the cross-section neck detection engine (NeckParams(engine="cross_section")) with the default ray casting
+engine on a synthetic dendrite: wall time, how far each engine's neck points are from the known synthetic necks (where
+the neck meets the head), and how close the head volumes are to the known synthetic volumes.
+
+Run from the repository root with:
+    python -m benchmarks.bench_cross_section
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.bench_adaptive import median_volume_error
+from benchmarks.bench_stages import SPINE_FILTER
+from benchmarks.synthetic import make_dendrite
+from pipeline.beheading import polyline_utils, spine_analysis
+from pipeline.preprocessing.skeletonization import skeletonize_mesh
+
+
+def detect_necks(spine_skeletons, mesh, params) -> tuple[list, float]:
+    """
+    :return: ((neck point 3D, neck tangent, neck point 1D) of each spine, wall time in seconds)
+    """
+
+    start = time.perf_counter()
+    necks = [
+        spine_analysis.compute_neck_point_and_tangent(spine_skeleton, mesh, params)
+        for spine_skeleton in spine_skeletons
+    ]
+
+    return necks, time.perf_counter() - start
+
+
+def neck_errors(dendrite, necks) -> np.ndarray:
+    """
+    :return: The distance from each neck point to the closest synthetic neck, in nm
+    """
+
+    truth = np.array([spine.neck_point for spine in dendrite.spines])
+    return np.array([np.linalg.norm(truth - point, axis=1).min() for point, _, _ in necks])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--spines", type=int, default=20, help="Number of spines on the synthetic dendrite")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--spacing", type=float, default=spine_analysis.NeckParams.spacing,
+                        help="Distance between samples along the skeleton in nm, for both engines")
+    parser.add_argument("--crop-margin", type=float, default=spine_analysis.NeckParams.crop_margin)
+    parser.add_argument("--neck-widening", type=float, default=spine_analysis.NeckParams.neck_widening)
+    args = parser.parse_args()
+
+    dendrite = make_dendrite(n_spines=args.spines, seed=args.seed)
+    table = polyline_utils.build_segment_table(skeletonize_mesh(dendrite.mesh))
+    spine_skeletons = [table.polylines[i] for i in table.select(**SPINE_FILTER)]
+
+    rays = spine_analysis.NeckParams(spacing=args.spacing)
+    sections = spine_analysis.NeckParams(
+        engine="cross_section", spacing=args.spacing, crop_margin=args.crop_margin, neck_widening=args.neck_widening
+    )
+
+    # Build the ray casting BVH and trimesh's edge caches up front so that neither engine is charged for them
+    spine_analysis.skel_helper.collision_volume(dendrite.mesh)
+    _ = dendrite.mesh.faces_unique_edges
+
+    ray_necks, ray_time = detect_necks(spine_skeletons, dendrite.mesh, rays)
+    section_necks, section_time = detect_necks(spine_skeletons, dendrite.mesh, sections)
+    section_repeat, _ = detect_necks(spine_skeletons, dendrite.mesh, sections)
+
+    ray_errors = neck_errors(dendrite, ray_necks)
+    section_errors = neck_errors(dendrite, section_necks)
+    moved = np.abs(np.array([neck[2] for neck in section_necks]) - np.array([neck[2] for neck in ray_necks]))
+
+    print(f"{len(spine_skeletons)} spines")
+    print(f"{'engine':<14} {'seconds':>8} {'median err nm':>14} {'max err nm':>11} {'median volume err':>18}")
+    print(f"{'rays':<14} {ray_time:8.2f} {np.median(ray_errors):14.1f} {ray_errors.max():11.1f} "
+          f"{median_volume_error(dendrite, ray_necks):18.1%}")
+    print(f"{'cross_section':<14} {section_time:8.2f} {np.median(section_errors):14.1f} {section_errors.max():11.1f} "
+          f"{median_volume_error(dendrite, section_necks):18.1%}")
+    print(f"Cross-section vs rays: median {np.median(moved):6.1f} nm, max {moved.max():6.1f} nm along the skeleton")
+
+    deterministic = np.array_equal(
+        [neck[2] for neck in section_necks], [neck[2] for neck in section_repeat]
+    )
+    print(f"Cross-section is deterministic: {deterministic}")
+
+    if not deterministic:
+        sys.exit("The cross-section engine gave different neck points for the same spines")
+
+
+if __name__ == "__main__":
+    main()
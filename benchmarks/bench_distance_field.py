@@ -0,0 +1,96 @@
+"""
+Compares the distance field neck detection engine (NeckParams(engine="distance_field")) with the default ray casting
+engine on a synthetic dendrite: wall time, how far each engine's neck points are from the known synthetic necks, and
+how close the head volumes are to the known synthetic volumes. Also checks the radius the field gives at the center of
+each synthetic head, and that the field survives a round trip through a preprocessing file.
+
+Run from the repository root with:
+    python -m benchmarks.bench_distance_field
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.bench_adaptive import median_volume_error
+from benchmarks.bench_cross_section import detect_necks, neck_errors
+from benchmarks.bench_stages import SPINE_FILTER
+from benchmarks.synthetic import make_dendrite
+from pipeline import distance_field, payload
+from pipeline.beheading import polyline_utils, spine_analysis
+from pipeline.preprocessing.skeletonization import skeletonize_mesh
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--spines", type=int, default=20, help="Number of spines on the synthetic dendrite")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--spacing", type=float, default=spine_analysis.NeckParams.spacing,
+                        help="Distance between samples along the skeleton in nm, for both engines")
+    args = parser.parse_args()
+
+    dendrite = make_dendrite(n_spines=args.spines, seed=args.seed)
+    skeleton = skeletonize_mesh(dendrite.mesh)
+    table = polyline_utils.build_segment_table(skeleton)
+    spine_skeletons = [table.polylines[i] for i in table.select(**SPINE_FILTER)]
+
+    start = time.perf_counter()
+    field = distance_field.from_mask(dendrite.mask, dendrite.origin, np.eye(3) * dendrite.voxel_size)
+    field_seconds = time.perf_counter() - start
+    print(f"{dendrite.mask.size} voxels, distance field {field.distances.shape} {field.nbytes / 1024 ** 2:.1f} MB "
+          f"in {field_seconds:.2f} s")
+
+    head_centers = np.array([spine.head_center for spine in dendrite.spines])
+    head_radii = np.array([spine.head_radius for spine in dendrite.spines])
+    radius_errors = np.abs(field.radius(head_centers) - head_radii)
+    print(f"Radius at the head centers: median error {np.median(radius_errors):.1f} nm, "
+          f"max {radius_errors.max():.1f} nm")
+
+    rays = spine_analysis.NeckParams(spacing=args.spacing)
+    fields = spine_analysis.NeckParams(engine="distance_field", spacing=args.spacing)
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "dendrite.dsb")
+        payload.pld_save(payload.Payload(dendrite.mesh, skeleton, None, None, distance_field=field), path)
+        loaded = payload.pld_load(path)
+
+    round_trip = loaded.distance_field is not None \
+        and distance_field.get(loaded.dendrite_mesh) is loaded.distance_field \
+        and np.array_equal(loaded.distance_field.distances, field.distances) \
+        and np.array_equal(loaded.distance_field.origin, field.origin) \
+        and np.array_equal(loaded.distance_field.axes, field.axes)
+    print(f"The distance field survives a round trip through a preprocessing file: {round_trip}")
+
+    mesh = loaded.dendrite_mesh
+    spine_analysis.skel_helper.collision_volume(mesh)  # So that the rays engine isn't charged for building its BVH
+
+    ray_necks, ray_time = detect_necks(spine_skeletons, mesh, rays)
+    field_necks, field_time = detect_necks(spine_skeletons, mesh, fields)
+    field_repeat, _ = detect_necks(spine_skeletons, mesh, fields)
+
+    ray_errors = neck_errors(dendrite, ray_necks)
+    field_errors = neck_errors(dendrite, field_necks)
+
+    print(f"{len(spine_skeletons)} spines")
+    print(f"{'engine':<15} {'seconds':>8} {'median err nm':>14} {'max err nm':>11} {'median volume err':>18}")
+    print(f"{'rays':<15} {ray_time:8.2f} {np.median(ray_errors):14.1f} {ray_errors.max():11.1f} "
+          f"{median_volume_error(dendrite, ray_necks):18.1%}")
+    print(f"{'distance_field':<15} {field_time:8.2f} {np.median(field_errors):14.1f} {field_errors.max():11.1f} "
+          f"{median_volume_error(dendrite, field_necks):18.1%}")
+
+    deterministic = np.array_equal([neck[2] for neck in field_necks], [neck[2] for neck in field_repeat])
+    print(f"Distance field is deterministic: {deterministic}")
+
+    if not round_trip:
+        sys.exit("The distance field changed in the preprocessing file")
+
+    if not deterministic:
+        sys.exit("The distance field engine gave different neck points for the same spines")
+
+
+if __name__ == "__main__":
+    main()
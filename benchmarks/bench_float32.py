@@ -0,0 +1,116 @@
+"""
+Compares float32 ray casting (skel_helper.set_float32, Embree through embreex) against the default float64 ncollpyde
+ray casting on a large synthetic dendrite: memory and build time of the collision volume, ray casting time, how much
+the radius profiles and neck points move, and the head volume error of each mode against the known synthetic volumes.
+Also reports how much rounding the mesh vertices to float32 changes the mesh volume, which is what happens to every
+mesh saved in a .dsb file (STL stores float32 coordinates). Requires embreex.
+
+Run from the repository root with:
+    python -m benchmarks.bench_float32
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.bench_stages import SPINE_FILTER, head_volume_accuracy
+from benchmarks.synthetic import make_dendrite
+from pipeline.beheading import polyline_utils, skel_helper, spine_analysis
+from pipeline.preprocessing.skeletonization import skeletonize_mesh
+
+
+def rss_mb() -> float | None:
+    """The current resident memory of the process, or None where /proc is not available."""
+
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * 4096 / 1024 ** 2
+    except OSError:
+        return None
+
+
+def run_mode(dendrite, spine_skeletons, float32: bool) -> dict:
+    skel_helper.set_float32(float32)
+
+    rss_start = rss_mb()
+    start = time.perf_counter()
+    volume = skel_helper.collision_volume(dendrite.mesh)
+
+    # Embree builds its BVH on the first query
+    volume.intersections(dendrite.mesh.vertices[:1], dendrite.mesh.vertices[:1] + 1)
+    build_time = time.perf_counter() - start
+    rss_end = rss_mb()
+
+    if float32 and not isinstance(volume, skel_helper.EmbreeVolume):
+        sys.exit("embreex is not installed")
+
+    start = time.perf_counter()
+    profiles = spine_analysis.radius_profiles(spine_skeletons, dendrite.mesh)
+    profile_time = time.perf_counter() - start
+
+    # Adaptive mode is deterministic, so neck points only differ because of the ray casting
+    params = spine_analysis.NeckParams(adaptive=True)
+    necks = [
+        spine_analysis.compute_neck_point_and_tangent(spine_skeleton, dendrite.mesh, params)
+        for spine_skeleton in spine_skeletons
+    ]
+    heads = [spine_analysis.behead(dendrite.mesh, point, tangent) for point, tangent, _ in necks]
+
+    return {
+        "volume": volume,  # Kept alive so that building the other mode's volume doesn't free it during its measurement
+        "volume_mb": rss_end - rss_start if rss_start is not None else None,
+        "build_s": build_time,
+        "profile_s": profile_time,
+        "radii": np.concatenate([radii for _, radii in profiles]),
+        "necks": np.array([neck_1d for _, _, neck_1d in necks]),
+        "head_volumes": np.array([head.volume if head is not None else np.nan for head in heads]),
+        "accuracy": head_volume_accuracy(dendrite, heads),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--spines", type=int, default=20, help="Number of spines on the synthetic dendrite")
+    parser.add_argument("--shaft-length", type=float, default=12000, help="Length of the dendrite in nm")
+    parser.add_argument("--voxel-size", type=float, default=15, help="Voxel size of the synthetic ROI in nm")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    dendrite = make_dendrite(n_spines=args.spines, shaft_length=args.shaft_length, voxel_size=args.voxel_size,
+                             seed=args.seed)
+    mesh = dendrite.mesh
+    table = polyline_utils.build_segment_table(skeletonize_mesh(mesh))
+    spine_skeletons = [table.polylines[i] for i in table.select(**SPINE_FILTER)]
+    print(f"{len(mesh.vertices)} vertices, {len(mesh.faces)} faces, {len(spine_skeletons)} spines")
+
+    rounded = mesh.copy()
+    rounded.vertices = mesh.vertices.astype(np.float32)
+    print(f"Mesh volume change from rounding the vertices to float32: "
+          f"{abs(rounded.volume - mesh.volume) / mesh.volume:.2e}")
+
+    results = {
+        "float64": run_mode(dendrite, spine_skeletons, float32=False),
+        "float32": run_mode(dendrite, spine_skeletons, float32=True),
+    }
+    skel_helper.set_float32(False)
+
+    print(f"{'':<10} {'volume MB':>10} {'build s':>8} {'profiles s':>11} {'median head volume error':>25}")
+    for name, result in results.items():
+        volume_mb = f"{result['volume_mb']:10.1f}" if result["volume_mb"] is not None else f"{'n/a':>10}"
+        print(f"{name:<10} {volume_mb} {result['build_s']:8.2f} {result['profile_s']:11.2f} "
+              f"{result['accuracy']['median_abs_volume_error']:25.2%}")
+
+    float64, float32 = results["float64"], results["float32"]
+    radius_diff = np.abs(float32["radii"] - float64["radii"])
+    neck_diff = np.abs(float32["necks"] - float64["necks"])
+    head_diff = np.abs(float32["head_volumes"] - float64["head_volumes"]) / float64["head_volumes"]
+
+    print(f"Radius profile samples: median difference {np.median(radius_diff):.2e} nm, max {radius_diff.max():.2e} nm")
+    print(f"Neck points: {np.count_nonzero(neck_diff > 1e-3)} / {len(neck_diff)} moved, max {neck_diff.max():.2e} nm")
+    print(f"Head volumes: max relative difference {np.nanmax(head_diff):.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Benchmark and equivalence check for the Numba kernels in pipeline/beheading/kernels.py against the NumPy
+implementations they replace. Runs the per-spine geometry work of neck detection (resampling the skeleton, rotating
+the ray disks, aggregating hit distances and finding points along the skeleton) on synthetic spine skeletons, once with
+each implementation. Requires Numba.
+
+Run from the repository root with:
+    python -m benchmarks.bench_kernels
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from pipeline.beheading import geometry as geom
+from pipeline.beheading import kernels, skel_helper
+
+# The defaults of NeckParams
+SPACING = 6
+N_RAYS = 150
+
+
+def synthetic_spines(n_spines: int, seed: int = 0) -> list[np.ndarray]:
+    """
+    Builds smooth random walks shaped like spine skeletons: 15 to 150 nodes about 20 nm apart.
+
+    :param n_spines: The number of skeletons
+    :param seed: The random seed
+    :return: The (N, 3) skeleton polylines
+    """
+
+    rng = np.random.default_rng(seed)
+    spines = []
+
+    for _ in range(n_spines):
+        n = rng.integers(15, 150)
+        directions = np.cumsum(rng.normal(scale=0.2, size=(n - 1, 3)), axis=0) + rng.normal(size=3)
+        directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+        steps = directions * rng.uniform(15, 25, size=(n - 1, 1))
+        spines.append(np.concatenate((np.zeros((1, 3)), np.cumsum(steps, axis=0))) + rng.uniform(0, 10000, size=3))
+
+    return spines
+
+
+def synthetic_hits(n_samples: int, rng) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Hit distances of N_RAYS rays at each sample, with some rays missing, like the output of a ray casting query.
+
+    :return: (hit distances, sample index of each hit)
+    """
+
+    groups = np.repeat(np.arange(n_samples), N_RAYS)
+    keep = rng.random(len(groups)) < 0.9
+    return rng.gamma(4, 50, size=keep.sum()), groups[keep]
+
+
+def per_spine_work(spines: list[np.ndarray], hits: list) -> list:
+    """
+    The geometry work neck detection does for each spine, apart from the ray casting itself.
+
+    :return: The outputs of every step, to compare between implementations
+    """
+
+    outputs = []
+    for spine, (dists, groups) in zip(spines, hits):
+        points = skel_helper.interpolate_along_path(spine, SPACING)
+        rotations = skel_helper.rotations_to_normals(skel_helper.polyline_tangents(points))
+        radii = skel_helper.aggregate_groups(dists, groups, len(points), "percentile99")
+
+        length = geom.accumulate(spine)[-1]
+        along = [geom.point_and_tangent_along_polyline(spine, length * t) for t in (0.1, 0.5, 0.9)]
+
+        outputs.append((points, rotations, radii, along))
+
+    return outputs
+
+
+def time_steps(spines: list[np.ndarray], hits: list) -> dict[str, float]:
+    """
+    :return: The total time of each step over all spines, in seconds
+    """
+
+    times = dict.fromkeys(["interpolate_along_path", "rotations_to_normals", "aggregate_groups",
+                           "point_and_tangent_along_polyline"], 0.0)
+
+    for spine, (dists, groups) in zip(spines, hits):
+        start = time.perf_counter()
+        points = skel_helper.interpolate_along_path(spine, SPACING)
+        times["interpolate_along_path"] += time.perf_counter() - start
+
+        tangents = skel_helper.polyline_tangents(points)
+        start = time.perf_counter()
+        skel_helper.rotations_to_normals(tangents)
+        times["rotations_to_normals"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        skel_helper.aggregate_groups(dists, groups, len(points), "percentile99")
+        times["aggregate_groups"] += time.perf_counter() - start
+
+        length = geom.accumulate(spine)[-1]
+        start = time.perf_counter()
+        for t in (0.1, 0.5, 0.9):
+            geom.point_and_tangent_along_polyline(spine, length * t)
+        times["point_and_tangent_along_polyline"] += time.perf_counter() - start
+
+    return times
+
+
+def max_difference(a, b) -> float:
+    if isinstance(a, (tuple, list)):
+        return max(max_difference(x, y) for x, y in zip(a, b))
+
+    a, b = np.asarray(a), np.asarray(b)
+    assert a.shape == b.shape, f"Shapes differ: {a.shape} and {b.shape}"
+    return float(np.abs(a - b).max()) if a.size else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--spines", type=int, default=500, help="Number of synthetic spine skeletons")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    kernels.set_enabled(True)
+    start = time.perf_counter()
+    if kernels.get() is None:
+        sys.exit("Numba is not installed (or DSB_NUMBA=0 is set)")
+
+    spines = synthetic_spines(args.spines, args.seed)
+    rng = np.random.default_rng(args.seed)
+    hits = [synthetic_hits(len(skel_helper.interpolate_along_path(spine, SPACING)), rng) for spine in spines]
+
+    # The first call of each kernel compiles it, or loads it from Numba's on-disk cache
+    per_spine_work(spines[:1], hits[:1])
+    print(f"Numba import and compilation: {time.perf_counter() - start:.2f} s")
+
+    numba_outputs = per_spine_work(spines, hits)
+    numba_times = time_steps(spines, hits)
+
+    kernels.set_enabled(False)
+    numpy_outputs = per_spine_work(spines, hits)
+    numpy_times = time_steps(spines, hits)
+
+    print(f"{args.spines} spines, time per spine:")
+    print(f"{'kernel':<34} {'NumPy':>9} {'Numba':>9} {'speedup':>8}")
+    for name in numpy_times:
+        numpy_us = numpy_times[name] / args.spines * 1e6
+        numba_us = numba_times[name] / args.spines * 1e6
+        print(f"{name:<34} {numpy_us:7.1f}µs {numba_us:7.1f}µs {numpy_us / numba_us:7.1f}x")
+
+    numpy_total = sum(numpy_times.values()) / args.spines * 1e6
+    numba_total = sum(numba_times.values()) / args.spines * 1e6
+    print(f"{'total':<34} {numpy_total:7.1f}µs {numba_total:7.1f}µs {numpy_total / numba_total:7.1f}x")
+
+    difference = max_difference(numpy_outputs, numba_outputs)
+    print(f"Largest difference between the implementations: {difference:.2e}")
+    assert difference < 1e-6, "The Numba kernels give different results from the NumPy implementations"
+
+
+if __name__ == "__main__":
+    main()
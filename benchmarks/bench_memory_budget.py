@@ -0,0 +1,95 @@
+"""
+Checks the memory model of pipeline/preprocessing/memorybudget.py on synthetic dendrites. For each voxel size and
+marching cubes sampling factor, compares the estimated face count with the real one, and the estimated peak memory of
+skeletonizing and saving with the peak measured in a fresh process. Then shows the sampling choose_sampling picks for
+a budget, and that the peak stays within it.
+
+Marching cubes sampling is emulated with skimage's step_size, which like Dragonfly's xSample/ySample/zSample only
+visits every n-th voxel. Linux only, since the peak is read from /proc.
+
+Run from the repository root with:
+    python -m benchmarks.bench_memory_budget
+"""
+
+import argparse
+import os
+import tempfile
+
+import numpy as np
+
+from benchmarks.synthetic import make_dendrite
+from pipeline import processes
+from pipeline.preprocessing import memorybudget
+
+
+def _peak_rss_mb() -> float:
+    # VmHWM rather than ru_maxrss, which a spawned process inherits from its parent
+    with open("/proc/self/status") as f:
+        return next(int(line.split()[1]) for line in f if line.startswith("VmHWM:")) / 1024
+
+
+def _skeletonize_and_save(task) -> float:
+    """
+    Runs in a fresh process, like childprocess.PreprocessingProcess. :return: The peak RSS of the process in MB
+    """
+
+    import trimesh
+    from pipeline import payload
+    from pipeline.preprocessing.skeletonization import skeletonize_mesh
+
+    vertices, faces, path = task
+    mesh = trimesh.Trimesh(vertices=vertices, faces=faces, process=False)
+    payload.pld_save(payload.Payload(mesh, skeletonize_mesh(mesh), None, None), path)
+    return _peak_rss_mb()
+
+
+def sampled_mesh(dendrite, step: int) -> tuple[np.ndarray, np.ndarray]:
+    from skimage.measure import marching_cubes
+
+    vertices, faces, _, _ = marching_cubes(np.pad(dendrite.mask, 1).astype(np.float32), level=0.5, step_size=step)
+    return (vertices - 1) * dendrite.voxel_size + dendrite.origin, faces
+
+
+def measured_peak_mb(vertices, faces) -> float:
+    with tempfile.TemporaryDirectory() as folder, processes.process_pool(1) as executor:
+        return executor.submit(_skeletonize_and_save, (vertices, faces, os.path.join(folder, "x.dsb"))).result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--spines", type=int, default=20, help="Number of spines on the synthetic dendrite")
+    parser.add_argument("--voxel-sizes", type=float, nargs="+", default=[30, 20], help="Voxel sizes in nm")
+    parser.add_argument("--budget", type=float, default=300, help="Memory budget for the last check in MB")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if not os.path.exists("/proc/self/status"):
+        print("Peak RSS can only be measured on Linux")
+        return
+
+    print(f"{'voxel nm':>8} {'sampling':>8} {'faces':>8} {'est. faces':>10} {'peak MB':>8} {'est. MB':>8}")
+    for voxel_size in args.voxel_sizes:
+        dendrite = make_dendrite(n_spines=args.spines, voxel_size=voxel_size, seed=args.seed)
+        grid = memorybudget.RoiGrid(dendrite.mask.shape, (voxel_size,) * 3, int(dendrite.mask.sum()))
+
+        for step in (1, 2):
+            vertices, faces = sampled_mesh(dendrite, step)
+            estimate = memorybudget.estimate(grid, memorybudget.Sampling(step, step, step))
+            peak = measured_peak_mb(vertices, faces)
+            print(f"{voxel_size:8.0f} {step:8d} {len(faces):8d} {estimate.faces:10d} {peak:8.1f} "
+                  f"{estimate.skeletonize_mb:8.1f}")
+
+            assert estimate.faces >= len(faces), "The face count was underestimated"
+            assert estimate.skeletonize_mb >= peak, "The peak memory was underestimated"
+
+    decision = memorybudget.choose_sampling(grid, args.budget)
+    step = decision.sampling.z
+    vertices, faces = sampled_mesh(dendrite, step)
+    peak = measured_peak_mb(vertices, faces)
+    print(f"Budget {args.budget:.0f} MB: step {step} (estimated {decision.estimate.peak_mb:.1f} MB), "
+          f"measured peak {peak:.1f} MB")
+    assert peak <= args.budget, "The chosen sampling went over the budget"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Benchmark for polyline_utils.get_branch_polylines_by_length on a large synthetic skeleton.
+
+Run from the repository root with:
+    python -m benchmarks.bench_polyline_utils
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+import skeletor as sk
+
+from pipeline.beheading import polyline_utils
+
+
+def synthetic_skeleton(n_branches: int = 20000, trunk_spacing: float = 20, seed: int = 0) -> sk.Skeleton:
+    """
+    Builds a skeleton made of a straight trunk along the x-axis with a branch sprouting from every trunk node.
+
+    :param n_branches: The number of side branches (and trunk nodes)
+    :param trunk_spacing: The distance between trunk nodes in nm
+    :param seed: The random seed used for branch lengths, directions and radii
+    :return: The skeleton
+    """
+
+    rng = np.random.default_rng(seed)
+
+    trunk = np.zeros((n_branches, 3))
+    trunk[:, 0] = np.arange(n_branches) * trunk_spacing
+    trunk_parents = np.arange(-1, n_branches - 1)
+
+    branch_nodes = rng.integers(2, 60, size=n_branches)
+    directions = rng.normal(size=(n_branches, 3))
+    directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+    step = rng.uniform(20, 80, size=n_branches)
+
+    owner = np.repeat(np.arange(n_branches), branch_nodes)
+    position = np.concatenate([np.arange(1, n + 1) for n in branch_nodes])
+    branch_xyz = trunk[owner] + directions[owner] * (step[owner] * position)[:, None]
+    branch_xyz += rng.normal(scale=3, size=branch_xyz.shape)
+
+    # Each branch node's parent is the previous node in the branch, or the trunk node it sprouts from
+    branch_ids = n_branches + np.arange(len(owner))
+    branch_parents = branch_ids - 1
+    branch_parents[position == 1] = owner[position == 1]
+
+    swc = pd.DataFrame({
+        "node_id": np.concatenate([np.arange(n_branches), branch_ids]),
+        "parent_id": np.concatenate([trunk_parents, branch_parents]),
+        "x": np.concatenate([trunk[:, 0], branch_xyz[:, 0]]),
+        "y": np.concatenate([trunk[:, 1], branch_xyz[:, 1]]),
+        "z": np.concatenate([trunk[:, 2], branch_xyz[:, 2]]),
+        "radius": np.concatenate([rng.uniform(100, 500, size=n_branches), rng.uniform(50, 400, size=len(owner))])
+    })
+
+    return sk.Skeleton(swc)
+
+
+def reference_get_branch_polylines_by_length(skeleton, min_length=1000, max_length=5000, min_nodes=5, max_nodes=30,
+                                             radius_threshold=2000):
+    """
+    The original per-segment implementation, kept to check that the vectorized version returns identical results.
+    """
+
+    polylines = []
+    radii = []
+
+    largest_segment = None
+    for seg in skeleton.get_segments():
+        if largest_segment is None or len(seg) > len(largest_segment):
+            largest_segment = seg
+
+    for seg in skeleton.get_segments():
+        if seg == largest_segment:
+            continue
+
+        if len(seg) < min_nodes or len(seg) > max_nodes:
+            continue
+
+        branch_vertices = skeleton.vertices[seg]
+        branch_edges = np.diff(branch_vertices, axis=0)
+        branch_lengths = np.linalg.norm(branch_edges, axis=1)
+        total_length = np.sum(branch_lengths)
+
+        length_outside_range = total_length < min_length or total_length > max_length
+        last_node_radius_outside_range = skeleton.swc.loc[seg[-1], "radius"] >= radius_threshold
+
+        if length_outside_range or last_node_radius_outside_range:
+            continue
+
+        node_radii = skeleton.swc.loc[seg, "radius"].values
+
+        polylines.append(branch_vertices)
+        radii.append(node_radii)
+
+    return polylines, radii
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--branches", type=int, default=20000, help="Number of side branches in the skeleton")
+    parser.add_argument("--skip-reference", action="store_true", help="Only time the vectorized implementation")
+    args = parser.parse_args()
+
+    skeleton = synthetic_skeleton(args.branches)
+
+    # Same thresholds as MainFormDsb.on_btn_select_preprocessing_file_clicked, except for a finite radius threshold
+    #  so that the radius filter is exercised
+    kwargs = dict(min_length=0, max_length=10000, min_nodes=15, max_nodes=5000, radius_threshold=300)
+
+    _, segments_time = timed(skeleton.get_segments)
+    (polylines, radii), new_time = timed(polyline_utils.get_branch_polylines_by_length, skeleton, **kwargs)
+
+    print(f"Skeleton: {len(skeleton.swc)} nodes, {args.branches} branches, {len(polylines)} selected")
+    print(f"skeleton.get_segments():   {segments_time:8.3f} s")
+    print(f"vectorized:                {new_time:8.3f} s  (one get_segments call, "
+          f"{new_time - segments_time:.3f} s of extraction)")
+
+    if args.skip_reference:
+        return
+
+    (ref_polylines, ref_radii), ref_time = timed(reference_get_branch_polylines_by_length, skeleton, **kwargs)
+    print(f"reference:                 {ref_time:8.3f} s  (two get_segments calls, {ref_time / new_time:.1f}x slower)")
+
+    assert len(polylines) == len(ref_polylines), "Different number of branches selected"
+    for new, ref in zip(polylines, ref_polylines):
+        assert np.array_equal(new, ref), "Polylines differ"
+    for new, ref in zip(radii, ref_radii):
+        assert np.array_equal(new, ref), "Radii differ"
+
+    print("Results are identical")
+
+
+if __name__ == "__main__":
+    main()
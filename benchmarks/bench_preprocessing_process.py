@@ -0,0 +1,121 @@
+"""
+Compares running skeletonization and saving on a thread of the main process (what PreprocessingWorker used to do)
+with childprocess.PreprocessingProcess. While preprocessing runs, the main thread stands in for Dragonfly's UI: it
+wakes up every few milliseconds, and the longest and 99th percentile delays before it gets to run are reported. Also
+checks that both write the same skeleton, how long cancelling takes to stop the child process, and that the child
+process also starts when the code is imported as the plugin package, as Dragonfly imports it.
+
+Run from the repository root with:
+    python -m benchmarks.bench_preprocessing_process
+"""
+
+import argparse
+import importlib
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import make_dendrite
+from pipeline import payload
+from pipeline.preprocessing import childprocess
+from pipeline.preprocessing.skeletonization import skeletonize_mesh
+
+_TICK = 0.005  # s
+
+
+def _measure_ui_delays(work) -> tuple[float, np.ndarray]:
+    """
+    Run work on a thread while ticking on the main thread.
+
+    :return: (total seconds, how late each tick was in ms)
+    """
+
+    thread = threading.Thread(target=work)
+    delays = []
+
+    start = time.perf_counter()
+    thread.start()
+    while thread.is_alive():
+        before = time.perf_counter()
+        time.sleep(_TICK)
+        delays.append((time.perf_counter() - before - _TICK) * 1000)
+
+    thread.join()
+    return time.perf_counter() - start, np.array(delays)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--spines", type=int, default=10, help="Number of spines on the synthetic dendrite")
+    parser.add_argument("--shaft-length", type=float, default=6000, help="Length of the dendrite in nm")
+    parser.add_argument("--voxel-size", type=float, default=20, help="Voxel size of the synthetic ROI in nm")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    dendrite = make_dendrite(n_spines=args.spines, shaft_length=args.shaft_length, voxel_size=args.voxel_size,
+                             seed=args.seed)
+    mesh = dendrite.mesh
+    print(f"{len(mesh.vertices)} vertices, {len(mesh.faces)} faces")
+
+    with tempfile.TemporaryDirectory() as folder:
+        thread_path = os.path.join(folder, "thread.dsb")
+        process_path = os.path.join(folder, "process.dsb")
+
+        def in_thread():
+            skeleton = skeletonize_mesh(mesh)
+            payload.pld_save(payload.Payload(mesh, skeleton, None, None), thread_path)
+
+        def in_process():
+            for _ in childprocess.PreprocessingProcess(mesh, None, None, process_path).progress():
+                pass
+
+        print(f"{'mode':<14} {'seconds':>8} {'max delay ms':>13} {'p99 delay ms':>13}")
+        for name, work in (("thread", in_thread), ("child process", in_process)):
+            seconds, delays = _measure_ui_delays(work)
+            print(f"{name:<14} {seconds:8.2f} {delays.max():13.1f} {np.percentile(delays, 99):13.1f}")
+
+        from_thread = payload.pld_load(thread_path)
+        from_process = payload.pld_load(process_path)
+        assert np.array_equal(from_thread.skeleton.vertices, from_process.skeleton.vertices) and \
+            np.array_equal(from_thread.skeleton.edges, from_process.skeleton.edges), \
+            "The child process wrote a different skeleton"
+        assert np.array_equal(from_thread.dendrite_mesh.faces, from_process.dendrite_mesh.faces), \
+            "The child process wrote a different mesh"
+        print("Both write the same mesh and skeleton")
+
+        cancelled_path = os.path.join(folder, "cancelled.dsb")
+        process = childprocess.PreprocessingProcess(mesh, None, None, cancelled_path)
+        stages = process.progress()
+        next(stages)  # Wait for skeletonization to start
+
+        start = time.perf_counter()
+        process.cancel()
+        try:
+            next(stages)
+        except childprocess.PreprocessingCancelled:
+            pass
+        else:
+            raise AssertionError("Preprocessing was not cancelled")
+
+        assert not os.path.exists(cancelled_path) and not os.path.exists(cancelled_path + ".partial"), \
+            "The cancelled run left a file behind"
+        print(f"Cancelled during skeletonization in {(time.perf_counter() - start) * 1000:.1f} ms, no file written")
+
+        # Inside Dragonfly the child unpickles its entry point from the plugin package, which runs the package's
+        #  __init__ in an interpreter without Dragonfly's modules
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        sys.path.insert(0, os.path.dirname(root))
+        plugin = importlib.import_module(f"{os.path.basename(root)}.pipeline.preprocessing.childprocess")
+
+        plugin_path = os.path.join(folder, "plugin.dsb")
+        stages = list(plugin.PreprocessingProcess(mesh, None, None, plugin_path).progress())
+        assert os.path.exists(plugin_path), "The child process started from the plugin package wrote no file"
+        print(f"The child process started from the plugin package: {', '.join(stages)}")
+
+
+if __name__ == "__main__":
+    main()
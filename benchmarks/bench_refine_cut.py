@@ -0,0 +1,91 @@
+"""
+Measures the cut refinement (NeckParams(refine_cut=True)) on a synthetic dendrite, for the neck points of each
+engine. The neck points are found once, then each spine is cut along the skeleton tangent and along the refined
+plane: how far each cut is tilted from the synthetic spine's axis, how close the head volumes are to the known
+synthetic volumes, and how long the refinement takes per spine.
+
+Run from the repository root with:
+    python -m benchmarks.bench_refine_cut
+"""
+
+import argparse
+import dataclasses
+import time
+
+import numpy as np
+
+from benchmarks.bench_stages import SPINE_FILTER
+from benchmarks.synthetic import make_dendrite
+from pipeline import distance_field
+from pipeline.beheading import polyline_utils, spine_analysis
+from pipeline.preprocessing.skeletonization import skeletonize_mesh
+
+
+def cut_errors(dendrite, cuts) -> tuple[np.ndarray, np.ndarray]:
+    """
+    :param cuts: (cut point, cut normal pointing from the head towards the dendrite) of each spine
+    :return: (tilt of each cut from the closest synthetic spine's axis in degrees, relative error of each head volume)
+    """
+
+    neck_points = np.array([spine.neck_point for spine in dendrite.spines])
+    tilts, errors = [], []
+
+    for point, normal in cuts:
+        spine = dendrite.spines[int(np.argmin(np.linalg.norm(neck_points - point, axis=1)))]
+        cosine = np.dot(normal, -spine.direction) / np.linalg.norm(normal)
+        tilts.append(np.degrees(np.arccos(np.clip(cosine, -1, 1))))
+
+        head = spine_analysis.behead(dendrite.mesh, point, normal)
+        volume = head.volume if head is not None else np.nan
+        errors.append((volume - spine.head_volume) / spine.head_volume)
+
+    return np.array(tilts), np.array(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--spines", type=int, default=20, help="Number of spines on the synthetic dendrite")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--engines", nargs="+", default=list(spine_analysis.ENGINES), choices=spine_analysis.ENGINES,
+                        help="The engines the neck points are found with")
+    parser.add_argument("--max-tilt", type=float, default=spine_analysis.NeckParams.cut_max_tilt)
+    parser.add_argument("--offset", type=float, default=spine_analysis.NeckParams.cut_offset)
+    args = parser.parse_args()
+
+    dendrite = make_dendrite(n_spines=args.spines, seed=args.seed)
+    table = polyline_utils.build_segment_table(skeletonize_mesh(dendrite.mesh))
+    spine_skeletons = [table.polylines[i] for i in table.select(**SPINE_FILTER)]
+
+    distance_field.attach(
+        dendrite.mesh, distance_field.from_mask(dendrite.mask, dendrite.origin, np.eye(3) * dendrite.voxel_size)
+    )
+    _ = dendrite.mesh.faces_unique_edges  # Built once per mesh, so not charged to the first spine
+
+    print(f"{len(spine_skeletons)} spines")
+    print(f"{'engine':<15} {'cut':<16} {'median tilt':>12} {'max tilt':>9} {'median volume err':>18} "
+          f"{'median |volume err|':>20} {'ms per spine':>13}")
+
+    for engine in args.engines:
+        params = spine_analysis.NeckParams(engine=engine)
+        refined = dataclasses.replace(params, refine_cut=True, cut_max_tilt=args.max_tilt, cut_offset=args.offset)
+
+        tangent_cuts, refined_cuts, seconds = [], [], []
+        for spine_skeleton in spine_skeletons:
+            point, tangent, point_1d = spine_analysis.compute_neck_point_and_tangent(
+                spine_skeleton, dendrite.mesh, params
+            )
+            tangent_cuts.append((point, tangent))
+
+            start = time.perf_counter()
+            refined_point, normal, _ = spine_analysis.refine_cut(spine_skeleton, dendrite.mesh, point_1d, refined)
+            seconds.append(time.perf_counter() - start)
+            refined_cuts.append((refined_point, normal))
+
+        for name, cuts, ms in (("skeleton tangent", tangent_cuts, ""),
+                               ("refined", refined_cuts, f"{np.median(seconds) * 1000:.0f}")):
+            tilts, errors = cut_errors(dendrite, cuts)
+            print(f"{engine:<15} {name:<16} {np.median(tilts):12.1f} {tilts.max():9.1f} "
+                  f"{np.nanmedian(errors):18.1%} {np.nanmedian(np.abs(errors)):20.1%} {ms:>13}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Exercises the local analysis service (pipeline/service.py) with stand-in clients, on a synthetic dendrite. A first
+session asks for neck points while the service loads the file, a second session asks for the same ones warm, and both
+are compared with a new session computing everything in process. Checks the answers against the in-process ones, and
+that requests fall back to the in-process path once the service is stopped.
+
+Neck points are computed in adaptive mode, whose rays come from fixed direction sets, so the service's neck points must
+be exactly the in-process ones. The default mode measures the head radius with a randomized sphere of rays, so neck
+points computed twice there can differ by tens of nm.
+
+Run from the repository root with:
+    python -m benchmarks.bench_service
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from benchmarks.bench_stages import SPINE_FILTER
+from benchmarks.synthetic import make_dendrite
+from pipeline import payload, service
+from pipeline.beheading import bulk, polyline_utils, profile_cache, spine_analysis
+from pipeline.preprocessing.skeletonization import skeletonize_mesh
+
+
+def local_session(path: str, spine_indices, params) -> tuple[float, list]:
+    """
+    What a session without the service does: load the file and compute the neck points.
+
+    :return: (seconds, neck points)
+    """
+
+    start = time.perf_counter()
+    pld = payload.pld_load(path)
+    skeletons = polyline_utils.build_segment_table(pld.skeleton).polylines
+    with profile_cache.ProfileCache(profile_cache.payload_hash(path), profile_cache.sidecar_path_for_payload(path)) \
+            as cache:
+        necks = []
+        for idx in spine_indices:
+            points, radii = cache.get_or_compute(
+                idx, params, lambda: spine_analysis.radius_profile(skeletons[idx], pld.dendrite_mesh, params)
+            )
+            necks.append(
+                spine_analysis.neck_point_from_profile(skeletons[idx], pld.dendrite_mesh, points, radii, params)
+            )
+
+    return time.perf_counter() - start, necks
+
+
+def service_session(info_file: str, path: str, spine_indices, params) -> tuple[float, list]:
+    """
+    What a session with the service does: ask it for the neck points.
+
+    :return: (seconds, neck points)
+    """
+
+    start = time.perf_counter()
+    client = service.ServiceClient.connect(info_file)
+    assert client is not None, "Could not connect to the service"
+
+    digest = profile_cache.payload_hash(path)
+    necks = [client.neck_point(path, digest, idx, params) for idx in spine_indices]
+    client.close()
+
+    return time.perf_counter() - start, necks
+
+
+def assert_same_necks(expected: list, actual: list) -> None:
+    for (point, tangent, point_1d), (other_point, other_tangent, other_point_1d) in zip(expected, actual):
+        assert point_1d == other_point_1d and np.array_equal(point, other_point) \
+            and np.array_equal(tangent, other_tangent), "The service gave a different neck point"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--spines", type=int, default=10, help="Number of spines on the synthetic dendrite")
+    parser.add_argument("--shaft-length", type=float, default=6000, help="Length of the dendrite in nm")
+    parser.add_argument("--voxel-size", type=float, default=20, help="Voxel size of the synthetic ROI in nm")
+    parser.add_argument("--necks", type=int, default=5, help="Number of spines to ask for neck points")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    dendrite = make_dendrite(n_spines=args.spines, shaft_length=args.shaft_length, voxel_size=args.voxel_size,
+                             seed=args.seed)
+    params = spine_analysis.NeckParams(adaptive=True)
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "dendrite.dsb")
+        payload.pld_save(payload.Payload(dendrite.mesh, skeletonize_mesh(dendrite.mesh), None, None), path)
+
+        table = polyline_utils.build_segment_table(payload.pld_load(path).skeleton)
+        spine_indices = [int(idx) for idx in table.select(**SPINE_FILTER)[:args.necks]]
+        print(f"{len(dendrite.mesh.faces)} faces, asking for {len(spine_indices)} neck points")
+
+        # Without a sidecar, so that the local session computes every profile
+        in_process_seconds, expected = local_session(path, spine_indices, params)
+        os.remove(profile_cache.sidecar_path_for_payload(path))
+
+        info_file = os.path.join(folder, "service.json")
+        analysis_service = service.Service()
+        server = service.ServiceServer(analysis_service, info_file=info_file)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        first_seconds, first = service_session(info_file, path, spine_indices, params)
+        second_seconds, second = service_session(info_file, path, spine_indices, params)
+        warm_local_seconds, _ = local_session(path, spine_indices, params)
+        assert_same_necks(expected, first)
+        assert_same_necks(first, second)
+
+        print(f"{'session':<40} {'seconds':>8}")
+        print(f"{'in process, nothing cached':<40} {in_process_seconds:8.2f}")
+        print(f"{'first session through the service':<40} {first_seconds:8.2f}")
+        print(f"{'second session through the service':<40} {second_seconds:8.2f}")
+        print(f"{'in process, profiles cached in sidecar':<40} {warm_local_seconds:8.2f}")
+
+        mesh = payload.pld_load(path).dendrite_mesh
+        client = service.ServiceClient.connect(info_file)
+        digest = profile_cache.payload_hash(path)
+        for idx, (neck_point, neck_tangent, _) in zip(spine_indices, expected):
+            accepted = bulk.AcceptedHead(idx, str(idx + 1), neck_point, neck_tangent)
+            local = bulk.behead(mesh, accepted)
+            remote = client.head_mesh(path, digest, accepted)
+            volume = client.head_volume(path, digest, accepted)
+
+            if local is None:
+                assert remote is None and volume is None, "The service found a head where there is none"
+                continue
+
+            assert np.array_equal(local.vertices, remote.vertices) and np.array_equal(local.faces, remote.faces), \
+                "The service gave a different head mesh"
+            assert local.volume == remote.volume == volume[0], "The service gave a different head volume"
+        print("Neck points, head meshes and head volumes from the service match the in-process ones")
+
+        server.close()
+        analysis_service.close()
+        client.close()
+        assert not os.path.exists(info_file), "The service left its connection details behind"
+
+        # A client whose service went away falls back to computing in process
+        idx = spine_indices[0]
+        fallback = service.call_or_fallback(
+            client, lambda c: c.neck_point(path, digest, idx, params),
+            lambda: spine_analysis.compute_neck_point_and_tangent(table.polylines[idx], mesh, params)
+        )
+        assert_same_necks(expected[:1], [fallback])
+        assert service.ServiceClient.connect(info_file) is None, "Connected to a stopped service"
+        print("Requests fall back to the in-process path once the service stops")
+
+
+if __name__ == "__main__":
+    main()
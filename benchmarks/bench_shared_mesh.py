@@ -0,0 +1,141 @@
+"""
+Compares the ways of giving worker processes the dendrite mesh: pickling it (what sending it with every task costs),
+loading the .dsb file in each worker (what neck_sweep.py used to do), and attaching to a shared_mesh.SharedMesh.
+Workers are started with the spawn method, as on Windows, so that nothing is inherited from the parent. Also checks
+that a worker attached to the shared mesh computes the same volume and radius profile as the parent.
+
+Run from the repository root with:
+    python -m benchmarks.bench_shared_mesh
+"""
+
+import argparse
+import multiprocessing
+import os
+import pickle
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from benchmarks.synthetic import make_dendrite
+from pipeline import payload, shared_mesh
+from pipeline.beheading import spine_analysis
+
+
+def private_mb() -> float | None:
+    """
+    The memory of this process that is not shared with any other process, or None where /proc is not available.
+    """
+
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+    except OSError:
+        return None
+
+    return sum(int(fields[name].split()[0]) for name in ("Private_Clean", "Private_Dirty")) / 1024
+
+
+def _mesh_private_mb(mesh, before: float | None) -> float | None:
+    """
+    The private memory a worker gained by getting the mesh, after reading every page of its vertices and faces but
+    before computing anything from them.
+    """
+
+    mesh.vertices.sum()
+    mesh.faces.sum()
+    return private_mb() - before if before is not None else None
+
+
+def _load_task(path: str) -> dict:
+    before = private_mb()
+    start = time.perf_counter()
+    mesh = payload.pld_load(path).dendrite_mesh
+    elapsed = time.perf_counter() - start
+
+    return {"seconds": elapsed, "private_mb": _mesh_private_mb(mesh, before), "volume": mesh.volume}
+
+
+def _unpickle_task(data: bytes) -> dict:
+    before = private_mb()
+    start = time.perf_counter()
+    mesh = pickle.loads(data)
+    elapsed = time.perf_counter() - start
+
+    return {"seconds": elapsed, "private_mb": _mesh_private_mb(mesh, before), "volume": mesh.volume}
+
+
+def _attach_task(task) -> dict:
+    handle, skeleton = task
+
+    before = private_mb()
+    start = time.perf_counter()
+    mesh, _ = shared_mesh.attach(handle)
+    elapsed = time.perf_counter() - start
+
+    return {"seconds": elapsed, "private_mb": _mesh_private_mb(mesh, before), "volume": mesh.volume,
+            "profile": spine_analysis.radius_profile(skeleton, mesh)}
+
+
+def in_worker(function, argument) -> dict:
+    """
+    Runs a function in a fresh spawned worker process, after importing the modules it needs there, so that only the
+    work itself is measured.
+    """
+
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        executor.submit(private_mb).result()
+        return executor.submit(function, argument).result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--spines", type=int, default=20, help="Number of spines on the synthetic dendrite")
+    parser.add_argument("--shaft-length", type=float, default=12000, help="Length of the dendrite in nm")
+    parser.add_argument("--voxel-size", type=float, default=15, help="Voxel size of the synthetic ROI in nm")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    dendrite = make_dendrite(n_spines=args.spines, shaft_length=args.shaft_length, voxel_size=args.voxel_size,
+                             seed=args.seed)
+    mesh = dendrite.mesh
+    print(f"{len(mesh.vertices)} vertices, {len(mesh.faces)} faces")
+
+    start = time.perf_counter()
+    pickled = pickle.dumps(mesh)
+    pickle_time = time.perf_counter() - start
+
+    # A spine skeleton to ray cast against: the line from the base of the first spine to its head center
+    spine = dendrite.spines[0]
+    skeleton = np.linspace(spine.base, spine.head_center, 40)
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "dendrite.dsb")
+        payload.pld_save(payload.Payload(mesh, None, None, None), path)
+
+        loaded = in_worker(_load_task, path)
+        unpickled = in_worker(_unpickle_task, pickled)
+
+        start = time.perf_counter()
+        with shared_mesh.SharedMesh(mesh) as shared:
+            share_time = time.perf_counter() - start
+            shared_mb = shared.nbytes / 1024 ** 2
+            attached = in_worker(_attach_task, (shared.handle, skeleton))
+
+    print(f"Pickled mesh: {len(pickled) / 1024 ** 2:.1f} MB, {pickle_time:.3f} s to pickle in the parent")
+    print(f"Shared mesh: {shared_mb:.1f} MB, {share_time:.3f} s to copy into shared memory once")
+    print(f"{'per worker':<18} {'seconds':>8} {'private MB':>11}")
+    for name, result in (("load .dsb", loaded), ("unpickle", unpickled), ("attach shared", attached)):
+        private = f"{result['private_mb']:11.1f}" if result["private_mb"] is not None else f"{'n/a':>11}"
+        print(f"{name:<18} {result['seconds']:8.3f} {private}")
+
+    points, radii = spine_analysis.radius_profile(skeleton, mesh)
+    assert attached["volume"] == mesh.volume, "The attached mesh has a different volume"
+    assert np.array_equal(attached["profile"][0], points) and np.array_equal(attached["profile"][1], radii), \
+        "The attached mesh gives a different radius profile"
+    print("The attached mesh gives the same volume and radius profile as the parent")
+
+
+if __name__ == "__main__":
+    main()
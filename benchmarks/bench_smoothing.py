@@ -0,0 +1,114 @@
+"""
+Benchmark and equivalence check for spine_analysis.smooth / smooth_batch against the scikit-learn
+PolynomialFeatures -> StandardScaler -> Ridge pipeline they replace. Requires scikit-learn.
+
+Run from the repository root with:
+    python -m benchmarks.bench_smoothing
+"""
+
+import argparse
+import time
+
+import numpy as np
+from sklearn.linear_model import Ridge
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import PolynomialFeatures, StandardScaler
+
+from pipeline.beheading import spine_analysis
+
+# The parameters used by find_neck_point_from_head_radius
+DEGREE = 15
+ALPHA = 0.001
+X_POINTS = 600
+
+
+def synthetic_profiles(n_spines: int, spacing: float = 6, seed: int = 0) -> tuple[list[np.ndarray], list[np.ndarray]]:
+    """
+    Builds radius profiles shaped like the ones measured along a spine skeleton (head first, then neck, then shaft),
+    with noise.
+
+    :param n_spines: The number of profiles
+    :param spacing: The distance between samples in nm, as in path_interpolation_spacing
+    :param seed: The random seed
+    :return: (cumulative distance of each sample, radius of each sample) for each profile
+    """
+
+    rng = np.random.default_rng(seed)
+    xs, ys = [], []
+
+    for _ in range(n_spines):
+        length = rng.uniform(600, 4000)
+        x = np.arange(spacing, length, spacing)
+
+        head_center = rng.uniform(0.1, 0.3) * length
+        head_radius = rng.uniform(150, 400)
+        neck_radius = rng.uniform(40, 100)
+        shaft_start = rng.uniform(0.7, 0.9) * length
+
+        y = neck_radius + head_radius * np.exp(-((x - head_center) / head_radius) ** 2)
+        y += 400 / (1 + np.exp(-(x - shaft_start) / 60))
+        y += rng.normal(scale=15, size=len(x))
+
+        xs.append(x)
+        ys.append(y)
+
+    return xs, ys
+
+
+def reference_smooth(x, y, x_points: int, degree: int, alpha: float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    The original scikit-learn implementation of spine_analysis.smooth with an integer x_points.
+    """
+
+    ridge_poly = make_pipeline(PolynomialFeatures(degree), StandardScaler(), Ridge(alpha=alpha))
+    x_points = np.linspace(x[0], x[-1], x_points)
+    ridge_poly.fit(x.reshape(-1, 1), y)
+
+    return x_points, ridge_poly.predict(x_points.reshape(-1, 1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--spines", type=int, default=300, help="Number of radius profiles")
+    args = parser.parse_args()
+
+    xs, ys = synthetic_profiles(args.spines)
+
+    start = time.perf_counter()
+    reference = [reference_smooth(x, y, X_POINTS, DEGREE, ALPHA) for x, y in zip(xs, ys)]
+    reference_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    single = [spine_analysis.smooth(x, y, x_points=X_POINTS, degree=DEGREE, alpha=ALPHA) for x, y in zip(xs, ys)]
+    single_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch_x, batch_y = spine_analysis.smooth_batch(xs, ys, x_points=X_POINTS, degree=DEGREE, alpha=ALPHA)
+    batch_time = time.perf_counter() - start
+
+    print(f"{args.spines} profiles, {min(map(len, xs))}-{max(map(len, xs))} samples each")
+    print(f"scikit-learn pipeline per spine: {reference_time:8.3f} s")
+    print(f"NumPy per spine:                 {single_time:8.3f} s  ({reference_time / single_time:.1f}x faster)")
+    print(f"NumPy batched:                   {batch_time:8.3f} s  ({reference_time / batch_time:.1f}x faster)")
+
+    max_rel_error = 0.0
+    peak_mismatches = 0
+    for (ref_x, ref_y), (x, y), b_x, b_y in zip(reference, single, batch_x, batch_y):
+        assert np.allclose(ref_x, x) and np.allclose(ref_x, b_x), "Evaluation points differ"
+
+        scale = np.abs(ref_y).max()
+        max_rel_error = max(max_rel_error, np.abs(ref_y - y).max() / scale, np.abs(ref_y - b_y).max() / scale)
+
+        peaks = {spine_analysis.rightmost_local_max_idx(profile) for profile in (ref_y, y, b_y)}
+        if len(peaks) != 1:
+            peak_mismatches += 1
+
+    print(f"Largest difference from scikit-learn, relative to the profile maximum: {max_rel_error:.2e}")
+    print(f"Profiles with a different rightmost_local_max_idx: {peak_mismatches} / {args.spines}")
+
+    assert max_rel_error < 1e-6, "Smoothed profiles differ from the scikit-learn pipeline"
+    assert peak_mismatches == 0, "Peak locations differ from the scikit-learn pipeline"
+
+
+if __name__ == "__main__":
+    main()
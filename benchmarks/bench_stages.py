@@ -0,0 +1,238 @@
+"""
+Per-stage time and memory benchmark of the DSB pipeline on a synthetic dendrite. Runs headlessly (no Dragonfly, no
+display) and writes the results as JSON so runs can be compared across commits and machines.
+
+Stages: skeletonize, branch extraction, radius profiling, neck detection, beheading, payload save and payload load.
+Each stage records wall time, CPU time and how much the process peak RSS grew during the stage. With --tracemalloc
+it also records the peak of Python-tracked allocations (which include NumPy arrays), at a large cost in speed. Head
+volumes are also checked against the known synthetic volumes.
+
+Run from the repository root with:
+    python -m benchmarks.bench_stages --output bench.json
+    python -m benchmarks.bench_stages --compare bench.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+
+from benchmarks.synthetic import make_dendrite
+from pipeline import payload
+from pipeline.beheading import polyline_utils, spine_analysis
+from pipeline.preprocessing.skeletonization import skeletonize_mesh
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# The default thresholds of the spine filter in the beheading tab
+SPINE_FILTER = dict(min_length=0, max_length=10000, min_nodes=15, max_nodes=5000, radius_threshold=np.inf)
+
+
+def peak_rss_mb() -> float | None:
+    if resource is None:
+        return None
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1 / 1024 ** 2 if sys.platform == "darwin" else 1 / 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+@contextmanager
+def stage(stages: dict, name: str, **extra):
+    """
+    Records the wall time, CPU time and memory use of the code in the `with` block under stages[name].
+    """
+
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+
+    rss_start = peak_rss_mb()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    yield
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+
+    rss_end = peak_rss_mb()
+
+    stages[name] = {
+        "wall_s": wall,
+        "cpu_s": cpu,
+        "py_peak_mb": tracemalloc.get_traced_memory()[1] / 1024 ** 2 if tracemalloc.is_tracing() else None,
+        "peak_rss_mb": rss_end,
+        "peak_rss_growth_mb": rss_end - rss_start if rss_end is not None else None,
+        **extra
+    }
+    print(f"  {name:<20} {wall:8.3f} s wall {cpu:8.3f} s cpu", flush=True)
+
+
+def head_volume_accuracy(dendrite, heads) -> dict:
+    """
+    Matches each beheaded head to the synthetic spine whose head center is closest to its centroid and compares the
+    volumes.
+    """
+
+    centers = np.array([spine.head_center for spine in dendrite.spines])
+    errors = []
+    matched = set()
+
+    for head in heads:
+        if head is None:
+            continue
+
+        dists = np.linalg.norm(centers - head.centroid, axis=1)
+        idx = int(np.argmin(dists))
+        spine = dendrite.spines[idx]
+        if dists[idx] > spine.head_radius:
+            continue
+
+        matched.add(idx)
+        errors.append((head.volume - spine.head_volume) / spine.head_volume)
+
+    errors = np.abs(errors)
+    return {
+        "spines": len(dendrite.spines),
+        "matched_spines": len(matched),
+        "median_abs_volume_error": float(np.median(errors)) if len(errors) else None,
+        "mean_abs_volume_error": float(np.mean(errors)) if len(errors) else None,
+    }
+
+
+def run(args) -> dict:
+    stages = {}
+
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    print(f"Generating a dendrite with {args.spines} spines")
+    with stage(stages, "generate"):
+        dendrite = make_dendrite(n_spines=args.spines, voxel_size=args.voxel_size, seed=args.seed)
+
+    mesh = dendrite.mesh
+
+    with stage(stages, "skeletonize", vertices=len(mesh.vertices), faces=len(mesh.faces)):
+        skeleton = skeletonize_mesh(mesh)
+
+    with stage(stages, "branch_extraction"):
+        table = polyline_utils.build_segment_table(skeleton)
+        selected = table.select(**SPINE_FILTER)
+
+    spine_skeletons = [table.polylines[i] for i in selected]
+
+    # The two halves of spine_analysis.compute_neck_point_and_tangent, timed separately
+    with stage(stages, "radius_profiling", spines=len(spine_skeletons)):
+        profiles = spine_analysis.radius_profiles(spine_skeletons, mesh)
+
+    with stage(stages, "neck_detection", spines=len(spine_skeletons)):
+        necks = [
+            spine_analysis.neck_point_from_profile(spine_skeleton, mesh, points, radii)
+            for spine_skeleton, (points, radii) in zip(spine_skeletons, profiles)
+        ]
+
+    with stage(stages, "beheading", spines=len(spine_skeletons)):
+        heads = [spine_analysis.behead(mesh, point, tangent) for point, tangent, _ in necks]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "synthetic.dsb")
+        pld = payload.Payload(dendrite_mesh=mesh, skeleton=skeleton, annotations=None, psds=None)
+
+        with stage(stages, "payload_save"):
+            payload.pld_save(pld, path)
+
+        size_mb = os.path.getsize(path) / 1024 ** 2
+
+        with stage(stages, "payload_load", file_mb=size_mb):
+            payload.pld_load(path)
+
+    tracemalloc.stop()
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "spines": args.spines,
+            "voxel_size": args.voxel_size,
+            "seed": args.seed,
+            "tracemalloc": args.tracemalloc,
+        },
+        "stages": stages,
+        "accuracy": head_volume_accuracy(dendrite, heads),
+    }
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list[str]:
+    """
+    Prints the wall time ratio of each stage against a baseline run.
+
+    :return: The stages that got slower by more than `tolerance` (a fraction)
+    """
+
+    regressions = []
+    print(f"{'stage':<20} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for name, current in result["stages"].items():
+        if name not in baseline["stages"]:
+            continue
+
+        before = baseline["stages"][name]["wall_s"]
+        ratio = current["wall_s"] / before if before > 0 else float("inf")
+        flag = " <-- slower" if ratio > 1 + tolerance else ""
+        print(f"{name:<20} {before:9.3f}s {current['wall_s']:9.3f}s {ratio:6.2f}x{flag}")
+
+        if flag:
+            regressions.append(name)
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--spines", type=int, default=20, help="Number of spines on the synthetic dendrite")
+    parser.add_argument("--voxel-size", type=float, default=20, help="Voxel size of the synthetic ROI in nm")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tracemalloc", action="store_true",
+                        help="Also record peak Python allocations per stage. Makes most stages several times slower.")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="A previous JSON result to compare wall times against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Fail if a stage is more than this fraction slower than in --compare")
+    args = parser.parse_args()
+
+    result = run(args)
+
+    accuracy = result["accuracy"]
+    error = accuracy["median_abs_volume_error"]
+    print(f"Matched {accuracy['matched_spines']} / {accuracy['spines']} spines, "
+          f"median head volume error {f'{error:.1%}' if error is not None else 'n/a (no heads matched)'}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+        for key in ("spines", "voxel_size", "seed"):
+            if baseline["meta"].get(key) != result["meta"][key]:
+                print(f"Warning: the baseline used {key}={baseline['meta'].get(key)}, this run used "
+                      f"{key}={result['meta'][key]}")
+
+        if regressions := compare(result, baseline, args.tolerance):
+            sys.exit(f"Slower than baseline: {', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+Compares head volumes counted from the voxels of the distance field (DistanceField.head_volume) with head volumes from
+slicing the mesh (spine_analysis.behead) on a synthetic dendrite, cutting each spine where its neck meets its head:
+wall time, how far apart the two volumes are, and how close each is to the known synthetic volume. Also checks that
+heads beheaded by the bulk save worker processes carry the voxel volume.
+
+Run from the repository root with:
+    python -m benchmarks.bench_voxel_volume
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import make_dendrite
+from pipeline import distance_field
+from pipeline.beheading import bulk, spine_analysis
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--spines", type=int, default=20, help="Number of spines on the synthetic dendrite")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    dendrite = make_dendrite(n_spines=args.spines, seed=args.seed)
+    field = distance_field.from_mask(dendrite.mask, dendrite.origin, np.eye(3) * dendrite.voxel_size)
+    distance_field.attach(dendrite.mesh, field)
+
+    cuts = [(spine.neck_point, -spine.direction) for spine in dendrite.spines]
+    truth = np.array([spine.head_volume for spine in dendrite.spines])
+
+    start = time.perf_counter()
+    mesh_volumes = np.array([spine_analysis.behead(dendrite.mesh, *cut).volume for cut in cuts])
+    mesh_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    voxel_volumes = np.array([field.head_volume(*cut)[0] for cut in cuts])
+    voxel_seconds = time.perf_counter() - start
+
+    # Heads that run into a neighbouring spine or the shaft aren't the synthetic sphere, for either measurement
+    isolated = np.abs(mesh_volumes - truth) / truth < 0.2
+    apart = np.abs(voxel_volumes - mesh_volumes) / mesh_volumes
+
+    print(f"{len(cuts)} heads, {isolated.sum()} isolated from the rest of the dendrite")
+    print(f"{'measurement':<12} {'seconds':>8} {'median err vs synthetic (isolated)':>35}")
+    for name, seconds, volumes in (("mesh", mesh_seconds, mesh_volumes), ("voxels", voxel_seconds, voxel_volumes)):
+        error = np.median(np.abs(volumes[isolated] - truth[isolated]) / truth[isolated])
+        print(f"{name:<12} {seconds:8.2f} {error:35.1%}")
+    print(f"Voxel vs mesh volume: median {np.median(apart):.2%}, max {apart.max():.2%}")
+
+    accepted = [bulk.AcceptedHead(i, str(i + 1), *cut) for i, cut in enumerate(cuts)]
+    heads = [head for batch in bulk.behead_many(dendrite.mesh, accepted, workers=2) for _, head in batch]
+    carried = all(
+        head is not None and head.voxel_volume == volume and head.result("synthetic").head_vol_voxels == volume / 1e9
+        for head, volume in zip(heads, voxel_volumes)
+    )
+    print(f"Heads from the bulk save workers carry the voxel volume: {carried}")
+
+    if not carried:
+        sys.exit("The bulk save lost the voxel head volumes")
+
+
+if __name__ == "__main__":
+    main()
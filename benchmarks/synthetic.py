@@ -0,0 +1,131 @@
+"""
+Synthetic dendrites with known spine geometry, for benchmarks and accuracy checks that don't need real data.
+
+The dendrite is built the same way preprocessing builds real data: a voxel mask (the "ROI") is turned into a surface
+with marching cubes. The mask is the union of a cylindrical shaft, a capsule for each spine neck and a sphere for
+each spine head, so the true head volume is known analytically.
+"""
+
+import math
+from dataclasses import dataclass
+
+import numpy as np
+import trimesh
+from skimage.measure import marching_cubes
+
+
+@dataclass(frozen=True)
+class SyntheticSpine:
+    base: np.ndarray  # Point on the shaft surface where the neck starts, in nm
+    direction: np.ndarray  # Unit vector from the shaft axis out along the spine
+    neck_length: float  # Length of the neck from the shaft surface to the head surface, in nm
+    neck_radius: float  # nm
+    head_radius: float  # nm
+
+    @property
+    def head_center(self) -> np.ndarray:
+        return self.base + self.direction * (self.neck_length + self.head_radius)
+
+    @property
+    def neck_point(self) -> np.ndarray:
+        """The point where the neck meets the head, which is where the ideal cut is."""
+        return self.base + self.direction * self.neck_length
+
+    @property
+    def head_volume(self) -> float:
+        """The volume of the head sphere in nm³."""
+        return 4 / 3 * math.pi * self.head_radius ** 3
+
+
+@dataclass(frozen=True)
+class SyntheticDendrite:
+    mesh: trimesh.Trimesh
+    mask: np.ndarray  # The boolean voxel mask the mesh was built from, indexed [x, y, z]
+    origin: np.ndarray  # The position of voxel [0, 0, 0] in nm
+    voxel_size: float  # nm
+    shaft_radius: float  # nm
+    spines: list[SyntheticSpine]
+
+
+def _paint_capsule(mask, origin, voxel_size, start, end, radius):
+    """Sets the voxels within `radius` of the segment from `start` to `end`, only touching its bounding box."""
+
+    lo = np.floor((np.minimum(start, end) - radius - origin) / voxel_size).astype(int).clip(0)
+    hi = np.ceil((np.maximum(start, end) + radius - origin) / voxel_size).astype(int).clip(None, np.array(mask.shape) - 1)
+
+    axes = [origin[i] + np.arange(lo[i], hi[i] + 1) * voxel_size for i in range(3)]
+    points = np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1)
+
+    segment = end - start
+    t = np.zeros(points.shape[:-1])
+    if np.dot(segment, segment) > 0:
+        t = np.clip((points - start) @ segment / np.dot(segment, segment), 0, 1)
+
+    dist = np.linalg.norm(points - (start + t[..., np.newaxis] * segment), axis=-1)
+    mask[lo[0]:hi[0] + 1, lo[1]:hi[1] + 1, lo[2]:hi[2] + 1] |= dist <= radius
+
+
+def make_dendrite(n_spines: int = 20, shaft_length: float = 12000, shaft_radius: float = 450,
+                  neck_length: tuple[float, float] = (300, 900), neck_radius: tuple[float, float] = (60, 110),
+                  head_radius: tuple[float, float] = (200, 400), voxel_size: float = 20,
+                  seed: int = 0) -> SyntheticDendrite:
+    """
+    Builds a straight dendrite shaft along the x-axis with spines sticking out of it in random directions. Spine
+    parameters are drawn uniformly from the given (min, max) ranges.
+
+    :param n_spines: The number of spines
+    :param shaft_length: The length of the shaft in nm
+    :param shaft_radius: The radius of the shaft in nm
+    :param neck_length: The range of neck lengths in nm
+    :param neck_radius: The range of neck radii in nm
+    :param head_radius: The range of head radii in nm
+    :param voxel_size: The voxel size of the mask the mesh is built from in nm
+    :param seed: The random seed
+    :return: The synthetic dendrite
+    """
+
+    rng = np.random.default_rng(seed)
+
+    # Spread the spines evenly along the shaft, leaving room at the ends
+    xs = np.linspace(0.1, 0.9, n_spines) * shaft_length
+    angles = rng.uniform(0, 2 * np.pi, n_spines)
+
+    spines = []
+    for x, angle in zip(xs, angles):
+        direction = np.array([0, np.cos(angle), np.sin(angle)])
+        spines.append(SyntheticSpine(
+            base=np.array([x, 0, 0]) + direction * shaft_radius,
+            direction=direction,
+            neck_length=rng.uniform(*neck_length),
+            neck_radius=rng.uniform(*neck_radius),
+            head_radius=rng.uniform(*head_radius)
+        ))
+
+    reach = shaft_radius + neck_length[1] + 2 * head_radius[1]
+    margin = 3 * voxel_size
+    origin = np.array([-margin, -reach - margin, -reach - margin])
+    extent = np.array([shaft_length + 2 * margin, 2 * (reach + margin), 2 * (reach + margin)])
+    mask = np.zeros(np.ceil(extent / voxel_size).astype(int), dtype=bool)
+
+    _paint_capsule(mask, origin, voxel_size, np.array([0.0, 0, 0]), np.array([shaft_length, 0, 0]), shaft_radius)
+    for spine in spines:
+        # The neck starts inside the shaft so that it is connected to it
+        _paint_capsule(mask, origin, voxel_size, spine.base - spine.direction * shaft_radius / 2, spine.head_center,
+                       spine.neck_radius)
+        _paint_capsule(mask, origin, voxel_size, spine.head_center, spine.head_center, spine.head_radius)
+
+    # The shaft ends are flat, like a cropped ROI
+    first, last = int(np.ceil(margin / voxel_size)), int((margin + shaft_length) / voxel_size)
+    mask[:first] = False
+    mask[last + 1:] = False
+
+    vertices, faces, _, _ = marching_cubes(np.pad(mask, 1).astype(np.float32), level=0.5)
+    vertices = (vertices - 1) * voxel_size + origin
+
+    mesh = trimesh.Trimesh(vertices=vertices, faces=faces)
+    trimesh.smoothing.filter_laplacian(mesh, lamb=0.3, iterations=2)  # Like laplacianSmooth in roi_to_mesh
+    mesh.fix_normals()
+
+    return SyntheticDendrite(
+        mesh=mesh, mask=mask, origin=origin, voxel_size=voxel_size, shaft_radius=shaft_radius, spines=spines
+    )
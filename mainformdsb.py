@@ -1,27 +1,42 @@
 import math
 import os
-from typing import Optional
+import threading
+import traceback
+from typing import Optional, TYPE_CHECKING
 
 import ORSModel
 from OrsHelpers.viewLayoutHelper import DisplayLayoutHelper
 import numpy as np
-from scipy.spatial import KDTree
-import trimesh
 from OrsLibraries.workingcontext import WorkingContext
 from ORSServiceClass.windowclasses.orsabstractwindow import OrsAbstractWindow
-from PyQt6.QtCore import pyqtSlot
+from PyQt6.QtCore import QCoreApplication, pyqtSignal, pyqtSlot
 from PyQt6.QtWidgets import QFileDialog
 
 from .pipeline.preprocessing.preprocessingworker import PreprocessingWorker
-from .pipeline.beheading import skel_helper, spine_analysis, polyline_utils
+from .pipeline.beheading import spine_analysis, polyline_utils, profile_cache, bulk, confidence
+from .pipeline.beheading.beheadingworker import BeheadingWorker, Task
+from .pipeline.beheading.bulksaveworker import BulkSaveWorker
+from .pipeline.beheading.scoringworker import ScoringWorker
 from .pipeline.preprocessing import meshhelper
 from .pipeline.beheading import geometry as geom
 from .pipeline import payload
+from .pipeline import results
+from .pipeline import service
+from .pipeline import telemetry
 from .ui_mainformdsb import Ui_MainFormDsb
-from .visualize import visualize as vis
+
+# trimesh, scipy, pyvista and vtk take seconds to import, so they are only imported once the beheading tab needs them.
+#  This keeps opening the plugin window fast for users who only run preprocessing.
+if TYPE_CHECKING:
+    import trimesh
+    from pyvistaqt import QtInteractor
+    from scipy.spatial import KDTree
 
 
 class MainFormDsb(OrsAbstractWindow):
+    stage_recorded: pyqtSignal = pyqtSignal(object)  # telemetry.StageRecord, from any thread
+    service_connected: pyqtSignal = pyqtSignal(object)  # service.ServiceClient or None, from the connecting thread
+
     def __init__(self, implementation, parent=None):
         super().__init__(implementation, parent)
         self.ui = Ui_MainFormDsb()
@@ -36,21 +51,94 @@ class MainFormDsb(OrsAbstractWindow):
         self.ui.chk_vis_annotations.stateChanged.connect(self.on_chk_vis_annotations_stateChanged)
         self.ui.chk_vis_multiroi.stateChanged.connect(self.on_chk_vis_multiroi_stateChanged)
 
+        for spin_box in self.spine_filter_spin_boxes():
+            spin_box.valueChanged.connect(self.apply_spine_filter)
+        self.ui.chk_review_only.stateChanged.connect(self.apply_spine_filter)
+
         self.ui.sldr_neck_point.setMaximum(1000)
         WorkingContext.registerOrsWidget('DSB_efd060071a1711f0b40cf83441a96bd5', implementation, 'MainFormDsb', self)
-        self.mesh: Optional[trimesh.Trimesh] = None
+        self.mesh: Optional["trimesh.Trimesh"] = None
+        self.vis_widget: Optional["QtInteractor"] = None  # Created the first time a preprocessing file is loaded
         self.visualizer = None
-        self.spine_skeletons = None
-        self.neck_point_slider_values = []
-        self.annotations_kdtree: Optional[KDTree] = None
+        self.segment_table: Optional[polyline_utils.SegmentTable] = None
+        self.spine_skeletons = None  # The polyline of every skeleton segment, indexed by segment index
+        self.spine_indices = np.empty(0, dtype=np.int64)  # Segment indices of the spines that pass the filter
+        self.spine_pos: Optional[int] = None  # Position in spine_indices of the spine being visualized
+        self.neck_point_slider_values: dict[int, int] = {}  # Keyed by segment index
+        self.neck_cuts: dict[int, tuple[np.ndarray, np.ndarray]] = {}  # (point, normal) of each spine's cut
+        self.annotations_kdtree: Optional["KDTree"] = None
         self.annotations = []
         self.neck_pt_3d: Optional[np.ndarray] = None
         self.neck_pt_tangent: Optional[np.ndarray] = None
         self.worker: Optional[PreprocessingWorker] = None
+        self.dataset_name: Optional[str] = None
+        self.results_store: Optional[results.ResultsStore] = None
+        self.profile_cache: Optional[profile_cache.ProfileCache] = None  # Radius profiles of the loaded file
+        self.payload_path: Optional[str] = None
+        self.payload_hash: Optional[str] = None
+        self.service: Optional[service.ServiceClient] = None  # The local analysis service, if one is running
+        self.service_connecting = False
+        self.service_connected.connect(self.on_service_connected)
+        self.accepted_heads: dict[int, bulk.AcceptedHead] = {}  # Heads waiting to be saved, keyed by segment index
+        self.psds: Optional["trimesh.Trimesh"] = None
+        self.spine_confidence: dict[int, confidence.SpineConfidence] = {}  # Keyed by segment index
+        self.auto_accepted: set[int] = set()  # Segment indices of the spines accepted by their confidence score
+        self.bulk_save_worker: Optional[BulkSaveWorker] = None
+        self.scoring_worker: Optional[ScoringWorker] = None
+        self.bulk_save_dataset: Optional[str] = None
+        self.bulk_save_total = 0
+        self.bulk_save_results: list[results.HeadResult] = []
+        self.bulk_save_failed = 0
+
+        # Neck points and beheading run on this thread so that the GUI never waits for them
+        self.load_generation = 0  # Incremented every time a preprocessing file is loaded, to ignore stale results
+        self.beheading_worker = BeheadingWorker()
+        self.beheading_worker.task_done.connect(self.on_beheading_task_done)
+        self.beheading_worker.task_failed.connect(self.on_beheading_task_failed)
+        self.beheading_worker.start()
+
+        # With DSB_TELEMETRY=1, the timing of each stage is shown after the status text as it finishes
+        self.stage_timing_text = ""
+        self.telemetry_listener = self.stage_recorded.emit  # Kept, since each access returns a new object
+        if telemetry.enabled():
+            self.stage_recorded.connect(self.show_stage_timing)
+            telemetry.add_listener(self.telemetry_listener)
+
+    def show_stage_timing(self, record: telemetry.StageRecord) -> None:
+        status = self.ui.lbl_status.text()
+        if self.stage_timing_text and status.endswith(self.stage_timing_text):
+            status = status[:-len(self.stage_timing_text)]
+
+        self.stage_timing_text = f"  [{record.summary()}]"
+        self.ui.lbl_status.setText(status + self.stage_timing_text)
 
     def update_status_label(self, text: str):
         self.ui.lbl_status.setText(text)
 
+    def get_results_store(self, csv_path: str) -> results.ResultsStore:
+        """
+        Opens the results database backing the given CSV file, reusing the open one if it is the same file. A CSV
+        written without one, e.g. by an older version of DSB, is imported the first time its database is created.
+
+        :param csv_path: The path of the CSV output file
+        :return: The results store
+        """
+
+        store_path = results.store_path_for_csv(csv_path)
+        if self.results_store is not None and self.results_store.filepath == store_path:
+            return self.results_store
+
+        if self.results_store is not None:
+            self.results_store.close()
+
+        is_new = not os.path.isfile(store_path)
+        self.results_store = results.ResultsStore(store_path)
+
+        if is_new and os.path.isfile(csv_path):
+            self.results_store.import_csv(csv_path)
+
+        return self.results_store
+
     @pyqtSlot()
     def on_btn_preprocessing_run_clicked(self):
         selected_roi = ORSModel.orsObj(self.ui.ccb_dendrite_roi_chooser.getSelectedGuid())
@@ -70,14 +158,29 @@ class MainFormDsb(OrsAbstractWindow):
         self.worker = PreprocessingWorker(
             filepath, selected_roi,
             ORSModel.orsObj(self.ui.ccb_multiroi_chooser.getSelectedGuid()) if self.ui.chk_vis_multiroi.isChecked() else None,
-            ORSModel.orsObj(self.ui.ccb_annotation_chooser.getSelectedGuid()) if self.ui.chk_vis_annotations.isChecked() else None
+            ORSModel.orsObj(self.ui.ccb_annotation_chooser.getSelectedGuid()) if self.ui.chk_vis_annotations.isChecked() else None,
+            distance_field=self.ui.chk_distance_field.isChecked()
         )
 
         self.worker.update_label.connect(self.update_status_label)
-        self.worker.finished.connect(lambda: self.ui.btn_preprocessing_run.setEnabled(True))
+        self.worker.finished.connect(self.finish_preprocessing)
 
         self.worker.start()
         self.ui.btn_preprocessing_run.setEnabled(False)  # Disable it until the worker is done
+        self.ui.btn_preprocessing_cancel.setEnabled(True)
+
+    @pyqtSlot()
+    def on_btn_preprocessing_cancel_clicked(self):
+        if self.worker is None or not self.worker.isRunning():
+            return
+
+        self.ui.lbl_status.setText("Cancelling preprocessing")
+        self.ui.btn_preprocessing_cancel.setEnabled(False)
+        self.worker.cancel()
+
+    def finish_preprocessing(self):
+        self.ui.btn_preprocessing_run.setEnabled(True)
+        self.ui.btn_preprocessing_cancel.setEnabled(False)
 
     @pyqtSlot()
     def on_btn_select_csv_output_clicked(self):
@@ -109,36 +212,216 @@ class MainFormDsb(OrsAbstractWindow):
             self.ui.lbl_status.setText("No file selected")
             return
 
-    def compute_neck_point_and_tangent(self, idx: int):
+    def request_neck_point(self, idx: int) -> None:
+        """
+        Computes the neck point of the spine on the beheading worker. Replaces any neck point request that hasn't
+        finished yet, so that only the spine the user stops on is computed. The result is handled by
+        on_beheading_task_done.
+        """
+
+        mesh, cache = self.mesh, self.profile_cache
+        client, path, digest = self.service, self.payload_path, self.payload_hash
+        spine_skeleton = self.spine_skeletons[idx]
+        params = spine_analysis.NeckParams(
+            engine=spine_analysis.PLUGIN_ENGINE, refine_cut=spine_analysis.PLUGIN_REFINE_CUT
+        )
+
+        def profile():
+            with telemetry.stage("radius_profile", spine=idx):
+                return spine_analysis.radius_profile(spine_skeleton, mesh, params)
+
+        def compute_locally(task: Task):
+            # Ray casting the radius profile is the slow part, so it is cached across spines, files and sessions
+            points, radii = cache.get_or_compute(idx, params, profile)
+
+            task.check_cancelled()
+            return spine_analysis.neck_point_from_profile(spine_skeleton, mesh, points, radii, params)
+
+        def compute(task: Task):
+            with telemetry.stage("neck_point", spine=idx):
+                return service.call_or_fallback(
+                    client, lambda c: c.neck_point(path, digest, idx, params), lambda: compute_locally(task)
+                )
+
+        self.beheading_worker.submit("neck", (self.load_generation, idx), compute, latest_wins=True)
+
+    @pyqtSlot()
+    def on_btn_auto_accept_clicked(self):
+        """
+        Scores the spines that pass the filter on the scoring worker and accepts the ones that score at least the
+        confidence threshold. Spines scored before keep their score, so changing the threshold and clicking again is
+        quick. The result is handled by finish_scoring.
         """
-        Computes the neck point of the spine
 
-        :return: (neck point 3D, neck tangent vector, neck point 1D)
+        if self.mesh is None or self.segment_table is None:
+            self.ui.lbl_status.setText("Load a preprocessing file first")
+            return
+
+        if self.scoring_worker is not None and self.scoring_worker.isRunning():
+            self.ui.lbl_status.setText("Already scoring the spines")
+            return
+
+        indices = self.segment_table.select(**self.spine_filter_thresholds())
+        unscored = [int(idx) for idx in indices if int(idx) not in self.spine_confidence]
+        if not unscored:
+            self.apply_confidence_threshold()
+            return
+
+        params = spine_analysis.NeckParams(
+            engine=spine_analysis.PLUGIN_ENGINE, refine_cut=spine_analysis.PLUGIN_REFINE_CUT
+        )
+
+        # Scoring many spines takes a while, so it runs on its own worker and the spines can still be visited meanwhile
+        self.scoring_worker = ScoringWorker(
+            self.load_generation, unscored, self.segment_table, self.mesh, self.psds, self.profile_cache, params
+        )
+        self.scoring_worker.finished.connect(self.finish_scoring)
+        self.scoring_worker.start()
+        self.ui.btn_auto_accept.setEnabled(False)
+        self.ui.lbl_status.setText(f"Scoring {len(unscored)} spines…")
+
+    def finish_scoring(self) -> None:
+        """
+        Applies the scores computed by the scoring worker, unless they are for a file that is no longer loaded.
         """
 
-        if self.mesh is None or self.spine_skeletons is None:
-            return None, None
+        self.ui.btn_auto_accept.setEnabled(True)
 
-        spine_skeleton = self.spine_skeletons[idx]
-        spacing = 6
+        worker = self.scoring_worker
+        if worker.generation != self.load_generation:
+            return
 
-        points_tangents, radii_tangents = skel_helper.get_radius_polyline(
-            spine_skeleton[::-1], self.mesh, n_rays=150, aggregate='percentile99',
-            projection='tangents', path_interpolation_spacing=spacing
+        if worker.error is not None:
+            self.ui.lbl_status.setText("An unexpected error occurred while scoring the spines")
+        elif worker.result is not None:
+            self.spine_confidence.update((spine.spine_idx, spine) for spine in worker.result)
+
+            # Scoring found the neck points, so visiting a scored spine doesn't compute its neck point again. Cuts
+            #  the user already has are kept.
+            for spine in worker.result:
+                if spine.neck is None or spine.spine_idx in self.neck_cuts:
+                    continue
+
+                if spine.spine_idx == self.visualizer.currently_visualizing:
+                    self.beheading_worker.cancel("neck")
+                    self.show_neck_point(spine.spine_idx, *spine.neck)
+                else:
+                    self.store_neck_point(spine.spine_idx, *spine.neck)
+
+            self.apply_confidence_threshold()
+
+    def apply_confidence_threshold(self) -> None:
+        """
+        Accepts the scored spines whose score is at least the confidence threshold, and un-accepts the spines accepted
+        by an earlier, lower threshold that no longer reach it. Spines accepted by hand are left as they are, and
+        auto-accepted spines that were already saved aren't accepted again. Then re-filters the spines, so that
+        navigation skips the auto-accepted ones if only spines needing review are visited.
+        """
+
+        threshold = self.ui.spn_confidence_threshold.value()
+
+        for idx, spine in self.spine_confidence.items():
+            confident = spine.neck is not None and spine.score >= threshold
+
+            if idx in self.auto_accepted and not confident:
+                self.auto_accepted.discard(idx)
+                self.accepted_heads.pop(idx, None)
+            elif confident and idx not in self.accepted_heads and idx not in self.auto_accepted:
+                neck_pt_3d, neck_pt_tangent, _ = spine.neck
+                name = self.change_name(neck_pt_3d)
+                self.accepted_heads[idx] = bulk.AcceptedHead(
+                    spine_idx=idx,
+                    head_name=name if name is not None else f"{idx + 1}",
+                    neck_point=np.array(neck_pt_3d),
+                    neck_tangent=np.array(neck_pt_tangent)
+                )
+                self.auto_accepted.add(idx)
+
+        self.apply_spine_filter()
+
+        to_review = len(self.spine_confidence) - len(self.auto_accepted)
+        self.ui.lbl_status.setText(
+            f"Auto-accepted {len(self.auto_accepted)} of {len(self.spine_confidence)} scored spines, {to_review} "
+            f"need review ({len(self.accepted_heads)} waiting to be saved)"
         )
 
-        cumulative_points = geom.accumulate(points_tangents)
+    def show_neck_point(self, idx: int, neck_pt_3d, neck_pt_tangent, neck_pt_1d) -> None:
+        """
+        Shows a neck point computed by the beheading worker, if its spine is still the one being visualized.
+        """
+
+        if idx != self.visualizer.currently_visualizing:
+            return
+
+        if neck_pt_3d is None or neck_pt_tangent is None:
+            self.ui.lbl_status.setText("Failed to compute neck point and tangent")
+            return
+
+        self.store_neck_point(idx, neck_pt_3d, neck_pt_tangent, neck_pt_1d)
 
-        neck_point_1d = spine_analysis.find_neck_point_from_head_radius(
-            spine_skeleton[::-1], self.mesh, cumulative_points, radii_tangents
+        self.visualizer.set_spine_point(idx, neck_pt_3d)
+        self.visualizer.vis_spine_idx(idx)
+        self.show_cut(idx)
+        self.ui.lbl_status.setText("")
+
+    def store_neck_point(self, idx: int, neck_pt_3d, neck_pt_tangent, neck_pt_1d) -> None:
+        """
+        Stores the cut of a spine and the slider position of its neck point, so that visiting the spine shows them.
+        """
+
+        accumulated = geom.accumulate(self.spine_skeletons[idx])
+        self.neck_point_slider_values[idx] = int(
+            (accumulated[-1] - neck_pt_1d) / accumulated[-1] * self.ui.sldr_neck_point.maximum()
         )
+        self.neck_cuts[idx] = (neck_pt_3d, neck_pt_tangent)
+
+    def show_cut(self, idx: int, suggest_name: bool = True) -> None:
+        """
+        Shows the stored cut of a spine, and moves the slider to it without re-deriving the cut from the skeleton,
+        which would undo a refined cut. Only moving the slider by hand changes the cut.
+
+        :param suggest_name: Whether to replace the head name with the suggested one
+        """
 
-        neck_point_3d, neck_tangent = geom.point_and_tangent_along_polyline(spine_skeleton, neck_point_1d)
-        return neck_point_3d, neck_tangent, neck_point_1d
+        self.neck_pt_3d, self.neck_pt_tangent = self.neck_cuts[idx]
+
+        self.ui.sldr_neck_point.blockSignals(True)
+        self.ui.sldr_neck_point.setValue(self.neck_point_slider_values[idx])
+        self.ui.sldr_neck_point.blockSignals(False)
+
+        self.visualizer.transform_plane(self.neck_pt_3d, self.neck_pt_tangent)
+        if suggest_name:
+            self.suggest_head_name(idx)
+
+    def suggest_head_name(self, idx: int) -> None:
+        new_name = self.change_name(self.neck_pt_3d)
+        if new_name is not None:
+            self.ui.line_head_name.setText(f"{new_name}")
+        else:
+            self.ui.line_head_name.setText(f"{idx + 1}")
+
+    def on_beheading_task_done(self, task: Task, result) -> None:
+        if task.kind == "neck":
+            generation, idx = task.key
+            if generation == self.load_generation:
+                self.show_neck_point(idx, *result)
+        elif task.kind == "save":
+            self.publish_saved_head(*task.key, *result)
+
+    def on_beheading_task_failed(self, task: Task, error: Exception) -> None:
+        traceback.print_exception(error)
+
+        if task.kind == "neck":
+            generation, idx = task.key
+            if generation == self.load_generation and idx == self.visualizer.currently_visualizing:
+                self.ui.lbl_status.setText("Failed to compute neck point and tangent")
+        elif task.kind == "save":
+            _, accepted = task.key
+            self.ui.lbl_status.setText(f"An unexpected error occurred while saving Spine Head {accepted.head_name}")
 
     def jump_vis(self, n: int) -> None:
         """
-        Jumps n spines forward or backward in the visualization.
+        Jumps n spines forward or backward in the visualization, only visiting spines that pass the spine filter.
         :param n: -1 to jump backward, 1 to jump forward, 0 to reload the current spine, etc.
         """
 
@@ -146,28 +429,95 @@ class MainFormDsb(OrsAbstractWindow):
             self.ui.lbl_status.setText("Load a preprocessing file first")
             return
 
-        vis_current = self.visualizer.currently_visualizing
-        vis_next = (vis_current + n) if vis_current is not None else 0
-        if vis_next >= len(self.spine_skeletons) or vis_next < 0:
+        pos_next = (self.spine_pos + n) if self.spine_pos is not None else 0
+        if pos_next >= len(self.spine_indices) or pos_next < 0:
             self.ui.lbl_status.setText("No more spines to visualize")
             return
 
-        if not self.visualizer.has_spine_point(vis_next):
-            # Compute the neck point and tangent for the next spine
-            self.neck_pt_3d, self.neck_pt_tangent, neck_pt_1d = self.compute_neck_point_and_tangent(vis_next)
+        vis_next = int(self.spine_indices[pos_next])
+        previous = self.visualizer.currently_visualizing
+
+        # The skeleton is shown straight away. A spine without a neck point yet shows a placeholder until the
+        #  beheading worker has computed it. Neck points found by scoring aren't shown until their spine is visited.
+        if vis_next in self.neck_cuts and not self.visualizer.has_spine_point(vis_next):
+            self.visualizer.set_spine_point(vis_next, self.neck_cuts[vis_next][0])
+        self.visualizer.vis_spine_idx(vis_next)
+        self.spine_pos = pos_next
+        self.update_spine_label()
+
+        if vis_next not in self.neck_cuts:
+            # Save Head and Accept Head wait for this spine's cut instead of using the previous spine's
+            self.neck_pt_3d, self.neck_pt_tangent = None, None
+            self.ui.lbl_status.setText("Computing neck point…")
+            self.request_neck_point(vis_next)
+            return
+
+        self.beheading_worker.cancel("neck")
+        self.show_cut(vis_next, suggest_name=vis_next != previous)  # Keep a name typed in before re-filtering
 
-            accumulated = geom.accumulate(self.spine_skeletons[vis_next])
-            self.neck_point_slider_values[vis_next] = int((accumulated[-1] - neck_pt_1d) / accumulated[-1] * self.ui.sldr_neck_point.maximum())
+    def update_spine_label(self) -> None:
+        idx = int(self.spine_indices[self.spine_pos])
+        text = f"Spine {self.spine_pos + 1} / {len(self.spine_indices)}"
+        if idx in self.accepted_heads:
+            text += " (accepted)"
 
-            if self.neck_pt_3d is None or self.neck_pt_tangent is None:
-                self.ui.lbl_status.setText("Failed to compute neck point and tangent")
-                return
+        if (spine := self.spine_confidence.get(idx)) is not None:
+            text += f", confidence {spine.score:.2f}"
+            if concerns := spine.concerns:
+                text += f": {', '.join(concerns)}"
 
-            self.visualizer.set_spine_point(vis_next, self.neck_pt_3d)
+        self.ui.lbl_spine_idx.setText(text)
 
-        self.visualizer.vis_spine_idx(vis_next)
-        self.ui.sldr_neck_point.setValue(self.neck_point_slider_values[vis_next])
-        self.ui.lbl_spine_idx.setText(f"Spine {vis_next + 1} / {len(self.spine_skeletons)}")
+    def spine_filter_spin_boxes(self) -> list:
+        return [
+            self.ui.spn_min_nodes, self.ui.spn_max_nodes, self.ui.spn_min_length, self.ui.spn_max_length,
+            self.ui.spn_max_end_radius, self.ui.spn_max_main_branch_dist
+        ]
+
+    def spine_filter_thresholds(self) -> dict:
+        """
+        Reads the spine filter thresholds from the UI. A value of 0 in any of the maximum fields means no limit.
+
+        :return: Keyword arguments for SegmentTable.select
+        """
+
+        def no_limit_if_zero(value):
+            return value if value > 0 else math.inf
+
+        return dict(
+            min_nodes=self.ui.spn_min_nodes.value(),
+            max_nodes=no_limit_if_zero(self.ui.spn_max_nodes.value()),
+            min_length=self.ui.spn_min_length.value(),
+            max_length=no_limit_if_zero(self.ui.spn_max_length.value()),
+            radius_threshold=no_limit_if_zero(self.ui.spn_max_end_radius.value()),
+            max_main_branch_dist=no_limit_if_zero(self.ui.spn_max_main_branch_dist.value())
+        )
+
+    def apply_spine_filter(self) -> None:
+        """
+        Re-filters the spines from the cached segment table. Neck points that were already computed are kept, so
+        returning to a spine does not recompute it. Spines accepted by their confidence score are skipped if only
+        spines needing review are visited.
+        """
+
+        if self.segment_table is None or self.visualizer is None:
+            return
+
+        self.spine_indices = self.segment_table.select(**self.spine_filter_thresholds())
+        if self.ui.chk_review_only.isChecked() and self.auto_accepted:
+            self.spine_indices = self.spine_indices[~np.isin(self.spine_indices, list(self.auto_accepted))]
+
+        if len(self.spine_indices) == 0:
+            self.spine_pos = None
+            self.ui.lbl_spine_idx.setText("Spine 0 / 0")
+            self.ui.lbl_status.setText("No spines match the filter")
+            return
+
+        # Stay on the current spine if it still passes the filter, otherwise move to the next one that does
+        current_idx = self.visualizer.currently_visualizing
+        pos = int(np.searchsorted(self.spine_indices, current_idx)) if current_idx is not None else 0
+        self.spine_pos = min(pos, len(self.spine_indices) - 1)
+        self.jump_vis(0)
 
     @pyqtSlot()
     def on_btn_prev_spine_clicked(self):
@@ -191,21 +541,78 @@ class MainFormDsb(OrsAbstractWindow):
             return
 
         pld = payload.pld_load(filepath)
-        self.mesh = pld.dendrite_mesh
-        self.spine_skeletons, radii = polyline_utils.get_branch_polylines_by_length(
-            pld.skeleton, min_length=0, max_length=10000, min_nodes=15, max_nodes=5000, radius_threshold=math.inf
+        self.dataset_name = os.path.basename(filepath)
+
+        # Neck points and scores still being computed are for the previous file. Heads being saved are kept.
+        self.load_generation += 1
+        self.beheading_worker.cancel("neck")
+        if self.scoring_worker is not None and self.scoring_worker.isRunning():
+            # The button is enabled again once the cancelled scoring stops, at its next spine or batch of profiles
+            self.scoring_worker.cancel()
+
+        if self.profile_cache is not None:
+            self.profile_cache.close()
+
+        self.payload_path = filepath
+        self.payload_hash = profile_cache.payload_hash(filepath)
+        self.profile_cache = profile_cache.ProfileCache(
+            self.payload_hash, profile_cache.sidecar_path_for_payload(filepath)
         )
-        self.neck_point_slider_values = [0 for _ in range(len(self.spine_skeletons))]
+
+        # Neck points and heads are asked of the analysis service if one was started, and computed here otherwise
+        self.connect_service()
+        self.mesh = pld.dendrite_mesh
+        with telemetry.stage("branch_extraction"):
+            self.segment_table = polyline_utils.build_segment_table(pld.skeleton)
+        self.spine_skeletons = self.segment_table.polylines
+        self.neck_point_slider_values = {}
+        self.neck_cuts = {}
+        self.accepted_heads = {}
+        self.spine_confidence = {}
+        self.auto_accepted = set()
+        self.psds = pld.psds
+        self.spine_pos = None
 
         self.annotations = pld.annotations if pld.annotations is not None else []
 
         if self.annotations:
+            from scipy.spatial import KDTree
             self.annotations_kdtree = KDTree([point for point, _ in self.annotations])
 
-        self.ui.vis_widget.show()
-        self.visualizer = vis.Visualizer(self.ui.vis_widget, pld.dendrite_mesh, self.spine_skeletons, pld.annotations, pld.psds)
-        self.ui.vis_widget.reset_camera()
-        self.jump_vis(0)
+        from .visualize import visualize as vis
+
+        if self.vis_widget is None:
+            from pyvistaqt import QtInteractor
+            self.vis_widget = QtInteractor(self.ui.vis_container)
+            self.ui.vis_layout.addWidget(self.vis_widget)
+
+        self.vis_widget.show()
+        with telemetry.stage("visualizer_setup", faces=len(pld.dendrite_mesh.faces)):
+            self.visualizer = vis.Visualizer(
+                self.vis_widget, pld.dendrite_mesh, self.spine_skeletons, pld.annotations, pld.psds
+            )
+        self.vis_widget.reset_camera()
+        self.apply_spine_filter()
+
+    def connect_service(self) -> None:
+        """
+        Connects to the analysis service, if one is running and not connected yet. A stale service file or a stuck
+        service would keep the connection from finishing, so it is made on its own thread, and neck points and heads
+        are computed here until on_service_connected is called.
+        """
+
+        if self.service_connecting or (self.service is not None and self.service.available):
+            return
+
+        self.service_connecting = True
+        threading.Thread(
+            target=lambda: self.service_connected.emit(service.ServiceClient.connect()), daemon=True
+        ).start()
+
+    def on_service_connected(self, client: Optional[service.ServiceClient]) -> None:
+        self.service_connecting = False
+        if client is not None:
+            self.service = client
 
     @pyqtSlot()
     def on_chk_vis_annotations_stateChanged(self):
@@ -231,7 +638,7 @@ class MainFormDsb(OrsAbstractWindow):
 
         if (self.mesh is None
             or current_idx is None
-            or current_idx >= len(self.neck_point_slider_values)
+            or current_idx not in self.neck_point_slider_values
         ):
             self.ui.lbl_status.setText("No spine selected")
             return
@@ -247,13 +654,9 @@ class MainFormDsb(OrsAbstractWindow):
         self.visualizer.transform_plane(self.neck_pt_3d, self.neck_pt_tangent)
 
         self.neck_point_slider_values[current_idx] = value
+        self.neck_cuts[current_idx] = (self.neck_pt_3d, self.neck_pt_tangent)
         self.visualizer.set_spine_point(current_idx, self.neck_pt_3d)
-
-        new_name = self.change_name(self.neck_pt_3d)
-        if new_name is not None:
-            self.ui.line_head_name.setText(f"{new_name}")
-        else:
-            self.ui.line_head_name.setText(f"{current_idx + 1}")
+        self.suggest_head_name(current_idx)
 
     @pyqtSlot()
     def on_btn_save_head_clicked(self):
@@ -261,7 +664,7 @@ class MainFormDsb(OrsAbstractWindow):
 
         if (self.mesh is None
                 or current_idx is None
-                or current_idx >= len(self.neck_point_slider_values)
+                or current_idx not in self.neck_point_slider_values
         ):
             self.ui.lbl_status.setText("No spine selected")
             return
@@ -270,33 +673,159 @@ class MainFormDsb(OrsAbstractWindow):
             self.ui.lbl_status.setText("No neck point computed")
             return
 
-        beheaded = self.mesh.slice_plane(self.neck_pt_3d, -self.neck_pt_tangent, cap=True)
+        accepted = bulk.AcceptedHead(
+            spine_idx=current_idx,
+            head_name=self.ui.line_head_name.text(),
+            neck_point=np.array(self.neck_pt_3d),
+            neck_tangent=np.array(self.neck_pt_tangent)
+        )
+        mesh = self.mesh
+        client, path, digest = self.service, self.payload_path, self.payload_hash
 
-        closest_component: Optional[trimesh.Trimesh] = None
-        closest_component_dist = np.inf
+        def behead(task: Task):
+            head = service.call_or_fallback(
+                client, lambda c: c.head_mesh(path, digest, accepted), lambda: bulk.behead(mesh, accepted)
+            )
+            return head, meshhelper.mesh_to_ors(mesh=head.to_trimesh()) if head is not None else None
 
-        for component in beheaded.split(only_watertight=False):
-            dist = trimesh.proximity.closest_point(component, [self.neck_pt_3d])[1][0]
+        # Beheading runs on the worker, which publishes the head with publish_saved_head once it is done
+        self.beheading_worker.submit("save", (self.dataset_name, accepted), behead)
+        self.ui.lbl_status.setText(f"Saving: Spine Head {accepted.head_name}")
 
-            if dist < closest_component_dist:
-                closest_component = component
-                closest_component_dist = dist
+    def publish_saved_head(self, dataset: str, accepted: bulk.AcceptedHead, head: Optional[bulk.Head],
+                           ors_mesh) -> None:
+        """
+        Publishes a head beheaded by the beheading worker for the Save Head button and writes its result row.
+        """
 
-        if closest_component is None:
+        if head is None:
             self.ui.lbl_status.setText("No component found for base - cancelling beheading")
             return
 
-        centroid = np.array(closest_component.centroid)
-
-        ors_mesh = meshhelper.mesh_to_ors(mesh=closest_component)
-        head_name = self.ui.line_head_name.text()
-        ors_mesh.setTitle(f"Spine Head {head_name}")
+        ors_mesh.setTitle(f"Spine Head {accepted.head_name}")
         ors_mesh.publish()
-        self.ui.lbl_status.setText(f"Saved: Spine Head {head_name}")
+        self.ui.lbl_status.setText(f"Saved: Spine Head {accepted.head_name}")
+
+        # Saved now, so it shouldn't be saved again with the accepted heads
+        if dataset == self.dataset_name and self.accepted_heads.pop(accepted.spine_idx, None) is not None:
+            self.update_spine_label()
 
         if filepath := self.ui.line_csv_output.text():
-            vol = closest_component.volume / 1e9  # Convert from nm³ to μm³
-            payload.csv_save(filepath, head_name, current_idx + 1, vol, self.neck_pt_3d, centroid)
+            store = self.get_results_store(filepath)
+            store.upsert(head.result(dataset))
+
+            if not store.export_csv(filepath):
+                self.ui.lbl_status.setText(
+                    f"Saved: Spine Head {accepted.head_name} (could not write CSV - is it open elsewhere?)"
+                )
+
+    @pyqtSlot()
+    def on_btn_accept_head_clicked(self):
+        current_idx = self.visualizer.currently_visualizing if self.visualizer is not None else None
+
+        if (self.mesh is None
+                or current_idx is None
+                or current_idx not in self.neck_point_slider_values
+        ):
+            self.ui.lbl_status.setText("No spine selected")
+            return
+
+        if self.neck_pt_3d is None or self.neck_pt_tangent is None:
+            self.ui.lbl_status.setText("No neck point computed")
+            return
+
+        head_name = self.ui.line_head_name.text()
+        self.auto_accepted.discard(current_idx)  # Reviewed now, so a different threshold shouldn't un-accept it
+        self.accepted_heads[current_idx] = bulk.AcceptedHead(
+            spine_idx=current_idx,
+            head_name=head_name,
+            neck_point=np.array(self.neck_pt_3d),
+            neck_tangent=np.array(self.neck_pt_tangent)
+        )
+
+        self.update_spine_label()
+        self.ui.lbl_status.setText(
+            f"Accepted: Spine Head {head_name} ({len(self.accepted_heads)} waiting to be saved)"
+        )
+
+    @pyqtSlot()
+    def on_btn_save_accepted_clicked(self):
+        if self.bulk_save_worker is not None and self.bulk_save_worker.isRunning():
+            self.ui.lbl_status.setText("Already saving the accepted heads")
+            return
+
+        if self.mesh is None or not self.accepted_heads:
+            self.ui.lbl_status.setText("No accepted heads to save")
+            return
+
+        accepted = [self.accepted_heads[idx] for idx in sorted(self.accepted_heads)]
+        self.bulk_save_dataset = self.dataset_name
+        self.bulk_save_total = len(accepted)
+        self.bulk_save_results = []
+        self.bulk_save_failed = 0
+
+        self.bulk_save_worker = BulkSaveWorker(self.mesh, accepted)
+        self.bulk_save_worker.update_label.connect(self.update_status_label)
+        self.bulk_save_worker.heads_ready.connect(self.publish_accepted_heads)
+        self.bulk_save_worker.finished.connect(self.finish_bulk_save)
+
+        self.bulk_save_worker.start()
+        self.ui.btn_save_accepted.setEnabled(False)  # Disable it until the worker is done
+
+    def publish_accepted_heads(self, batch: list) -> None:
+        """
+        Publishes one batch of heads from the bulk save worker to Dragonfly. Their result rows are written together
+        once the whole save is done.
+
+        :param batch: (accepted head, head or None if beheading failed, ORS mesh or None) of each spine in the batch
+        """
+
+        for accepted, head, ors_mesh in batch:
+            if head is None:
+                self.bulk_save_failed += 1
+                continue
+
+            ors_mesh.setTitle(f"Spine Head {accepted.head_name}")
+            ors_mesh.publish()
+            self.bulk_save_results.append(head.result(self.bulk_save_dataset))
+
+            # Keep the spine queued if it was accepted again, with a different neck point, while saving
+            if self.accepted_heads.get(accepted.spine_idx) is accepted:
+                del self.accepted_heads[accepted.spine_idx]
+
+        done = len(self.bulk_save_results) + self.bulk_save_failed
+        self.ui.lbl_status.setText(f"Saving accepted heads: {done} / {self.bulk_save_total}")
+
+    def finish_bulk_save(self) -> None:
+        """
+        Writes the result rows of every head the bulk save published in a single transaction, then exports the CSV.
+        """
+
+        self.ui.btn_save_accepted.setEnabled(True)
+
+        status = f"Saved {len(self.bulk_save_results)} accepted heads"
+        if self.bulk_save_failed:
+            status += f", {self.bulk_save_failed} could not be beheaded and are still queued"
+
+        not_processed = self.bulk_save_total - len(self.bulk_save_results) - self.bulk_save_failed
+        if not_processed:
+            status += f", {not_processed} were not processed because of an error"
+
+        if self.bulk_save_worker.fell_back:
+            status += " (the worker processes could not start, so they were saved one at a time)"
+
+        if (filepath := self.ui.line_csv_output.text()) and self.bulk_save_results:
+            store = self.get_results_store(filepath)
+            store.upsert_many(self.bulk_save_results)
+
+            if not store.export_csv(filepath):
+                status += " (could not write CSV - is it open elsewhere?)"
+
+        self.bulk_save_results = []
+        self.ui.lbl_status.setText(status)
+
+        if self.spine_pos is not None:
+            self.update_spine_label()
 
     @pyqtSlot()
     def on_btn_go_to_spine_clicked(self):
@@ -315,5 +844,35 @@ class MainFormDsb(OrsAbstractWindow):
 
     @pyqtSlot()
     def closeEvent(self, event):
-        self.ui.vis_widget.Finalize()  # Explicitly finalize to prevent a black screen upon exit of the plugin window
+        # Let heads that are still being saved finish and deliver their results, so that their rows are written
+        #  before the store is closed. Neck points still being computed are cancelled.
+        self.beheading_worker.stop()
+        if self.worker is not None and self.worker.isRunning():
+            self.worker.cancel()
+            self.worker.wait()
+
+        if self.bulk_save_worker is not None and self.bulk_save_worker.isRunning():
+            self.bulk_save_worker.wait()
+
+        if self.scoring_worker is not None and self.scoring_worker.isRunning():
+            self.scoring_worker.cancel()
+            self.scoring_worker.wait()
+
+        QCoreApplication.sendPostedEvents()
+
+        if telemetry.enabled():
+            telemetry.remove_listener(self.telemetry_listener)
+            telemetry.write_session()
+
+        if self.results_store is not None:
+            self.results_store.close()
+
+        if self.profile_cache is not None:
+            self.profile_cache.close()
+
+        if self.service is not None:
+            self.service.close()
+
+        if self.vis_widget is not None:
+            self.vis_widget.Finalize()  # Explicitly finalize to prevent a black screen upon exit of the plugin window
         super().closeEvent(event)
@@ -0,0 +1,284 @@
+"""
+Parameter sweep for neck detection. Runs the automatic beheading on preprocessed datasets for every combination of
+the given NeckParams values and scores each combination against ground truth with the accuracy_eval metrics.
+
+Ray casting the radius profiles is the expensive step and only depends on NeckParams.profile_key (the spacing and the
+number of rays, plus the adaptive settings in adaptive mode), so each profile is computed once and shared by every grid
+point with the same key. Profiles are also saved in the same sidecar file the plugin uses, so they are not recomputed
+by later sweeps or beheading sessions. Beheading results are also reused when two grid points put the neck of a spine
+at the same place. Both the profiles and the grid points are spread across processes. Each .dsb file is loaded once;
+the worker processes attach to its mesh in shared memory (see pipeline/shared_mesh.py) instead of loading it again.
+
+Example:
+    python neck_sweep.py --dataset data/cell1_roi5.dsb data/cell1_roi5_ground_truth_smoothed.csv \\
+        --param degree=10,15,20 --param head_radius_factor=1,1.25,1.5 --output sweep.csv
+"""
+
+import argparse
+import contextlib
+import dataclasses
+import itertools
+import os
+import time
+import typing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import accuracy_eval
+from pipeline import payload, results, shared_mesh
+from pipeline.beheading import geometry as geom
+from pipeline.beheading import polyline_utils, profile_cache, spine_analysis
+
+# The default thresholds of the spine filter in the beheading tab
+SPINE_FILTER = dict(min_length=0, max_length=10000, min_nodes=15, max_nodes=5000, radius_threshold=np.inf)
+
+# Set in each worker process by _init_worker
+_meshes = None
+_head_cache = {}
+
+
+def parse_param(text: str) -> tuple[str, list]:
+    """
+    Parses a --param argument such as "degree=10,15,20" into the field name and its values, converted to the field's
+    annotated type. The default isn't used for this, since float fields such as spacing have int defaults.
+    """
+
+    name, _, values = text.partition("=")
+    fields = {field.name: field for field in dataclasses.fields(spine_analysis.NeckParams)}
+
+    if name not in fields:
+        raise argparse.ArgumentTypeError(f"Unknown parameter {name!r}, expected one of {', '.join(fields)}")
+
+    field_type = typing.get_type_hints(spine_analysis.NeckParams)[name]
+    if field_type is bool:
+        # bool("False") is True, so parse the words instead
+        return name, [value.strip().lower() in ("true", "1", "yes") for value in values.split(",")]
+
+    return name, [field_type(value) for value in values.split(",")]
+
+
+def _init_worker(handles: list[shared_mesh.SharedMeshHandle]):
+    global _meshes
+    _meshes = [shared_mesh.attach(handle)[0] for handle in handles]
+
+
+def _profile_task(task):
+    """
+    Computes the radius profiles of a batch of spines from one dataset, casting the rays of the whole batch at once.
+
+    :return: [(dataset index, spine index, profile or None)]
+    """
+
+    dataset_idx, batch, params = task
+    mesh = _meshes[dataset_idx]
+
+    try:
+        profiles = spine_analysis.radius_profiles([skeleton for _, skeleton in batch], mesh, params)
+        return [(dataset_idx, spine_idx, profile) for (spine_idx, _), profile in zip(batch, profiles)]
+    except Exception:
+        pass
+
+    # Retry one spine at a time so that one spine the ray casting can't handle doesn't fail the whole batch. Those
+    #  spines are reported as failed by the grid points.
+    results = []
+    for spine_idx, skeleton in batch:
+        try:
+            results.append((dataset_idx, spine_idx, spine_analysis.radius_profile(skeleton, mesh, params)))
+        except Exception:
+            results.append((dataset_idx, spine_idx, None))
+
+    return results
+
+
+def _behead_cached(dataset_idx: int, spine_idx: int, spine_skeleton: np.ndarray, neck_point_1d: float):
+    """
+    Beheads a spine, reusing the result if the neck was already placed within 0.1 nm of the same spot.
+
+    :return: (neck point 3D, head mesh or None)
+    """
+
+    key = (dataset_idx, spine_idx, round(neck_point_1d, 1))
+    if key not in _head_cache:
+        neck_point, neck_tangent = geom.point_and_tangent_along_polyline(spine_skeleton, neck_point_1d)
+        _head_cache[key] = neck_point, spine_analysis.behead(_meshes[dataset_idx], neck_point, neck_tangent)
+
+    return _head_cache[key]
+
+
+def _grid_task(task):
+    """
+    Beheads every spine with one set of parameters and returns the head results of each dataset.
+    """
+
+    params, spines, profiles = task
+    heads = {}
+    failed = 0
+
+    for (dataset_idx, spine_idx), spine_skeleton in spines.items():
+        profile = profiles.get((dataset_idx, spine_idx))
+        if profile is None:
+            failed += 1
+            continue
+
+        mesh = _meshes[dataset_idx]
+
+        try:
+            _, _, neck_point_1d = spine_analysis.neck_point_from_profile(spine_skeleton, mesh, *profile, params)
+            neck_point, head = _behead_cached(dataset_idx, spine_idx, spine_skeleton, neck_point_1d)
+        except Exception:
+            failed += 1
+            continue
+
+        if head is None:
+            failed += 1
+            continue
+
+        heads.setdefault(dataset_idx, []).append(results.HeadResult(
+            dataset=str(dataset_idx),
+            head_idx=spine_idx + 1,
+            head_name=str(spine_idx + 1),
+            head_vol=head.volume / 1e9,  # Convert from nm³ to μm³
+            beheading_point=neck_point,
+            centroid=np.array(head.centroid)
+        ))
+
+    return params, heads, failed
+
+
+def score(heads: dict, gts: list[pd.DataFrame], max_dist: float, one_to_one: bool) -> dict:
+    """
+    Scores the heads of every dataset against ground truth with the accuracy_eval metrics.
+
+    :param heads: The HeadResults of each dataset, keyed by dataset index
+    :param gts: The ground truth table of each dataset
+    :return: The metrics over all datasets combined
+    """
+
+    all_gt, all_dsb, all_merged = [], [], []
+
+    for dataset_idx, gt in enumerate(gts):
+        # Prefix GT names with the dataset so that spines with the same name in different datasets stay distinct
+        gt = gt.assign(name=f"{dataset_idx}:" + gt["name"].astype(str))
+        dsb = pd.DataFrame([head.as_row() for head in heads.get(dataset_idx, [])], columns=results.CSV_HEADER)
+
+        all_gt.append(gt)
+        all_dsb.append(dsb)
+        all_merged.append(accuracy_eval.merge_ground_truth(gt, dsb, max_dist=max_dist, one_to_one=one_to_one))
+
+    return accuracy_eval.compute_metrics(
+        pd.concat(all_gt, ignore_index=True), pd.concat(all_dsb, ignore_index=True),
+        pd.concat(all_merged, ignore_index=True)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dataset", nargs=2, action="append", required=True, metavar=("DSB", "GT_CSV"),
+                        help="A preprocessed .dsb file and its ground truth CSV. Can be given more than once.")
+    parser.add_argument("--param", type=parse_param, action="append", default=[],
+                        help="A NeckParams field and the comma-separated values to try, e.g. degree=10,15,20")
+    parser.add_argument("--max-dist", type=float, default=500.0, help="Maximum match distance in nm")
+    parser.add_argument("--one-to-one", action="store_true", help="Match each GT spine to at most one DSB head")
+    parser.add_argument("--sort", default="median_abs_volume_percent_diff", help="Metric to sort the results by")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of worker processes")
+    parser.add_argument("--output", help="Write the results of every grid point to this CSV file")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Don't read or write the radius profiles cached next to each .dsb file")
+    args = parser.parse_args()
+
+    dsb_paths = [dsb_path for dsb_path, _ in args.dataset]
+    gts = [pd.read_csv(gt_path) for _, gt_path in args.dataset]
+
+    # Each .dsb is only loaded here. Workers attach to its mesh in shared memory instead of loading it again.
+    stack = contextlib.ExitStack()
+    handles = []
+    spines = {}
+    for dataset_idx, path in enumerate(dsb_paths):
+        pld = payload.pld_load(path)
+        handles.append(stack.enter_context(shared_mesh.SharedMesh(pld.dendrite_mesh)).handle)
+
+        table = polyline_utils.build_segment_table(pld.skeleton)
+        for spine_idx in table.select(**SPINE_FILTER):
+            spines[dataset_idx, int(spine_idx)] = table.polylines[spine_idx]
+
+    names = [name for name, _ in args.param]
+    grid = [
+        spine_analysis.NeckParams(**dict(zip(names, values)))
+        for values in itertools.product(*(values for _, values in args.param))
+    ]
+    print(f"{len(spines)} spines in {len(dsb_paths)} datasets, {len(grid)} grid points")
+
+    rows = []
+    start = time.perf_counter()
+
+    # Profiles computed by earlier sweeps or plugin sessions are read from the sidecar file next to each .dsb
+    caches = [
+        profile_cache.ProfileCache(
+            profile_cache.payload_hash(path), None if args.no_cache else profile_cache.sidecar_path_for_payload(path)
+        )
+        for path in dsb_paths
+    ]
+
+    # The pool is shut down before the shared meshes are unlinked
+    with stack, ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                                    initargs=(handles,)) as executor:
+        # Compute each distinct radius profile once
+        profiles = {}
+        for params in {params.profile_key: params for params in grid}.values():
+            found = {}
+            for dataset_idx, cache in enumerate(caches):
+                dataset_spines = [spine_idx for d, spine_idx in spines if d == dataset_idx]
+                for spine_idx, profile in cache.get_many(dataset_spines, params).items():
+                    found[dataset_idx, spine_idx] = profile
+
+            # Split the missing spines of each dataset into a few batches per worker
+            tasks = []
+            for dataset_idx in range(len(dsb_paths)):
+                missing = [
+                    (spine_idx, skeleton) for (d, spine_idx), skeleton in spines.items()
+                    if d == dataset_idx and (d, spine_idx) not in found
+                ]
+                batch_size = max(1, -(-len(missing) // (4 * args.workers)))
+                tasks.extend(
+                    (dataset_idx, missing[first:first + batch_size], params)
+                    for first in range(0, len(missing), batch_size)
+                )
+
+            computed = {
+                (dataset_idx, spine_idx): profile
+                for batch in executor.map(_profile_task, tasks)
+                for dataset_idx, spine_idx, profile in batch
+            }
+            for dataset_idx, cache in enumerate(caches):
+                cache.put_many({
+                    spine_idx: profile for (d, spine_idx), profile in computed.items()
+                    if d == dataset_idx and profile is not None
+                }, params)
+
+            profiles[params.profile_key] = {**found, **computed}
+            print(f"Radius profiles for {params.profile_key}: {len(found)} cached, "
+                  f"{len(computed)} computed, {time.perf_counter() - start:.1f} s")
+
+        # Then run the cheap downstream steps for every grid point
+        tasks = [(params, spines, profiles[params.profile_key]) for params in grid]
+        for params, heads, failed in executor.map(_grid_task, tasks):
+            metrics = score(heads, gts, args.max_dist, args.one_to_one)
+            rows.append({**dataclasses.asdict(params), **metrics, "failed_spines": failed})
+            print(f"[{len(rows)}/{len(grid)}] {time.perf_counter() - start:.1f} s "
+                  f"{', '.join(f'{name}={getattr(params, name)}' for name in names)}: "
+                  f"{args.sort}={metrics.get(args.sort)}")
+
+    for cache in caches:
+        cache.close()
+
+    table = pd.DataFrame(rows).sort_values(args.sort, ignore_index=True)
+    print(table.head(10).to_string())
+
+    if args.output:
+        table.to_csv(args.output, index=False)
+
+
+if __name__ == "__main__":
+    main()
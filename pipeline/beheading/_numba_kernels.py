@@ -0,0 +1,140 @@
+"""
+The Numba kernels behind kernels.get(). Importing this module imports Numba, so only kernels.get() should import it.
+Each kernel gives the same results as the NumPy function of the same name in geometry or skel_helper.
+"""
+
+import numba
+import numpy as np
+
+jit = numba.njit(cache=True, nogil=True)
+
+
+@jit
+def _vertex_tangent(polyline, i):
+    # Same as geometry.compute_polyline_vertex_tangents, for one vertex
+    n = len(polyline)
+    if i == 0:
+        tangent = polyline[1] - polyline[0]
+    elif i == n - 1:
+        tangent = polyline[n - 1] - polyline[n - 2]
+    else:
+        tangent = polyline[i + 1] - polyline[i - 1]
+
+    return tangent / np.sqrt(np.sum(tangent ** 2))
+
+
+@jit
+def point_and_tangent_along_polyline(polyline, dist_along_skel):
+    n = len(polyline)
+    cumulative = np.zeros(n)
+    for i in range(1, n):
+        cumulative[i] = cumulative[i - 1] + np.sqrt(np.sum((polyline[i] - polyline[i - 1]) ** 2))
+
+    index = min(max(np.searchsorted(cumulative, dist_along_skel, side="right"), 1), n - 1)
+
+    percent_interpolate = (dist_along_skel - cumulative[index - 1]) / (cumulative[index] - cumulative[index - 1])
+    prev_tangent = _vertex_tangent(polyline, index - 1)
+    this_tangent = _vertex_tangent(polyline, index)
+
+    point = polyline[index - 1] + percent_interpolate * (polyline[index] - polyline[index - 1])
+    tangent = prev_tangent + percent_interpolate * (this_tangent - prev_tangent)
+    return point, tangent
+
+
+@jit
+def interpolate_along_path(points, spacing):
+    n = len(points)
+    s = np.zeros(n)
+    for i in range(1, n):
+        s[i] = s[i - 1] + np.sqrt(np.sum((points[i] - points[i - 1]) ** 2))
+
+    new_s = np.arange(0, s[-1], spacing)
+    result = np.empty((len(new_s), 3))
+    for axis in range(3):
+        result[:, axis] = np.interp(new_s, s, np.ascontiguousarray(points[:, axis]))
+
+    return result
+
+
+@jit
+def rotations_to_normals(normals):
+    # Same as skel_helper.rotation_to_normal for each normal, including its np.isclose / np.allclose checks
+    rotations = np.zeros((len(normals), 3, 3))
+
+    for i in range(len(normals)):
+        nx, ny, nz = normals[i, 0], normals[i, 1], normals[i, 2]
+
+        # The cross product of [0, 0, 1] and the normal
+        ax, ay = -ny, nx
+        axis_norm = np.sqrt(ax * ax + ay * ay)
+
+        if abs(axis_norm) <= 1e-8:
+            rotations[i, 0, 0] = 1
+            if abs(nx) <= 1e-8 and abs(ny) <= 1e-8 and abs(nz + 1) <= 1e-8 + 1e-5:
+                rotations[i, 1, 1] = -1
+                rotations[i, 2, 2] = -1
+            else:
+                rotations[i, 1, 1] = 1
+                rotations[i, 2, 2] = 1
+            continue
+
+        ax /= axis_norm
+        ay /= axis_norm
+        theta = np.arccos(min(max(nz, -1.0), 1.0))
+
+        # Rodrigues' rotation formula R = I + sin(theta) K + (1 - cos(theta)) K², written out for an axis with no z
+        #  component: K = [[0, 0, ay], [0, 0, -ax], [-ay, ax, 0]]
+        sin, cos1 = np.sin(theta), 1 - np.cos(theta)
+        rotations[i, 0, 0] = 1 - cos1 * ay * ay
+        rotations[i, 0, 1] = cos1 * ax * ay
+        rotations[i, 0, 2] = sin * ay
+        rotations[i, 1, 0] = cos1 * ax * ay
+        rotations[i, 1, 1] = 1 - cos1 * ax * ax
+        rotations[i, 1, 2] = -sin * ax
+        rotations[i, 2, 0] = -sin * ay
+        rotations[i, 2, 1] = sin * ax
+        rotations[i, 2, 2] = 1 - cos1 * (ax * ax + ay * ay)
+
+    return rotations
+
+
+@jit
+def aggregate_groups(values, groups, n_groups, q, mean):
+    counts = np.zeros(n_groups, dtype=np.int64)
+    for group in groups:
+        counts[group] += 1
+
+    starts = np.zeros(n_groups + 1, dtype=np.int64)
+    starts[1:] = np.cumsum(counts)
+
+    # Counting sort by group
+    by_group = np.empty(len(values))
+    filled = starts[:-1].copy()
+    for i in range(len(values)):
+        by_group[filled[groups[i]]] = values[i]
+        filled[groups[i]] += 1
+
+    result = np.zeros(n_groups)
+    for group in range(n_groups):
+        count = counts[group]
+        if count == 0:
+            continue
+
+        group_values = by_group[starts[group]:starts[group + 1]]
+        if mean:
+            result[group] = np.sum(group_values) / count
+            continue
+
+        # np.percentile's default linear interpolation between the two closest ranks
+        group_values = np.sort(group_values)
+        rank = (count - 1) * (q / 100)
+        below = int(np.floor(rank))
+        above = min(below + 1, count - 1)
+        fraction = rank - below
+        low, high = group_values[below], group_values[above]
+        if fraction >= 0.5:
+            result[group] = high - (high - low) * (1 - fraction)
+        else:
+            result[group] = low + (high - low) * fraction
+
+    return result
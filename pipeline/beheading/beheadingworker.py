@@ -0,0 +1,136 @@
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+from PyQt6.QtCore import QThread, pyqtSignal
+
+
+class Cancelled(Exception):
+    """
+    Raised by Task.check_cancelled inside a task that a newer request has replaced.
+    """
+
+
+@dataclass(eq=False)
+class Task:
+    """
+    A unit of work for the BeheadingWorker.
+    """
+
+    kind: str  # Tasks of the same kind replace each other if latest_wins is set
+    key: Any  # Identifies what the task is for, e.g. the spine, so that the GUI can tell if its result is still wanted
+    function: Callable[["Task"], Any]  # Called with the task itself, to check for cancellation
+    latest_wins: bool = False
+    cancelled: bool = field(default=False, init=False)
+
+    def check_cancelled(self) -> None:
+        """
+        Stop the task if it was cancelled. Tasks call this between their steps.
+        """
+
+        if self.cancelled:
+            raise Cancelled()
+
+
+class BeheadingWorker(QThread):
+    """
+    Runs the slow beheading tab operations (neck point computation and beheading) one at a time off the GUI thread.
+
+    Tasks submitted with latest_wins replace every queued task of the same kind and cancel the running one, so
+    quickly skipping through spines only computes the spine the user stops on. Other tasks, such as saving a head,
+    always run, in the order they were submitted.
+    """
+
+    task_done: pyqtSignal = pyqtSignal(object, object)  # (task, result)
+    task_failed: pyqtSignal = pyqtSignal(object, object)  # (task, exception)
+
+    def __init__(self):
+        super().__init__()
+
+        self._queue: deque[Task] = deque()
+        self._running: Optional[Task] = None
+        self._condition = threading.Condition()
+        self._stopping = False
+
+    def submit(self, kind: str, key: Any, function: Callable[[Task], Any], latest_wins: bool = False) -> Task:
+        """
+        Queue a task.
+
+        :param kind: The kind of task, e.g. "neck" or "save"
+        :param key: Identifies what the task is for. Passed back with the result.
+        :param function: Does the work. Called on the worker thread with the task, and should call
+                         task.check_cancelled() between its steps.
+        :param latest_wins: Whether to cancel the queued and running tasks of the same kind
+        :return: The task
+        """
+
+        task = Task(kind, key, function, latest_wins)
+
+        with self._condition:
+            if latest_wins:
+                self._cancel(lambda other: other.kind == kind)
+
+            self._queue.append(task)
+            self._condition.notify()
+
+        return task
+
+    def _cancel(self, predicate: Callable[[Task], bool]) -> None:
+        # Must be called with the condition held
+        for task in self._queue:
+            if predicate(task):
+                task.cancelled = True
+
+        self._queue = deque(task for task in self._queue if not task.cancelled)
+
+        if self._running is not None and predicate(self._running):
+            self._running.cancelled = True
+
+    def cancel(self, kind: str) -> None:
+        """
+        Cancel the queued and running tasks of one kind, e.g. the neck point computations when a different
+        preprocessing file is loaded.
+
+        :param kind: The kind of task to cancel
+        """
+
+        with self._condition:
+            self._cancel(lambda task: task.kind == kind)
+
+    def stop(self) -> None:
+        """
+        Cancel the latest_wins tasks, let the other queued tasks finish and wait for the thread to finish. Their
+        results are still emitted.
+        """
+
+        with self._condition:
+            self._cancel(lambda task: task.latest_wins)
+            self._stopping = True
+            self._condition.notify()
+
+        self.wait()
+
+    def run(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._stopping:
+                    self._condition.wait()
+
+                if not self._queue:
+                    return
+
+                task = self._running = self._queue.popleft()
+
+            try:
+                result = task.function(task)
+            except Cancelled:
+                pass
+            except Exception as e:
+                self.task_failed.emit(task, e)
+            else:
+                # The result of a task that finished just as it was replaced is still valid
+                self.task_done.emit(task, result)
+            finally:
+                with self._condition:
+                    self._running = None
@@ -0,0 +1,172 @@
+"""
+Beheads many spines at once, for saving every head the user accepted in the beheading tab in one go. The dendrite
+mesh is put in shared memory once and the spines are beheaded in batches by a pool of worker processes. If the worker
+processes can't be started, the spines are beheaded in this process instead.
+"""
+
+import os
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from typing import Callable, Iterator, Optional, Sequence, TYPE_CHECKING
+
+import numpy as np
+
+from . import spine_analysis
+from .. import distance_field, processes, results, shared_mesh, telemetry
+
+if TYPE_CHECKING:
+    import trimesh
+
+# Set in each worker process by _init_worker
+_mesh = None
+
+
+@dataclass(frozen=True)
+class AcceptedHead:
+    """
+    A neck point the user accepted for a spine, queued to be saved.
+    """
+
+    spine_idx: int  # Segment index of the spine
+    head_name: str
+    neck_point: np.ndarray
+    neck_tangent: np.ndarray
+
+
+@dataclass(frozen=True)
+class Head:
+    """
+    A beheaded spine head. Holds the mesh arrays rather than a trimesh mesh, whose cached properties would make it
+    much larger to send back from a worker process.
+    """
+
+    accepted: AcceptedHead
+    vertices: np.ndarray
+    faces: np.ndarray
+    volume: float  # nm³
+    centroid: np.ndarray
+    voxel_volume: Optional[float] = None  # nm³, counted from the distance field's voxels if the file has one
+
+    def to_trimesh(self) -> "trimesh.Trimesh":
+        import trimesh
+        return trimesh.Trimesh(vertices=self.vertices, faces=self.faces, process=False)
+
+    def result(self, dataset: str) -> results.HeadResult:
+        return results.HeadResult(
+            dataset=dataset,
+            head_idx=self.accepted.spine_idx + 1,
+            head_name=self.accepted.head_name,
+            head_vol=self.volume / 1e9,  # Convert from nm³ to μm³
+            beheading_point=self.accepted.neck_point,
+            centroid=self.centroid,
+            head_vol_voxels=self.voxel_volume / 1e9 if self.voxel_volume is not None else None
+        )
+
+
+def behead(mesh: "trimesh.Trimesh", accepted: AcceptedHead) -> Optional[Head]:
+    """
+    Behead one spine. If the mesh has a distance field, the head volume is also measured from its voxels.
+
+    :param mesh: The dendrite mesh
+    :param accepted: The spine and where to cut it
+    :return: The head, or None if the cut produced no components
+    """
+
+    component = spine_analysis.behead(mesh, accepted.neck_point, accepted.neck_tangent)
+    if component is None:
+        return None
+
+    return Head(
+        accepted=accepted,
+        vertices=np.asarray(component.vertices),
+        faces=np.asarray(component.faces),
+        volume=float(component.volume),
+        centroid=np.array(component.centroid),
+        voxel_volume=voxel_volume(mesh, accepted.neck_point, accepted.neck_tangent)
+    )
+
+
+def voxel_volume(mesh: "trimesh.Trimesh", neck_point: np.ndarray, neck_tangent: np.ndarray) -> Optional[float]:
+    """
+    :param mesh: The dendrite mesh
+    :param neck_point: The point to cut at
+    :param neck_tangent: The skeleton tangent at the neck point, pointing from the head towards the dendrite
+    :return: The head volume in nm³ counted from the voxels of the mesh's distance field, or None if the mesh has no
+             distance field or there are no voxels on the head side of the cut
+    """
+
+    field = distance_field.get(mesh)
+    if field is None:
+        return None
+
+    with telemetry.stage("voxel_volume"):
+        measured = field.head_volume(neck_point, neck_tangent)
+
+    return measured[0] if measured is not None else None
+
+
+def _behead_or_none(mesh: "trimesh.Trimesh", accepted: AcceptedHead) -> Optional[Head]:
+    # One spine that can't be beheaded shouldn't stop the others from being saved
+    try:
+        return behead(mesh, accepted)
+    except Exception:
+        return None
+
+
+def _init_worker(handle: shared_mesh.SharedMeshHandle, field_geometry: Optional[tuple[np.ndarray, np.ndarray]]):
+    global _mesh
+    _mesh, extras = shared_mesh.attach(handle)
+
+    if field_geometry is not None:
+        distance_field.attach(_mesh, distance_field.DistanceField(extras["distances"], *field_geometry))
+
+
+def _behead_task(batch: list[AcceptedHead]) -> list[Optional[Head]]:
+    return [_behead_or_none(_mesh, accepted) for accepted in batch]
+
+
+def behead_many(mesh: "trimesh.Trimesh", accepted: Sequence[AcceptedHead], workers: Optional[int] = None,
+                batch_size: int = 8, on_fallback: Optional[Callable[[BaseException], None]] = None) \
+        -> Iterator[list[tuple[AcceptedHead, Optional[Head]]]]:
+    """
+    Behead many spines, in a pool of worker processes if there is more than one batch. If the pool can't start or
+    breaks, the remaining spines are beheaded in the calling thread.
+
+    :param mesh: The dendrite mesh
+    :param accepted: The spines to behead and where to cut them
+    :param workers: The number of worker processes, or None for one per CPU
+    :param batch_size: The number of spines beheaded per task. Results are yielded one batch at a time.
+    :param on_fallback: Called with the error if the pool can't be used and the calling thread takes over
+    :return: Yields the batches in order, as they finish: (accepted head, head or None if beheading failed)
+    """
+
+    batches = [list(accepted[first:first + batch_size]) for first in range(0, len(accepted), batch_size)]
+    workers = min(workers or os.cpu_count() or 1, len(batches))
+    field = distance_field.get(mesh)
+    done = 0
+
+    if workers > 1:
+        # The distance field goes through shared memory with the mesh, for the voxel head volumes
+        extras = {"distances": field.distances} if field is not None else None
+        field_geometry = (field.origin, field.axes) if field is not None else None
+
+        try:
+            with shared_mesh.SharedMesh(mesh, extras) as shared, \
+                    processes.process_pool(workers, _init_worker, (shared.handle, field_geometry)) as executor:
+                for batch, heads in zip(batches, executor.map(_behead_task, batches)):
+                    yield list(zip(batch, heads))
+                    done += 1
+        except (BrokenProcessPool, OSError) as e:
+            if on_fallback is not None:
+                on_fallback(e)
+
+    if done == len(batches):
+        return
+
+    # A separate mesh object sharing the same arrays, so that trimesh's cache isn't shared with the caller's thread
+    import trimesh
+    local_mesh = trimesh.Trimesh(vertices=mesh.vertices, faces=mesh.faces, process=False)
+    distance_field.attach(local_mesh, field)
+
+    for batch in batches[done:]:
+        yield [(accepted_head, _behead_or_none(local_mesh, accepted_head)) for accepted_head in batch]
@@ -0,0 +1,50 @@
+from PyQt6.QtCore import QThread, pyqtSignal
+
+import traceback
+from typing import TYPE_CHECKING
+
+from . import bulk
+from .. import telemetry
+from ..preprocessing import meshhelper
+
+if TYPE_CHECKING:
+    import trimesh
+
+
+class BulkSaveWorker(QThread):
+    """
+    Beheads the accepted spines and converts the heads to Dragonfly meshes off the GUI thread. The converted heads are
+    sent to the GUI thread one batch at a time through heads_ready, to be published there, which also reports the
+    progress.
+    """
+
+    update_label: pyqtSignal = pyqtSignal(str)
+    heads_ready: pyqtSignal = pyqtSignal(list)  # [(AcceptedHead, Head or None, ORS mesh or None)] of one batch
+    finished: pyqtSignal = pyqtSignal()
+
+    def __init__(self, mesh: "trimesh.Trimesh", accepted: list[bulk.AcceptedHead]):
+        super().__init__()
+
+        self.mesh = mesh
+        self.accepted = accepted
+        self.fell_back = False  # Whether the worker processes couldn't be used, so the heads were beheaded here
+
+    def on_fallback(self, error: BaseException) -> None:
+        traceback.print_exception(error)
+        self.fell_back = True
+
+    def run(self):
+        try:
+            self.update_label.emit(f"Saving accepted heads: 0 / {len(self.accepted)}")
+
+            with telemetry.stage("behead_many", heads=len(self.accepted)):
+                for batch in bulk.behead_many(self.mesh, self.accepted, on_fallback=self.on_fallback):
+                    self.heads_ready.emit([
+                        (accepted, head, meshhelper.mesh_to_ors(head.to_trimesh()) if head is not None else None)
+                        for accepted, head in batch
+                    ])
+        except Exception as e:
+            self.update_label.emit("An unexpected error occurred while saving the accepted heads")
+            raise e
+        finally:
+            self.finished.emit()
@@ -0,0 +1,220 @@
+"""
+Scores how confident neck detection is about each spine, from signals the pipeline already produces, so that the
+spines it is sure about can be accepted in one go and proofreading only visits the rest. A skeleton branch that isn't
+a spine, or a spine whose radius profile has no clear head, scores low.
+
+The score is the product of one factor in [0, 1] per signal:
+- The prominence of the head peak in the smoothed radius profile above the narrowest part of the neck, relative to
+  its height. A clear head stands out from the neck; a branch along the shaft or a stubby spine has a flat profile.
+- The fraction of radius samples outside the mesh, which get_radius_polyline has to fall back on nearest neighbours
+  for. Many of them mean the skeleton leaves the mesh, and the profile is unreliable.
+- Whether the neck point is on the narrow part of the profile, between its narrowest point and the head. A neck
+  point in the shaft or in the head means the head radius it was placed from is off.
+- The branch length and the head radius, which are only penalized outside the range real spines fall in.
+- Whether a PSD is near the head, if the file has PSDs. A head without one is more likely to be something else.
+"""
+
+from dataclasses import dataclass
+from typing import Callable, Optional, Sequence
+
+import numpy as np
+
+from . import geometry as geom
+from . import skel_helper, spine_analysis
+
+PROMINENCE_FULL = 0.3  # A head peak this prominent, relative to its height, doesn't lower the score
+FALLBACK_ZERO = 0.25  # This fraction of radius samples outside the mesh makes the score 0
+LENGTH_RANGE = (300, 4000)  # nm. Real spines are this long
+HEAD_RADIUS_RANGE = (80, 1000)  # nm. Real spine heads are this wide
+OUT_OF_RANGE_FACTOR = 0.5  # The factor for a length or head radius outside its range
+NECK_RATIO = 0.7  # A neck point where the smoothed profile is wider than this fraction of the head is questionable
+MISPLACED_NECK_FACTOR = 0.5  # The factor for a questionable neck point
+PSD_DISTANCE = 500  # nm. A PSD this close to the head center counts as the spine's
+NO_PSD_FACTOR = 0.7  # The factor for a head without a PSD, if the file has PSDs
+
+DEFAULT_THRESHOLD = 0.8  # Spines scoring at least this much are accepted without review
+
+PROFILE_CHUNK = 4  # Radius profiles are computed in batches of this many spines, checking for cancellation between
+
+
+@dataclass(frozen=True)
+class SpineConfidence:
+    spine_idx: int  # Segment index of the spine
+    score: float  # In [0, 1]
+    prominence: float  # Of the head peak in the smoothed radius profile above the neck, relative to its height
+    fallback_fraction: float  # Of the radius samples outside the mesh
+    length: float  # Of the skeleton branch in nm
+    head_radius: float  # The height of the head peak in nm
+    neck_placed: bool  # Whether the neck point is on the narrow part of the profile
+    psd_distance: Optional[float]  # From the head center to the closest PSD in nm, None if the file has no PSDs
+    neck: Optional[tuple[np.ndarray, np.ndarray, float]]  # (neck point 3D, tangent, 1D), None if too short to profile
+
+    @property
+    def concerns(self) -> list[str]:
+        """
+        :return: Why the score is lowered, in words for the status bar
+        """
+
+        found = []
+        if self.prominence < PROMINENCE_FULL:
+            found.append("no clear head")
+        if self.fallback_fraction > 0:
+            found.append("skeleton leaves the mesh")
+        if not self.neck_placed:
+            found.append("neck point off the neck")
+        if not LENGTH_RANGE[0] <= self.length <= LENGTH_RANGE[1]:
+            found.append("unusual length")
+        if not HEAD_RADIUS_RANGE[0] <= self.head_radius <= HEAD_RADIUS_RANGE[1]:
+            found.append("unusual head size")
+        if self.psd_distance is not None and self.psd_distance > PSD_DISTANCE:
+            found.append("no PSD nearby")
+
+        return found
+
+
+def profile_signals(points: np.ndarray, radii: np.ndarray, neck_distance: float,
+                    params: spine_analysis.NeckParams = spine_analysis.NeckParams()) \
+        -> tuple[float, float, np.ndarray, bool]:
+    """
+    Reads the head and how the neck point sits in a radius profile. Like find_neck_point_from_head_radius, it starts
+    from the rightmost peak of the smoothed profile. The smoothing leaves ripples across a head, so the head is the
+    highest point beyond the narrowest point before that peak, and its prominence is measured from the narrowest point.
+
+    :param points: The sample points of the radius profile, as returned by radius_profile
+    :param radii: The radius at each sample point. Samples that aren't finite are left out.
+    :param neck_distance: The neck point's distance along the profile, from the dendrite
+    :param params: The neck detection parameters the profile was smoothed with
+    :return: (prominence of the head relative to its height, height of the head, head center, whether the neck point
+             is between the narrowest point and the head where the profile is narrower than NECK_RATIO of the head).
+             0, 0, the last sample point and False if the profile has no peak.
+    """
+
+    distances = np.concatenate([[0], geom.accumulate(points)])
+    finite = np.isfinite(radii)
+    if finite.sum() <= params.degree:
+        return 0.0, 0.0, points[-1], False
+
+    smoothed_x, smoothed_y = spine_analysis.smooth(
+        distances[finite], radii[finite], degree=params.degree, alpha=params.alpha, x_points=params.x_points
+    )
+
+    peak = spine_analysis.rightmost_local_max_idx(smoothed_y, distance=params.peak_distance)
+    if peak < 0:
+        return 0.0, 0.0, points[-1], False
+
+    narrowest = int(np.argmin(smoothed_y[:peak + 1]))
+    head = narrowest + int(np.argmax(smoothed_y[narrowest:]))
+    if smoothed_y[head] <= 0:
+        return 0.0, 0.0, points[-1], False
+
+    prominence = (smoothed_y[head] - max(smoothed_y[narrowest], 0)) / smoothed_y[head]
+    center = np.array([np.interp(smoothed_x[head], distances, points[:, axis]) for axis in range(3)])
+
+    neck_radius = np.interp(neck_distance, smoothed_x, smoothed_y)
+    neck_placed = bool(
+        smoothed_x[narrowest] <= neck_distance <= smoothed_x[head]
+        and 0 < neck_radius <= NECK_RATIO * smoothed_y[head]
+    )
+
+    return float(prominence), float(smoothed_y[head]), center, neck_placed
+
+
+def score(prominence: float, fallback_fraction: float, neck_placed: bool, length: float, head_radius: float,
+          psd_distance: Optional[float]) -> float:
+    """
+    Combines the signals into a confidence score. See the module docstring.
+
+    :return: The score, in [0, 1]
+    """
+
+    factors = [
+        min(prominence / PROMINENCE_FULL, 1.0),
+        max(1 - fallback_fraction / FALLBACK_ZERO, 0.0),
+        1.0 if neck_placed else MISPLACED_NECK_FACTOR,
+        1.0 if LENGTH_RANGE[0] <= length <= LENGTH_RANGE[1] else OUT_OF_RANGE_FACTOR,
+        1.0 if HEAD_RADIUS_RANGE[0] <= head_radius <= HEAD_RADIUS_RANGE[1] else OUT_OF_RANGE_FACTOR,
+        1.0 if psd_distance is None or psd_distance <= PSD_DISTANCE else NO_PSD_FACTOR,
+    ]
+
+    return float(np.prod(factors))
+
+
+def score_spines(spine_indices: Sequence[int], segment_table, dendrite_mesh, psds=None, cache=None,
+                 params: spine_analysis.NeckParams = spine_analysis.NeckParams(),
+                 check_cancelled: Optional[Callable[[], None]] = None) -> list[SpineConfidence]:
+    """
+    Scores many spines and finds their neck points. The radius profiles that aren't cached are computed with
+    radius_profiles, PROFILE_CHUNK spines at a time.
+
+    :param spine_indices: The segment indices of the spines
+    :param segment_table: The segment table of the skeleton
+    :param dendrite_mesh: The dendrite mesh
+    :param psds: The PSD mesh, or None if the file has no PSDs
+    :param cache: A ProfileCache to read and store the radius profiles in, if any
+    :param params: The neck detection parameters
+    :param check_cancelled: Called between spines and between batches of radius profiles, to stop scoring by raising
+    :return: The confidence of each spine, in the order of spine_indices
+    """
+
+    spine_indices = [int(idx) for idx in spine_indices]
+
+    # A branch without two radius samples has no profile, and scores 0
+    profiled = [idx for idx in spine_indices if segment_table.lengths[idx] >= 2 * params.spacing]
+    profiles = cache.get_many(profiled, params) if cache is not None else {}
+
+    missing = [idx for idx in profiled if idx not in profiles]
+    for first in range(0, len(missing), PROFILE_CHUNK):
+        if check_cancelled is not None:
+            check_cancelled()
+
+        chunk = missing[first:first + PROFILE_CHUNK]
+        computed = dict(zip(chunk, spine_analysis.radius_profiles(
+            [segment_table.polylines[idx] for idx in chunk], dendrite_mesh, params
+        )))
+        profiles.update(computed)
+
+        # Stored as they are computed, so that a cancelled scoring doesn't have to compute them again
+        if cache is not None:
+            cache.put_many(computed, params)
+
+    psd_tree = None
+    if psds is not None and len(psds.vertices) > 0:
+        from scipy.spatial import cKDTree
+        psd_tree = cKDTree(np.asarray(psds.vertices))
+
+    volume = skel_helper.collision_volume(dendrite_mesh)
+    confidences = []
+
+    for idx in spine_indices:
+        if check_cancelled is not None:
+            check_cancelled()
+
+        length = float(segment_table.lengths[idx])
+        if idx not in profiles:
+            confidences.append(SpineConfidence(idx, 0.0, 0.0, 1.0, length, 0.0, False, None, None))
+            continue
+
+        points, radii = profiles[idx]
+        spine_skeleton = segment_table.polylines[idx]
+        neck = spine_analysis.neck_point_from_profile(spine_skeleton, dendrite_mesh, points, radii, params)
+
+        # The profile runs from the dendrite, the neck point's distance from the tip
+        neck_distance = geom.accumulate(spine_skeleton)[-1] - neck[2]
+        prominence, head_radius, head_center, neck_placed = profile_signals(points, radii, neck_distance, params)
+
+        fallback_fraction = float(np.mean(~volume.contains(points)))
+        psd_distance = float(psd_tree.query(head_center)[0]) if psd_tree is not None else None
+
+        confidences.append(SpineConfidence(
+            spine_idx=idx,
+            score=score(prominence, fallback_fraction, neck_placed, length, head_radius, psd_distance),
+            prominence=prominence,
+            fallback_fraction=fallback_fraction,
+            length=length,
+            head_radius=head_radius,
+            neck_placed=neck_placed,
+            psd_distance=psd_distance,
+            neck=neck
+        ))
+
+    return confidences
@@ -0,0 +1,246 @@
+"""
+Cross-sectional areas of a mesh along a skeleton, measured by slicing it with many planes at once. Used by the
+"cross_section" neck detection engine in spine_analysis, as an alternative to estimating the radius by ray casting.
+
+Each plane's section is traced from the mesh edges it crosses. A crossed face gives one segment of the section,
+oriented by the face normal, and the segments are joined into loops through the edges they share. Only the loops that
+wind around the skeleton point are counted, so a plane that also cuts the shaft or a neighbouring spine measures just
+the spine the point is in.
+"""
+
+from typing import Optional
+
+import numpy as np
+
+from . import geometry as geom
+
+# The planes are sliced this many at a time, each chunk against the faces near it. Smaller chunks slice fewer faces
+#  each, larger ones spend less time cutting out the faces; 64 was fastest in benchmarks/bench_cross_section.py.
+_PLANES_PER_CHUNK = 64
+
+
+def resample(polyline: np.ndarray, distances: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    :param polyline: The polyline, shape (N, 3)
+    :param distances: Distances along the polyline, increasing
+    :return: (points at the distances, unit tangents of the resampled polyline at those points)
+    """
+
+    cumulative = np.concatenate([[0], geom.accumulate(polyline)])
+    points = np.stack([np.interp(distances, cumulative, polyline[:, axis]) for axis in range(3)], axis=1)
+
+    if len(points) < 2:
+        return points, np.zeros_like(points)
+
+    return points, geom.compute_polyline_vertex_tangents(points)
+
+
+def tilted_normals(normal: np.ndarray, max_tilt: float, n_tilts: int, n_azimuths: int) -> np.ndarray:
+    """
+    Unit normals of the planes tilted away from a plane, for searching nearby plane orientations.
+
+    :param normal: The normal of the plane
+    :param max_tilt: The largest tilt in degrees
+    :param n_tilts: The number of tilts, evenly spaced from 0 to max_tilt
+    :param n_azimuths: The number of directions each nonzero tilt is made in
+    :return: The normal itself first, then n_azimuths normals for each nonzero tilt, shape (1 + (n_tilts - 1) *
+             n_azimuths, 3)
+    """
+
+    normal = normal / np.linalg.norm(normal)
+
+    # Two unit vectors perpendicular to the normal and each other
+    helper = np.eye(3)[np.argmin(np.abs(normal))]
+    u = np.cross(normal, helper)
+    u /= np.linalg.norm(u)
+    v = np.cross(normal, u)
+
+    tilts = np.radians(np.linspace(0, max_tilt, n_tilts)[1:])[:, np.newaxis, np.newaxis]
+    azimuths = np.linspace(0, 2 * np.pi, n_azimuths, endpoint=False)[np.newaxis, :, np.newaxis]
+    sideways = np.cos(azimuths) * u + np.sin(azimuths) * v
+
+    tilted = np.cos(tilts) * normal + np.sin(tilts) * sideways
+    return np.concatenate([normal[np.newaxis], tilted.reshape(-1, 3)])
+
+
+def crop(mesh, points: np.ndarray, margin: float) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Cuts out the faces of a mesh near some points. The mesh's unique edges are cached by trimesh, so cropping many
+    spines from one mesh only works them out once.
+
+    :param mesh: The trimesh mesh
+    :param points: The points the crop must contain
+    :param margin: How far beyond the bounding box of the points to keep faces
+    :return: (vertices, faces, edges, face edges) of the faces with a vertex within the padded bounding box of the
+             points, as taken by section_areas
+    """
+
+    vertices = np.asarray(mesh.vertices)
+    faces = np.asarray(mesh.faces)
+
+    lo = points.min(axis=0) - margin
+    hi = points.max(axis=0) + margin
+
+    inside = np.all((vertices >= lo) & (vertices <= hi), axis=1)
+    kept = inside[faces].any(axis=1)
+
+    used_edges, face_edges = np.unique(mesh.faces_unique_edges[kept], return_inverse=True)
+    used_vertices, edges = np.unique(mesh.edges_unique[used_edges], return_inverse=True)
+    faces = np.searchsorted(used_vertices, faces[kept])
+
+    return vertices[used_vertices], faces, edges.reshape(-1, 2), face_edges.reshape(-1, 3)
+
+
+def _unique_edges(faces: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    :return: (unique edges as sorted vertex pairs, shape (E, 2), the index of each face's three edges, shape (F, 3))
+    """
+
+    edges = np.sort(faces[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2), axis=1)
+    unique, inverse = np.unique(edges, axis=0, return_inverse=True)
+    return unique, inverse.reshape(-1, 3)
+
+
+def _slice_chunk(vertices, faces, face_normals, edges, face_edges, origins, normals) -> tuple[np.ndarray, np.ndarray]:
+    """
+    section_areas for one chunk of planes.
+
+    :return: (area of each plane's section around its origin, whether that section is open)
+    """
+
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    n_planes = len(origins)
+    areas = np.full(n_planes, np.nan)
+
+    # Signed distance of every vertex from every plane, shape (planes, vertices)
+    dist = normals @ vertices.T - np.einsum("ij,ij->i", normals, origins)[:, np.newaxis]
+    above = dist > 0
+
+    crossed = above[:, edges[:, 0]] != above[:, edges[:, 1]]  # (planes, edges)
+    node_plane, node_edge = np.nonzero(crossed)
+    if len(node_plane) == 0:
+        return areas, np.zeros(n_planes, dtype=bool)
+
+    # The section passes through each crossed edge at one point: a node of the section's loops
+    d0 = dist[node_plane, edges[node_edge, 0]]
+    d1 = dist[node_plane, edges[node_edge, 1]]
+    v0 = vertices[edges[node_edge, 0]]
+    nodes = v0 + (d0 / (d0 - d1))[:, np.newaxis] * (vertices[edges[node_edge, 1]] - v0)
+
+    # A face crossed by a plane has exactly two crossed edges, which are joined by a segment of the section. The
+    #  nodes are in (plane, edge) order, so they are found by binary search.
+    corners_above = above[:, faces].sum(axis=2)
+    seg_plane, seg_face = np.nonzero((corners_above == 1) | (corners_above == 2))
+    seg_edges = face_edges[seg_face]
+    seg_crossed = crossed[seg_plane[:, np.newaxis], seg_edges]
+    node_keys = node_plane * len(edges) + node_edge
+    seg_keys = seg_plane[:, np.newaxis] * len(edges) + seg_edges[seg_crossed].reshape(-1, 2)
+    ends = np.searchsorted(node_keys, seg_keys)
+    a, b = nodes[ends[:, 0]], nodes[ends[:, 1]]
+
+    # Orient the segments the same way around every loop, counterclockwise about the plane normal for an outward
+    #  facing surface
+    plane_normals = normals[seg_plane]
+    flip = np.einsum("ij,ij->i", b - a, np.cross(plane_normals, face_normals[seg_face])) < 0
+    a[flip], b[flip] = b[flip], a[flip]
+
+    # Shoelace area and winding angle of each segment about the plane's origin
+    u = a - origins[seg_plane]
+    w = b - origins[seg_plane]
+    signed = np.einsum("ij,ij->i", np.cross(u, w), plane_normals)
+    angles = np.arctan2(signed, np.einsum("ij,ij->i", u, w))
+
+    graph = coo_matrix((np.ones(len(ends)), (ends[:, 0], ends[:, 1])), shape=(len(nodes), len(nodes)))
+    n_loops, node_loop = connected_components(graph, directed=False)
+    seg_loop = node_loop[ends[:, 0]]
+
+    loop_area = np.bincount(seg_loop, weights=signed / 2, minlength=n_loops)
+    loop_winding = np.bincount(seg_loop, weights=angles, minlength=n_loops) / (2 * np.pi)
+    loop_plane = np.zeros(n_loops, dtype=int)
+    loop_plane[node_loop] = node_plane
+
+    # A loop with a node that isn't joined to two segments was cut off by the crop (or the mesh has a hole)
+    degree = np.bincount(ends.ravel(), minlength=len(nodes))
+    loop_open = np.bincount(node_loop, weights=degree != 2, minlength=n_loops) > 0
+
+    around = np.abs(loop_winding) > 0.5
+    counted = np.bincount(loop_plane[around], minlength=n_planes) > 0
+    enclosed = np.bincount(loop_plane[around], weights=np.abs(loop_area[around]), minlength=n_planes)
+    areas[counted] = enclosed[counted]
+    is_open = np.bincount(loop_plane[around], weights=loop_open[around], minlength=n_planes) > 0
+
+    return areas, is_open
+
+
+def section_areas(vertices: np.ndarray, faces: np.ndarray, origins: np.ndarray, normals: np.ndarray,
+                  margin: float = np.inf, edges: Optional[np.ndarray] = None,
+                  face_edges: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Measures the area of the mesh's cross-section around each origin, in the plane through it with the given normal.
+
+    :param vertices: The mesh vertices, shape (V, 3)
+    :param faces: The mesh faces, with consistent outward winding, shape (F, 3)
+    :param origins: A point on each plane, shape (P, 3)
+    :param normals: The unit normal of each plane, shape (P, 3)
+    :param margin: Only the faces within this distance of an origin along each axis are sliced, so sections reaching
+                   further are cut off
+    :param edges: The unique edges of the mesh as vertex pairs, shape (E, 2), if already known
+    :param face_edges: The index of each face's three edges in `edges`, shape (F, 3), if already known
+    :return: The area of each section, shape (P,). inf if the section around the origin isn't closed, which happens
+             when it reaches further than the margin, and NaN if the origin isn't inside the mesh.
+    """
+
+    origins = np.asarray(origins, dtype=np.float64)
+    normals = np.asarray(normals, dtype=np.float64)
+    areas = np.full(len(origins), np.nan)
+
+    if len(faces) == 0 or len(origins) == 0:
+        return areas
+
+    if edges is None or face_edges is None:
+        edges, face_edges = _unique_edges(faces)
+
+    corners = vertices[faces]
+    face_normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+
+    for start in range(0, len(origins), _PLANES_PER_CHUNK):
+        chunk = slice(start, start + _PLANES_PER_CHUNK)
+
+        # Each chunk is only sliced against the faces within the margin of its planes' origins
+        lo = origins[chunk].min(axis=0) - margin
+        hi = origins[chunk].max(axis=0) + margin
+        inside = np.all((vertices >= lo) & (vertices <= hi), axis=1)
+        kept = inside[faces].any(axis=1)
+
+        kept_edges, kept_face_edges = np.unique(face_edges[kept], return_inverse=True)
+        kept_vertices, kept_edge_vertices = np.unique(edges[kept_edges], return_inverse=True)
+
+        chunk_areas, chunk_open = _slice_chunk(
+            vertices[kept_vertices], np.searchsorted(kept_vertices, faces[kept]), face_normals[kept],
+            kept_edge_vertices.reshape(-1, 2), kept_face_edges.reshape(-1, 3), origins[chunk], normals[chunk]
+        )
+        chunk_areas[chunk_open] = np.inf
+        areas[chunk] = chunk_areas
+
+    return areas
+
+
+def area_profile(polyline: np.ndarray, mesh, spacing: float, crop_margin: float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Measures the cross-sectional area of the mesh along a polyline, in planes perpendicular to it.
+
+    :param polyline: The polyline
+    :param mesh: The trimesh mesh
+    :param spacing: The distance between sections along the polyline
+    :param crop_margin: Only the part of the mesh within this distance of a section's center along each axis is
+                        sliced. It must be larger than the sections that matter.
+    :return: (section centers, area of each section as returned by section_areas)
+    """
+
+    distances = np.arange(0, geom.accumulate(polyline)[-1], spacing)
+    points, tangents = resample(polyline, distances)
+
+    vertices, faces, edges, face_edges = crop(mesh, points, crop_margin)
+    return points, section_areas(vertices, faces, points, tangents, crop_margin, edges, face_edges)
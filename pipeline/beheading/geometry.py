@@ -1,5 +1,7 @@
 import numpy as np
 
+from . import kernels
+
 
 def lerp(a, b, t):
     return a + t * (b - a)
@@ -32,6 +34,11 @@ def accumulate(polyline: np.ndarray) -> np.ndarray:
 
 
 def point_and_tangent_along_polyline(polyline, dist_along_skel) -> tuple[np.ndarray, np.ndarray]:
+    if (numba_kernels := kernels.get()) is not None:
+        return numba_kernels.point_and_tangent_along_polyline(
+            np.ascontiguousarray(polyline, dtype=np.float64), float(dist_along_skel)
+        )
+
     tangents = compute_polyline_vertex_tangents(polyline)
     cumulative = np.concatenate([[0], accumulate(polyline)])
 
@@ -0,0 +1,48 @@
+"""
+Numba-compiled versions of the small per-spine geometry kernels in geometry and skel_helper. They are only used when
+Numba is installed; otherwise (or with the environment variable DSB_NUMBA=0) the NumPy implementations run instead.
+Both give the same results to floating point precision, which benchmarks/bench_kernels.py checks.
+
+Numba is imported and the kernels are compiled on first use, not when this module is imported, so opening the plugin
+stays fast. Compiled code is cached on disk, so only the first run on a machine pays for compilation.
+"""
+
+import importlib
+import os
+from types import ModuleType
+from typing import Optional
+
+_kernels = None
+_enabled = os.environ.get("DSB_NUMBA", "1") != "0"
+
+
+def set_enabled(enabled: bool) -> None:
+    """
+    Turn the Numba kernels on or off, e.g. to compare them against the NumPy implementations.
+
+    :param enabled: Whether to use the Numba kernels when Numba is installed
+    """
+
+    global _enabled
+    _enabled = enabled
+
+
+def get() -> Optional[ModuleType]:
+    """
+    Get the compiled kernels.
+
+    :return: The _numba_kernels module, or None if Numba is not installed or the kernels are turned off
+    """
+
+    global _kernels
+
+    if not _enabled:
+        return None
+
+    if _kernels is None:
+        try:
+            _kernels = importlib.import_module("._numba_kernels", __package__)
+        except ImportError:
+            _kernels = False
+
+    return _kernels or None
@@ -1,6 +1,108 @@
+import math
+from dataclasses import dataclass
+
 import numpy as np
 
 
+@dataclass(frozen=True)
+class SegmentTable:
+    """
+    Per-segment statistics of a skeleton. Built once when a payload is loaded so that the branch filter thresholds can
+    be changed without walking the skeleton again.
+    """
+
+    polylines: list[np.ndarray]  # The vertices of each segment, from the tip to where it joins its parent
+    radii: list[np.ndarray]  # The radius of each node in each segment
+    node_counts: np.ndarray  # The number of nodes in each segment
+    lengths: np.ndarray  # The length of each segment in nm
+    end_radii: np.ndarray  # The radius of the last node of each segment in nm
+    main_branch_dists: np.ndarray  # The distance from the last node of each segment to the main branch in nm
+    main_branch: int  # The index of the largest segment, which is likely the main branch
+
+    def __len__(self) -> int:
+        return len(self.polylines)
+
+    def select(self, min_length=1000, max_length=5000, min_nodes=5, max_nodes=30, radius_threshold=2000,
+               max_main_branch_dist=math.inf) -> np.ndarray:
+        """
+        Find the segments that pass the given thresholds. The main branch is never selected.
+
+        :param min_length: The minimum branch length in nanometers.
+        :param max_length: The maximum branch length in nanometers.
+        :param min_nodes: The minimum number of nodes in the branch.
+        :param max_nodes: The maximum number of nodes in the branch.
+        :param radius_threshold: The maximum radius of the last node in nanometers.
+        :param max_main_branch_dist: The maximum distance from the last node to the main branch in nanometers.
+        :return: The indices of the selected segments, in ascending order
+        """
+
+        if len(self) == 0:
+            return np.empty(0, dtype=np.int64)
+
+        keep = (
+            (self.node_counts >= min_nodes) & (self.node_counts <= max_nodes)
+            & (self.lengths >= min_length) & (self.lengths <= max_length)
+            & ~(self.end_radii >= radius_threshold)
+            & (self.main_branch_dists <= max_main_branch_dist)
+        )
+        keep[self.main_branch] = False
+
+        return np.flatnonzero(keep)
+
+
+def build_segment_table(skeleton) -> SegmentTable:
+    """
+    Compute the per-segment statistics of a skeleton in one pass over its segments.
+
+    :param skeleton: The skeletor skeleton
+    :return: The segment table
+    """
+
+    from scipy.spatial import KDTree
+
+    segments = skeleton.get_segments()
+    if not segments:
+        empty = np.empty(0)
+        return SegmentTable([], [], np.empty(0, dtype=np.int64), empty, empty, empty, main_branch=-1)
+
+    # skeleton.vertices builds a new array from the SWC table on every access, so fetch it once. The radius column is
+    #  looked up by node ID (the SWC index), matching skeleton.swc.loc[node_ids, "radius"]
+    vertices = skeleton.vertices
+    node_radius = skeleton.swc["radius"].reindex(np.arange(len(vertices))).to_numpy()
+
+    # Flatten all segments into one node array so every per-segment quantity is a single array operation
+    node_counts = np.fromiter((len(seg) for seg in segments), dtype=np.int64, count=len(segments))
+    offsets = np.concatenate(([0], np.cumsum(node_counts)[:-1]))
+    nodes = np.concatenate(segments)
+
+    seg_vertices = vertices[nodes]
+    seg_radii = node_radius[nodes]
+
+    # Edge lengths between consecutive flattened nodes. The edges joining the end of one segment to the start of the
+    #  next are zeroed, then np.add.reduceat sums the edges of each segment. The trailing zero keeps reduceat in bounds
+    #  for the last segment.
+    edge_lengths = np.zeros(len(nodes))
+    edge_lengths[:-1] = np.linalg.norm(np.diff(seg_vertices, axis=0), axis=1)
+    edge_lengths[offsets[1:] - 1] = 0
+    lengths = np.add.reduceat(edge_lengths, offsets)
+
+    ends = offsets + node_counts - 1
+    main_branch = int(np.argmax(node_counts))
+    polylines = np.split(seg_vertices, offsets[1:])
+
+    main_branch_dists, _ = KDTree(polylines[main_branch]).query(seg_vertices[ends])
+
+    return SegmentTable(
+        polylines=polylines,
+        radii=np.split(seg_radii, offsets[1:]),
+        node_counts=node_counts,
+        lengths=lengths,
+        end_radii=seg_radii[ends],
+        main_branch_dists=main_branch_dists,
+        main_branch=main_branch
+    )
+
+
 def get_branch_polylines_by_length(skeleton, min_length=1000, max_length=5000, min_nodes=5, max_nodes=30, radius_threshold=2000):
     """
     Extract branches from the skeleton based on length, node count, and each node's radius, and return a list of polylines
@@ -28,41 +130,9 @@ def get_branch_polylines_by_length(skeleton, min_length=1000, max_length=5000, m
     radii : list of np.ndarray
         A list of radii for each polyline, where each radii array corresponds to the radii of all nodes in the polyline.
     """
-    polylines = []
-    radii = []
-
-    # Identify the largest segment to skip later since it is likely the main branch
-    largest_segment = None
-    for seg in skeleton.get_segments():
-        if largest_segment is None or len(seg) > len(largest_segment):
-            largest_segment = seg
-
-    for seg in skeleton.get_segments():
-        if seg == largest_segment:
-            continue
-
-        # Check if the number of nodes in the branch are outside the specified range
-        if len(seg) < min_nodes or len(seg) > max_nodes:
-            continue
-
-        # Calculate the total length of the branch
-        branch_vertices = skeleton.vertices[seg]
-        branch_edges = np.diff(branch_vertices, axis=0)
-        branch_lengths = np.linalg.norm(branch_edges, axis=1)
-        total_length = np.sum(branch_lengths)
-
-        # Check if the branch length and last node's radius are outside the specified ranges
-        length_outside_range = total_length < min_length or total_length > max_length
-        last_node_radius_outside_range = skeleton.swc.loc[seg[-1], "radius"] >= radius_threshold
-
-        if length_outside_range or last_node_radius_outside_range:
-            continue
-
-        # Get the radii for all nodes in the branch
-        node_radii = skeleton.swc.loc[seg, "radius"].values
 
-        # Append the branch vertices as a polyline and its corresponding node radii
-        polylines.append(branch_vertices)
-        radii.append(node_radii)
+    table = build_segment_table(skeleton)
+    selected = table.select(min_length=min_length, max_length=max_length, min_nodes=min_nodes, max_nodes=max_nodes,
+                            radius_threshold=radius_threshold)
 
-    return polylines, radii
+    return [table.polylines[i] for i in selected], [table.radii[i] for i in selected]
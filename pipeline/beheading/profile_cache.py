@@ -0,0 +1,255 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Callable, Iterable, Optional
+
+import numpy as np
+
+# Bump when spine_analysis.radius_profile changes in a way that changes its output, so that profiles saved by older
+#  versions are ignored instead of reused
+PROFILE_VERSION = 2
+
+# Stored in the sidecar's user_version. A sidecar with a different layout is only a cache, so it is emptied and
+#  recreated instead of migrated.
+_SCHEMA_VERSION = 3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    payload_hash TEXT NOT NULL,
+    spine_idx INTEGER NOT NULL,
+    params TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    points BLOB NOT NULL,
+    radii BLOB NOT NULL,
+    PRIMARY KEY (payload_hash, spine_idx, params, version)
+)
+"""
+
+_INSERT = """
+INSERT OR REPLACE INTO profiles (payload_hash, spine_idx, params, version, points, radii) VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+_SELECT = """
+SELECT points, radii FROM profiles WHERE payload_hash = ? AND spine_idx = ? AND params = ? AND version = ?
+"""
+
+Profile = tuple[np.ndarray, np.ndarray]
+
+
+def payload_hash(filepath: str, chunk_size: int = 1 << 20) -> str:
+    """
+    Hash the contents of a preprocessing file, so cached results are never reused for a different or re-run file.
+    :param filepath: The path of the .dsb file
+    :param chunk_size: The number of bytes to read at a time
+    :return: The hex digest
+    """
+
+    digest = hashlib.blake2b(digest_size=16)
+    with open(filepath, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def sidecar_path_for_payload(dsb_path: str) -> str:
+    """
+    Get the path of the profile cache stored next to a preprocessing file.
+    :param dsb_path: The path of the .dsb file
+    :return: The path of the SQLite sidecar file
+    """
+
+    return os.path.splitext(dsb_path)[0] + ".profiles.sqlite"
+
+
+class ProfileCache:
+    """
+    Two-level cache of spine radius profiles (the output of spine_analysis.radius_profile) for one preprocessing file.
+    Profiles are kept in an in-memory LRU capped at `max_bytes`, and written through to an SQLite sidecar file so
+    that later sessions on the same file never ray cast a profile again. Entries are keyed by the payload hash, the
+    spine (segment) index and NeckParams.profile_key.
+    """
+
+    def __init__(self, payload_hash: str, sidecar_path: Optional[str] = None, max_bytes: int = 128 * 1024 ** 2,
+                 timeout: float = 30.0):
+        """
+        :param payload_hash: The hash of the preprocessing file, from payload_hash()
+        :param sidecar_path: The path of the SQLite sidecar file, or None to only cache in memory. If the file can't
+                             be opened (e.g. a read-only folder), the cache falls back to memory only.
+        :param max_bytes: The maximum size of the profiles kept in memory
+        :param timeout: How long to wait, in seconds, for another process to release the sidecar file
+        """
+
+        self.payload_hash = payload_hash
+        self.sidecar_path = sidecar_path
+        self.max_bytes = max_bytes
+
+        # The beheading worker and the GUI thread both use the cache, e.g. the GUI closes it when another file is loaded
+        #  while the worker may still be storing a profile in it
+        self._lock = threading.RLock()
+        self._memory: OrderedDict[tuple, Profile] = OrderedDict()
+        self._memory_bytes = 0
+        self._conn: Optional[sqlite3.Connection] = None
+
+        if sidecar_path is not None:
+            try:
+                self._conn = sqlite3.connect(sidecar_path, timeout=timeout, isolation_level=None,
+                                             check_same_thread=False)
+                if self._conn.execute("PRAGMA user_version").fetchone()[0] != _SCHEMA_VERSION:
+                    self._conn.execute("DROP TABLE IF EXISTS profiles")
+                    self._conn.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+
+                self._conn.execute(_SCHEMA)
+            except (sqlite3.Error, OSError):
+                self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _key(self, spine_idx: int, params) -> tuple:
+        # Numbers are stored as floats, so that e.g. spacing=6 from the plugin and spacing=6.0 from a sweep share a key
+        profile_key = tuple(
+            float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else value
+            for value in params.profile_key
+        )
+        return int(spine_idx), repr(profile_key)
+
+    def _remember(self, key: tuple, profile: Profile) -> None:
+        """
+        Add a profile to the in-memory LRU, evicting the least recently used profiles beyond max_bytes.
+        """
+
+        if key in self._memory:
+            self._memory_bytes -= sum(array.nbytes for array in self._memory.pop(key))
+
+        self._memory[key] = profile
+        self._memory_bytes += sum(array.nbytes for array in profile)
+
+        while self._memory_bytes > self.max_bytes and len(self._memory) > 1:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= sum(array.nbytes for array in evicted)
+
+    def _row(self, key: tuple, profile: Profile) -> tuple:
+        points, radii = profile
+        return (
+            self.payload_hash, *key, PROFILE_VERSION,
+            np.ascontiguousarray(points, dtype=np.float64).tobytes(),
+            np.ascontiguousarray(radii, dtype=np.float64).tobytes()
+        )
+
+    def get(self, spine_idx: int, params) -> Optional[Profile]:
+        """
+        Look up a profile, first in memory and then in the sidecar file.
+        :param spine_idx: The segment index of the spine
+        :param params: The NeckParams the profile was computed with
+        :return: (sample points, radii), or None if the profile has not been cached
+        """
+
+        key = self._key(spine_idx, params)
+
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+
+            if self._conn is None:
+                return None
+
+            try:
+                row = self._conn.execute(_SELECT, (self.payload_hash, *key, PROFILE_VERSION)).fetchone()
+            except sqlite3.Error:
+                return None
+
+            if row is None:
+                return None
+
+            profile = np.frombuffer(row[0], dtype=np.float64).reshape(-1, 3), np.frombuffer(row[1], dtype=np.float64)
+            self._remember(key, profile)
+            return profile
+
+    def get_many(self, spine_indices: Iterable[int], params) -> dict[int, Profile]:
+        """
+        Look up many profiles.
+        :param spine_indices: The segment indices of the spines
+        :param params: The NeckParams the profiles were computed with
+        :return: The cached profiles, keyed by segment index. Spines without a cached profile are left out.
+        """
+
+        found = {}
+        for spine_idx in spine_indices:
+            if (profile := self.get(spine_idx, params)) is not None:
+                found[int(spine_idx)] = profile
+
+        return found
+
+    def put(self, spine_idx: int, params, profile: Profile) -> None:
+        """
+        Cache a profile in memory and in the sidecar file.
+        :param spine_idx: The segment index of the spine
+        :param params: The NeckParams the profile was computed with
+        :param profile: (sample points, radii)
+        """
+
+        self.put_many({spine_idx: profile}, params)
+
+    def put_many(self, profiles: dict[int, Profile], params) -> None:
+        """
+        Cache many profiles, writing them to the sidecar file in a single transaction.
+        :param profiles: (sample points, radii) keyed by segment index
+        :param params: The NeckParams the profiles were computed with
+        """
+
+        rows = [self._row(self._key(spine_idx, params), profile) for spine_idx, profile in profiles.items()]
+
+        with self._lock:
+            for spine_idx, profile in profiles.items():
+                self._remember(self._key(spine_idx, params), profile)
+
+            # Closed, e.g. because another file was loaded while the profiles were being computed
+            if self._conn is None or not rows:
+                return
+
+            # A sidecar that can't be written to (e.g. locked for longer than the timeout) only costs a recompute later
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    self._conn.executemany(_INSERT, rows)
+                except sqlite3.Error:
+                    self._conn.execute("ROLLBACK")
+                    raise
+
+                self._conn.execute("COMMIT")
+            except sqlite3.Error:
+                pass
+
+    def get_or_compute(self, spine_idx: int, params, compute: Callable[[], Profile]) -> Profile:
+        """
+        Get a cached profile, or compute and cache it.
+        :param spine_idx: The segment index of the spine
+        :param params: The NeckParams the profile is computed with
+        :param compute: Computes the profile if it is not cached
+        :return: (sample points, radii)
+        """
+
+        profile = self.get(spine_idx, params)
+        if profile is None:
+            profile = compute()
+            self.put(spine_idx, params, profile)
+
+        return profile
+
+    def close(self) -> None:
+        """
+        Close the sidecar file. The in-memory profiles are kept, and profiles stored afterwards are only kept in memory.
+        Safe to call while another thread is using the cache.
+        """
+
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
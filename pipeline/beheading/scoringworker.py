@@ -0,0 +1,68 @@
+from PyQt6.QtCore import QThread, pyqtSignal
+
+import traceback
+from typing import Optional, Sequence, TYPE_CHECKING
+
+from . import confidence, spine_analysis
+from .beheadingworker import Cancelled
+from .. import distance_field, telemetry
+
+if TYPE_CHECKING:
+    import trimesh
+
+
+class ScoringWorker(QThread):
+    """
+    Scores spines for auto-accepting off the GUI thread. Scoring many spines takes a while, so it runs here rather than
+    on the BeheadingWorker, where it would hold up the neck points of the spines being visited.
+    """
+
+    finished: pyqtSignal = pyqtSignal()
+
+    def __init__(self, generation: int, spine_indices: Sequence[int], segment_table, mesh: "trimesh.Trimesh", psds,
+                 cache, params: spine_analysis.NeckParams):
+        """
+        :param generation: The load generation of the file the spines are from
+        """
+
+        super().__init__()
+
+        self.generation = generation
+        self.spine_indices = spine_indices
+        self.segment_table = segment_table
+        self.mesh = mesh
+        self.psds = psds
+        self.cache = cache
+        self.params = params
+
+        self.result: Optional[list[confidence.SpineConfidence]] = None
+        self.error: Optional[Exception] = None
+        self._cancelled = False
+
+    def cancel(self) -> None:
+        self._cancelled = True
+
+    def check_cancelled(self) -> None:
+        if self._cancelled:
+            raise Cancelled()
+
+    def run(self):
+        try:
+            # A separate mesh object sharing the same arrays, so that trimesh's cache isn't shared with the beheading
+            #  worker's thread
+            import trimesh
+            local_mesh = trimesh.Trimesh(vertices=self.mesh.vertices, faces=self.mesh.faces, process=False)
+            distance_field.attach(local_mesh, distance_field.get(self.mesh))
+
+            with telemetry.stage("confidence", spines=len(self.spine_indices)):
+                self.result = confidence.score_spines(
+                    self.spine_indices, self.segment_table, local_mesh, self.psds, self.cache, self.params,
+                    check_cancelled=self.check_cancelled
+                )
+        except Cancelled:
+            pass
+        except Exception as e:
+            traceback.print_exception(e)
+            self.error = e
+        finally:
+            self.finished.emit()
@@ -1,10 +1,157 @@
-import numpy as np
+import math
 import numbers
+import os
+import weakref
+
+import numpy as np
+
+from . import kernels
+
+# ncollpyde, scipy, skeletor and trimesh are imported inside the functions that use them so that importing this module
+#  (and opening the plugin window) stays fast
+
+# Used to order direction sets so that every prefix is spread evenly
+_GOLDEN = (1 + 5 ** 0.5) / 2
+
+_AGG_MAP = {
+    'mean': np.mean, 'max': np.max, 'min': np.min, 'median': np.median,
+    'percentile75': lambda x: np.percentile(x, 75), 'percentile99': lambda x: np.percentile(x, 99)
+}
+
+# The percentile each aggregate other than the mean is equal to
+_AGG_PERCENTILE = {'max': 100, 'min': 0, 'median': 50, 'percentile75': 75, 'percentile99': 99}
+
+# The collision volume (BVH) of each mesh, with the mesh hash and precision it was built for. Weak keys so meshes can be
+#  freed.
+_volumes = weakref.WeakKeyDictionary()
+
+# ncollpyde needs several hundred bytes per ray while a query runs, so larger queries are split into chunks of this many
+#  rays. That is still plenty to keep every core busy.
+_RAYS_PER_QUERY = 1 << 16
+
+# Opt-in float32 ray casting. Set with the environment variable DSB_FLOAT32=1 or set_float32().
+_float32 = os.environ.get("DSB_FLOAT32", "0") == "1"
+
+
+def set_float32(enabled: bool) -> None:
+    """
+    Turn float32 ray casting on or off. When on and the embreex package is installed, ray casting uses Embree's
+    float32 BVH (see EmbreeVolume), which takes about half the memory of ncollpyde's float64 one. Meshes stay float64
+    so that head volumes and centroids are computed at full precision.
+
+    :param enabled: Whether to cast rays in float32
+    """
+
+    global _float32
+    _float32 = enabled
+
+
+class EmbreeVolume:
+    """
+    The parts of the ncollpyde.Volume interface that this module uses, backed by Embree through trimesh. Embree builds
+    its BVH in float32, which is plenty for nanometre coordinates of a cell-sized mesh.
+    """
+
+    def __init__(self, mesh):
+        """
+        :param mesh: The trimesh mesh
+        :raises ImportError: If embreex is not installed
+        """
+
+        import embreex  # noqa: F401 (trimesh silently falls back to a slow pure Python intersector without it)
+        from trimesh.ray.ray_pyembree import RayMeshIntersector
+
+        self.mesh = mesh
+        self._intersector = RayMeshIntersector(mesh)
+
+    def intersections(self, sources, targets):
+        """
+        The first intersection of each line segment with the mesh, like ncollpyde.Volume.intersections.
+
+        :param sources: The (N, 3) segment starts
+        :param targets: The (N, 3) segment ends
+        :return: (index of each segment with a hit, (K, 3) hit locations, whether each hit is on the back of a face)
+        """
 
-import ncollpyde
-import scipy
+        sources = np.asarray(sources, dtype=np.float64)
+        vectors = np.asarray(targets, dtype=np.float64) - sources
+        lengths = np.linalg.norm(vectors, axis=1)
 
-from skeletor.post.radiusextraction import fibonacci_sphere
+        locations, index_ray, index_tri = self._intersector.intersects_location(
+            sources, vectors / lengths[:, np.newaxis], multiple_hits=False
+        )
+
+        # Embree casts infinite rays, so drop the hits past the end of each segment
+        keep = np.linalg.norm(locations - sources[index_ray], axis=1) <= lengths[index_ray]
+        order = np.argsort(index_ray[keep], kind="stable")
+        index_ray, locations, index_tri = index_ray[keep][order], locations[keep][order], index_tri[keep][order]
+
+        triangles = self.mesh.vertices[self.mesh.faces[index_tri]]
+        normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+        is_backface = np.einsum("ij,ij->i", normals, vectors[index_ray]) > 0
+
+        return index_ray, locations, is_backface
+
+    def contains(self, points):
+        """
+        Whether each point is inside the mesh, like ncollpyde.Volume.contains.
+
+        :param points: The (N, 3) points
+        :return: An (N,) boolean array
+        """
+
+        return self._intersector.contains_points(np.asarray(points, dtype=np.float64))
+
+
+def intersect(coll, sources, targets):
+    """
+    coll.intersections, split into queries of at most _RAYS_PER_QUERY rays to bound memory use.
+
+    :param coll: The collision volume, from collision_volume
+    :param sources: The (N, 3) ray starts
+    :param targets: The (N, 3) ray ends
+    :return: (index of each ray with a hit, (K, 3) hit locations, whether each hit is on the back of a face)
+    """
+
+    if len(sources) <= _RAYS_PER_QUERY:
+        return coll.intersections(sources, targets)
+
+    chunks = []
+    for first in range(0, len(sources), _RAYS_PER_QUERY):
+        last = first + _RAYS_PER_QUERY
+        ix, loc, is_backface = coll.intersections(sources[first:last], targets[first:last])
+        chunks.append((ix + first, loc, is_backface))
+
+    return tuple(np.concatenate(arrays) for arrays in zip(*chunks))
+
+
+def collision_volume(mesh):
+    """
+    Get the collision volume used for ray casting against a mesh: an ncollpyde Volume, or an EmbreeVolume in float32
+    mode (see set_float32) if embreex is installed. Only built the first time it is needed or if the mesh has changed.
+
+    :param mesh: The trimesh mesh
+    :return: The ncollpyde Volume or EmbreeVolume
+    """
+
+    mesh_hash = hash(mesh)  # trimesh caches this and changes it when the vertices or faces change
+    cached = _volumes.get(mesh)
+    if cached is not None and cached[0] == mesh_hash and cached[1] == _float32:
+        return cached[2]
+
+    coll = None
+    if _float32:
+        try:
+            coll = EmbreeVolume(mesh)
+        except ImportError:
+            pass
+
+    if coll is None:
+        import ncollpyde
+        coll = ncollpyde.Volume(mesh.vertices, mesh.faces, validate=False)
+
+    _volumes[mesh] = (mesh_hash, _float32, coll)
+    return coll
 
 
 def interpolate_along_path(points, spacing):
@@ -16,6 +163,9 @@ def interpolate_along_path(points, spacing):
     Returns:
         np.ndarray: An (M, 3) array of interpolated 3D points.
     """
+    if (numba_kernels := kernels.get()) is not None:
+        return numba_kernels.interpolate_along_path(np.ascontiguousarray(points, dtype=np.float64), float(spacing))
+
     # Calculate distances between consecutive points
     diffs = np.diff(points, axis=0)
     seg_lengths = np.linalg.norm(diffs, axis=1)
@@ -47,9 +197,19 @@ def rotate_points_to_normal(points, target_normal):
         np.ndarray: The rotated points.
     """
 
-    n0 = np.array([0, 0, 1])  # Original normal vector
-
     target_normal /= np.linalg.norm(target_normal)
+    return points.dot(rotation_to_normal(target_normal).T)
+
+
+def rotation_to_normal(target_normal):
+    """
+    The rotation matrix that turns [0, 0, 1] into target_normal.
+
+    :param target_normal: A normalized 3D vector
+    :return: A (3, 3) rotation matrix
+    """
+
+    n0 = np.array([0, 0, 1])  # Original normal vector
 
     # Compute the rotation axis via the cross product between n0 and target_normal
     axis = np.cross(n0, target_normal)
@@ -60,13 +220,11 @@ def rotate_points_to_normal(points, target_normal):
     if np.isclose(axis_norm, 0):
         if np.allclose(target_normal, -n0):  # Rotate 180 degrees if the normals are antiparallel
             # For a 180-degree rotation, we can rotate around any axis perpendicular to n0. The x-axis is chosen.
-            R = np.array([[1, 0, 0],
-                          [0, -1, 0],
-                          [0, 0, -1]])
-
-            return points.dot(R.T)
+            return np.array([[1, 0, 0],
+                             [0, -1, 0],
+                             [0, 0, -1]])
 
-        return points
+        return np.eye(3)
 
     axis /= axis_norm  # Normalize rotation axis
     theta = np.arccos(np.clip(np.dot(n0, target_normal), -1.0, 1.0))  # Rotation angle
@@ -77,10 +235,22 @@ def rotate_points_to_normal(points, target_normal):
                   [-axis[1], axis[0], 0]])
 
     # Rodrigues' rotation formula: R = I + sin(theta)*K + (1-cos(theta))*K^2
-    R = np.eye(3) + np.sin(theta) * K + (1 - np.cos(theta)) * np.dot(K, K)
+    return np.eye(3) + np.sin(theta) * K + (1 - np.cos(theta)) * np.dot(K, K)
+
 
-    return points.dot(R.T)  # Apply rotation and return
 
+def rotations_to_normals(normals):
+    """
+    rotation_to_normal for many normals.
+
+    :param normals: An (N, 3) array of normalized 3D vectors
+    :return: An (N, 3, 3) array of rotation matrices
+    """
+
+    if (numba_kernels := kernels.get()) is not None:
+        return numba_kernels.rotations_to_normals(np.ascontiguousarray(normals, dtype=np.float64))
+
+    return np.stack([rotation_to_normal(normal) for normal in normals]).reshape(-1, 3, 3)
 
 
 def polyline_tangents(points):
@@ -137,8 +307,10 @@ def get_radius_knn(coords, mesh, n=5, aggregate='mean'):
     assert aggregate in agg_map
     agg_func = agg_map[aggregate]
 
+    from scipy.spatial import cKDTree
+
     # Generate kdTree
-    tree = scipy.spatial.cKDTree(mesh.vertices)
+    tree = cKDTree(mesh.vertices)
 
     # Query for coordinates
     dist, ix = tree.query(coords, k=5)
@@ -176,79 +348,120 @@ def get_radius_polyline(polyline, mesh, n_rays=20, aggregate='mean', projection=
     :returns (points sampled, their corresponding radii)
 
     """
-    agg_map = {'mean': np.mean, 'max': np.max, 'min': np.min,
-               'median': np.median, 'percentile75': lambda x: np.percentile(x, 75), 'percentile99': lambda x: np.percentile(x, 99)}
-    assert aggregate in agg_map
-    agg_func = agg_map[aggregate]
 
-    assert projection in ['sphere', 'tangents']
-    assert (fallback == 'knn') or isinstance(fallback, numbers.Number) or isinstance(fallback, type(None))
+    return get_radius_polylines(
+        [polyline], mesh, n_rays=n_rays, aggregate=aggregate, projection=projection, fallback=fallback,
+        path_interpolation_spacing=path_interpolation_spacing
+    )[0]
 
-    # Get max dimension of mesh
-    dim = polyline.max(axis=0) - polyline.min(axis=0)
-    radius = max(dim)
 
-    # Vertices for each point on the circle
-    points = interpolate_along_path(polyline, path_interpolation_spacing)
-    sources = np.repeat(points, n_rays, axis=0)
+def aggregate_groups(values, groups, n_groups, aggregate='mean'):
+    """
+    Aggregates values by group without a Python loop over the groups. Gives the same results as calling the
+    aggregate function of get_radius_polyline on the values of each group.
+
+    :param values: The values, shape (N,)
+    :param groups: The group index of each value in [0, n_groups), shape (N,)
+    :param n_groups: The number of groups
+    :param aggregate: "mean" | "median" | "max" | "min" | "percentile75" | "percentile99"
+    :return: The aggregate of each group, or 0 for groups without values, shape (n_groups,)
+    """
 
-    if projection == 'sphere':
-        # Repeat points n_rays times
-        sources = np.repeat(points, n_rays, axis=0)
+    assert aggregate in _AGG_MAP
 
-        targets = fibonacci_sphere(n_rays, randomize=True) * radius  # Uniform sphere points sphere scaled by radius
-        targets = np.tile(targets, (points.shape[0], 1))  # Reshape to match sources
-        targets += sources # Offset onto sources
-    else:
-        tangents = polyline_tangents(points)
+    if (numba_kernels := kernels.get()) is not None:
+        return numba_kernels.aggregate_groups(
+            np.ascontiguousarray(values, dtype=np.float64), np.ascontiguousarray(groups, dtype=np.int64), n_groups,
+            _AGG_PERCENTILE.get(aggregate, 0), aggregate == 'mean'
+        )
 
-        # Follow these steps:
-        #  1. Create a unit disk of n_rays points along axes x and y
-        #  2. Scale the unit disk by radius
-        #  3. Duplicate the disk by the number of points to equal the length of sources: shape [len(points), n_rays, 3]
-        #  4. Rotate the unit disk to align with the tangent vector
-        #  5. Define a targets array by adding the rotated disk to the sources
+    result = np.zeros(n_groups)
+    counts = np.bincount(groups, minlength=n_groups)
+    has_values = counts > 0
 
-        # Step 1
-        zero_to_2pi = np.linspace(0, 2 * np.pi, n_rays, endpoint=False)
-        disk = np.column_stack((np.cos(zero_to_2pi), np.sin(zero_to_2pi), np.zeros(n_rays)))
+    if aggregate == 'mean':
+        result[has_values] = np.bincount(groups, weights=values, minlength=n_groups)[has_values] / counts[has_values]
+        return result
 
-        # Step 2
-        disk *= radius
+    # Sort by group, then by value, so that each group's values are a sorted run
+    order = np.lexsort((values, groups))
+    values = values[order]
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[has_values]
+    counts = counts[has_values]
 
-        # Step 3
-        disk = np.repeat(disk[np.newaxis, :, :], points.shape[0], axis=0)
+    # np.percentile's default linear interpolation between the two closest ranks
+    rank = (counts - 1) * (_AGG_PERCENTILE[aggregate] / 100)
+    below = np.floor(rank).astype(np.int64)
+    above = np.minimum(below + 1, counts - 1)
+    fraction = rank - below
 
-        # Step 4
-        for i, tangent in enumerate(tangents):
-            disk[i] = rotate_points_to_normal(disk[i], tangent)
+    # Interpolated from the closer rank, like np.percentile
+    low, high = values[starts + below], values[starts + above]
+    result[has_values] = np.where(fraction >= 0.5, high - (high - low) * (1 - fraction), low + (high - low) * fraction)
+    return result
 
-        # Step 5
-        disk = disk.reshape(-1, 3)
-        targets = sources + disk
 
-    # Initialize ncollpyde Volume
-    coll = ncollpyde.Volume(mesh.vertices, mesh.faces, validate=False)
+def get_radius_polylines(polylines, mesh, n_rays=20, aggregate='mean', projection='sphere', fallback='knn',
+                         path_interpolation_spacing=5):
+    """
+    get_radius_polyline for many polylines at once. The rays of every polyline are cast in a single
+    ncollpyde query, which spreads the work across all cores instead of a few thousand rays at a time.
+
+    :param polylines: The (N, 3) polylines
+    :param mesh: The trimesh mesh
+    :param n_rays: Number of rays to cast for each sample
+    :param aggregate: As in get_radius_polyline
+    :param projection: As in get_radius_polyline
+    :param fallback: As in get_radius_polyline
+    :param path_interpolation_spacing: The distance between samples along each polyline
+    :return: (points sampled, their radii) of each polyline
+    """
+
+    from skeletor.post.radiusextraction import fibonacci_sphere
+
+    assert aggregate in _AGG_MAP
+    assert projection in ['sphere', 'tangents']
+    assert (fallback == 'knn') or isinstance(fallback, numbers.Number) or isinstance(fallback, type(None))
+
+    if len(polylines) == 0:
+        return []
+
+    all_points = []
+    all_targets = []
+
+    for polyline in polylines:
+        # Rays reach as far as the largest dimension of the polyline
+        radius = max(polyline.max(axis=0) - polyline.min(axis=0))
+        points = interpolate_along_path(polyline, path_interpolation_spacing)
+
+        if projection == 'sphere':
+            offsets = fibonacci_sphere(n_rays, randomize=True) * radius  # Uniform sphere points scaled by radius
+            offsets = np.broadcast_to(offsets, (len(points), n_rays, 3))
+        else:
+            # A disk of n_rays points in the xy-plane scaled by radius, rotated to be orthogonal to the tangent at
+            #  each point
+            zero_to_2pi = np.linspace(0, 2 * np.pi, n_rays, endpoint=False)
+            disk = np.column_stack((np.cos(zero_to_2pi), np.sin(zero_to_2pi), np.zeros(n_rays))) * radius
+            rotations = rotations_to_normals(polyline_tangents(points))
+            offsets = disk @ rotations.transpose(0, 2, 1)
+
+        all_points.append(points)
+        all_targets.append((points[:, np.newaxis, :] + offsets).reshape(-1, 3))
+
+    points = np.concatenate(all_points)
+    sources = np.repeat(points, n_rays, axis=0)
+    targets = np.concatenate(all_targets)
+
+    coll = collision_volume(mesh)
 
     # Get intersections: `ix` points to index of line segment; `loc` is the
     #  x/y/z coordinate of the intersection and `is_backface` is True if
     # intersection happened at the inside of a mesh
-    ix, loc, is_backface = coll.intersections(sources, targets)
+    ix, loc, is_backface = intersect(coll, sources, targets)
 
-    # Calculate intersection distances
+    # Calculate intersection distances, then aggregate them by the sample point each ray came from
     dist = np.sqrt(np.sum((sources[ix] - loc) ** 2, axis=1))
-
-    # Map from `ix` back to index of original point
-    org_ix = (ix / n_rays).astype(int)
-
-    # Split by original index
-    split_ix = np.where(org_ix[:-1] - org_ix[1:])[0]
-    split = np.split(dist, split_ix)
-
-    # Aggregate over each original ix
-    final_dist = np.zeros(points.shape[0])
-    for l, i in zip(split, np.unique(org_ix)):
-        final_dist[i] = agg_func(l)
+    final_dist = aggregate_groups(dist, ix // n_rays, len(points), aggregate)
 
     if not isinstance(fallback, type(None)):
         # See if any needs fixing
@@ -262,7 +475,9 @@ def get_radius_polyline(polyline, mesh, n_rays=20, aggregate='mean', projection=
             elif fallback == 'knn':
                 final_dist[needs_fix] = get_radius_knn(points[needs_fix], mesh, aggregate=aggregate)
 
-    return points, final_dist
+    # Split the samples back up by polyline
+    split_at = np.cumsum([len(polyline_points) for polyline_points in all_points])[:-1]
+    return list(zip(np.split(points, split_at), np.split(final_dist, split_at)))
 
 
 def get_radius_point(point: np.ndarray, mesh, n_rays=20, aggregate='mean', projection='sphere', fallback='knn'):
@@ -291,10 +506,10 @@ def get_radius_point(point: np.ndarray, mesh, n_rays=20, aggregate='mean', proje
     :returns radius at point
 
     """
-    agg_map = {'mean': np.mean, 'max': np.max, 'min': np.min,
-               'median': np.median, 'percentile75': lambda x: np.percentile(x, 75), 'percentile99': lambda x: np.percentile(x, 99)}
-    assert aggregate in agg_map
-    agg_func = agg_map[aggregate]
+    from skeletor.post.radiusextraction import fibonacci_sphere
+
+    assert aggregate in _AGG_MAP
+    agg_func = _AGG_MAP[aggregate]
 
     assert projection in ['sphere', 'tangents']
     assert (fallback == 'knn') or isinstance(fallback, numbers.Number) or isinstance(fallback, type(None))
@@ -338,8 +553,7 @@ def get_radius_point(point: np.ndarray, mesh, n_rays=20, aggregate='mean', proje
         disk = disk.reshape(-1, 3)
         targets = sources + disk
 
-    # Initialize ncollpyde Volume
-    coll = ncollpyde.Volume(mesh.vertices, mesh.faces, validate=False)
+    coll = collision_volume(mesh)
 
     # Get intersections: `ix` points to index of line segment; `loc` is the
     #  x/y/z coordinate of the intersection and `is_backface` is True if
@@ -374,3 +588,208 @@ def get_radius_point(point: np.ndarray, mesh, n_rays=20, aggregate='mean', proje
                 final_dist[needs_fix] = get_radius_knn(np.array([point]), mesh, aggregate=aggregate)
 
     return final_dist
+
+
+def interpolate_at(points, distances):
+    """
+    Interpolates points at the given distances along a 3D polyline.
+
+    :param points: An (N, 3) array of 3D points defining the path.
+    :param distances: The distances along the path to sample at.
+    :return: A (len(distances), 3) array of interpolated 3D points.
+    """
+
+    s = np.concatenate(([0], np.cumsum(np.linalg.norm(np.diff(points, axis=0), axis=1))))
+    return np.column_stack([np.interp(distances, s, points[:, axis]) for axis in range(3)])
+
+
+def progressive_order(n):
+    """
+    A permutation of range(n) where every prefix is spread evenly over the range, treating it as a circle. Steps by
+    the number coprime to n closest to n / golden ratio, which is a discrete version of the golden-angle sequence.
+
+    :param n: The number of indices
+    :return: An (n,) integer array
+    """
+
+    if n <= 2:
+        return np.arange(n)
+
+    candidates = [step for step in range(1, n) if math.gcd(step, n) == 1]
+    step = min(candidates, key=lambda candidate: abs(candidate - n / _GOLDEN))
+    return (np.arange(n) * step) % n
+
+
+def progressive_disk_directions(n):
+    """
+    The n evenly spaced unit vectors in the xy-plane that get_radius_polyline casts, ordered by progressive_order so
+    that the first k of them are spread evenly around the circle for any k.
+
+    :param n: The number of directions
+    :return: An (n, 3) array
+    """
+
+    angles = np.linspace(0, 2 * np.pi, n, endpoint=False)[progressive_order(n)]
+    return np.column_stack((np.cos(angles), np.sin(angles), np.zeros(n)))
+
+
+def progressive_sphere_directions(n):
+    """
+    The n points of a (non-randomized) Fibonacci sphere, ordered by progressive_order so that the first k of them are
+    spread evenly over the sphere for any k.
+
+    :param n: The number of directions
+    :return: An (n, 3) array
+    """
+
+    from skeletor.post.radiusextraction import fibonacci_sphere
+
+    return np.asarray(fibonacci_sphere(n, randomize=False))[progressive_order(n)]
+
+
+def _ray_rounds(min_rays, max_rays):
+    """The cumulative ray counts of each round: min_rays, then doubling, capped at max_rays."""
+
+    counts = [min(min_rays, max_rays)]
+    while counts[-1] < max_rays:
+        counts.append(min(counts[-1] * 2, max_rays))
+
+    return counts
+
+
+def cast_until_converged(mesh, sources, offsets, max_rays, min_rays=16, tolerance=0.02, aggregate='percentile99'):
+    """
+    Ray casting where each source gets more rays only until its aggregated hit distance stops changing. Rays are cast
+    in rounds (min_rays, then doubling up to max_rays). After each round a source is done if its estimate changed by
+    at most `tolerance` (a fraction) since the previous round.
+
+    :param mesh: The trimesh mesh
+    :param sources: An (N, 3) array of ray origins
+    :param offsets: A function taking (source indices, first ray, last ray) and returning the ray vectors of those
+                    sources, shape (len(indices), last ray - first ray, 3). Rays must come from a fixed, progressive
+                    direction set so that results are deterministic.
+    :param max_rays: The maximum number of rays per source
+    :param min_rays: The number of rays in the first round
+    :param tolerance: The relative change below which an estimate has converged
+    :param aggregate: How hit distances are aggregated, as in get_radius_polyline
+    :return: (aggregated distance of each source (0 if nothing was hit), number of rays cast from each source)
+    """
+
+    assert aggregate in _AGG_MAP
+
+    coll = collision_volume(mesh)
+
+    n = len(sources)
+    hit_owners = np.empty(0, dtype=np.int64)
+    hit_dists = np.empty(0)
+    estimates = np.zeros(n)
+    ray_counts = np.zeros(n, dtype=np.int64)
+    active = np.arange(n)
+
+    first = 0
+    for round_idx, last in enumerate(_ray_rounds(min_rays, max_rays)):
+        if len(active) == 0:
+            break
+
+        rays = offsets(active, first, last)  # (len(active), last - first, 3)
+        round_sources = np.repeat(sources[active], last - first, axis=0)
+        ix, loc, _ = intersect(coll, round_sources, round_sources + rays.reshape(-1, 3))
+
+        hit_owners = np.concatenate((hit_owners, active[ix // (last - first)]))
+        hit_dists = np.concatenate((hit_dists, np.linalg.norm(round_sources[ix] - loc, axis=1)))
+
+        previous = estimates[active].copy()
+        estimates[active] = aggregate_groups(hit_dists, hit_owners, n, aggregate)[active]
+        ray_counts[active] = last
+
+        if round_idx > 0:
+            change = np.abs(estimates[active] - previous)
+            active = active[change > tolerance * estimates[active]]
+
+        first = last
+
+    return estimates, ray_counts
+
+
+def get_radius_polyline_adaptive(polyline, mesh, max_rays=150, min_rays=16, tolerance=0.02, aggregate='percentile99',
+                                 fallback='knn', spacing=24, distances=None, tangent_spacing=None):
+    """
+    Like get_radius_polyline with projection='tangents', but with adaptive ray counts (see cast_until_converged)
+    from a fixed direction set, so the result is deterministic.
+
+    :param polyline: A (N, 3) array of 3D points defining the polyline.
+    :param mesh: The trimesh mesh
+    :param max_rays: The maximum number of rays per sample
+    :param min_rays: The number of rays per sample in the first round
+    :param tolerance: The relative change in radius below which a sample stops getting more rays
+    :param aggregate: How hit distances are aggregated, as in get_radius_polyline
+    :param fallback: As in get_radius_polyline
+    :param spacing: The distance between samples along the polyline, if distances is not given
+    :param distances: The distances along the polyline to sample at. Overrides spacing.
+    :param tangent_spacing: The distance to the points on either side of a sample used for its tangent. Defaults to
+                            spacing. The tangents are the same as polyline_tangents of the samples
+                            np.arange(0, length, tangent_spacing), the ones get_radius_polyline uses.
+    :return: (points sampled, their radii, number of rays cast from each point)
+    """
+
+    length = np.sum(np.linalg.norm(np.diff(polyline, axis=0), axis=1))
+    if distances is None:
+        distances = np.arange(0, length, spacing)
+
+    distances = np.asarray(distances, dtype=np.float64)
+    tangent_spacing = spacing if tangent_spacing is None else tangent_spacing
+    last_sample = np.arange(0, length, tangent_spacing)[-1]
+
+    points = interpolate_at(polyline, distances)
+    tangents = (interpolate_at(polyline, np.minimum(distances + tangent_spacing, last_sample))
+                - interpolate_at(polyline, np.maximum(distances - tangent_spacing, 0)))
+    tangents /= np.linalg.norm(tangents, axis=1, keepdims=True)
+
+    # Rays reach as far as the largest dimension of the polyline, as in get_radius_polyline
+    radius = max(polyline.max(axis=0) - polyline.min(axis=0))
+    rotations = rotations_to_normals(tangents)
+    disk = progressive_disk_directions(max_rays) * radius
+
+    def offsets(indices, first, last):
+        return np.einsum("nij,kj->nki", rotations[indices], disk[first:last])
+
+    radii, ray_counts = cast_until_converged(mesh, points, offsets, max_rays, min_rays, tolerance, aggregate)
+
+    if fallback is not None:
+        needs_fix = ~collision_volume(mesh).contains(points) | (radii == 0)
+
+        if any(needs_fix):
+            if isinstance(fallback, numbers.Number):
+                radii[needs_fix] = fallback
+            elif fallback == 'knn':
+                radii[needs_fix] = get_radius_knn(points[needs_fix], mesh, aggregate=aggregate)
+
+    return points, radii, ray_counts
+
+
+def get_radius_point_adaptive(point, mesh, max_rays=500, min_rays=16, tolerance=0.02, aggregate='percentile99',
+                              fallback='knn'):
+    """
+    Like get_radius_point with projection='sphere', but with adaptive ray counts (see cast_until_converged) from a
+    fixed direction set, so the result is deterministic.
+
+    :return: (radius at point, number of rays cast)
+    """
+
+    # Rays reach as far as the largest dimension of the mesh, as in get_radius_point
+    radius = max(mesh.vertices.max(axis=0) - mesh.vertices.min(axis=0))
+    sphere = progressive_sphere_directions(max_rays) * radius
+
+    def offsets(indices, first, last):
+        return np.broadcast_to(sphere[first:last], (len(indices), last - first, 3))
+
+    points = np.array([point], dtype=np.float64)
+    radii, ray_counts = cast_until_converged(mesh, points, offsets, max_rays, min_rays, tolerance, aggregate)
+
+    if fallback is not None and (not collision_volume(mesh).contains(points)[0] or radii[0] == 0):
+        if isinstance(fallback, numbers.Number):
+            radii[0] = fallback
+        elif fallback == 'knn':
+            radii[0] = get_radius_knn(points, mesh, aggregate=aggregate)[0]
+
+    return radii[0], int(ray_counts[0])
@@ -1,11 +1,157 @@
-from sklearn.pipeline import make_pipeline
-from sklearn.preprocessing import PolynomialFeatures, StandardScaler
-from scipy.signal import find_peaks
-from sklearn.linear_model import Ridge
+import os
+from dataclasses import dataclass
+
 import numpy as np
 
+from . import cross_section
 from . import geometry as geom
 from . import skel_helper
+from .. import distance_field as dfield
+from .. import telemetry
+
+ENGINES = ("rays", "cross_section", "distance_field")
+
+# The engines whose neck points the cut refinement improves. The cross_section engine already places the neck point
+#  at the smallest cross-section, and refining its cuts made the head volumes worse on synthetic dendrites.
+REFINED_ENGINES = ("rays", "distance_field")
+
+# The cut refinement searches this many tilts from 0 to cut_max_tilt, each in this many directions, at this many
+#  points from -cut_offset to cut_offset along the skeleton: 125 planes, which are sliced in two chunks
+_CUT_TILTS = 4
+_CUT_AZIMUTHS = 8
+_CUT_OFFSETS = 5
+
+# Cuts whose section is within this fraction of the smallest count as just as small, and the one closest to the neck
+#  point with the least tilt is kept, so that a uniform neck doesn't move the cut for nothing
+_CUT_AREA_TOLERANCE = 0.02
+
+# The neck detection engine the plugin uses. Set with the environment variable DSB_NECK_ENGINE. "distance_field" is
+#  only used if asked for, even for files saved with a distance field: without refine_cut, its head volumes are less
+#  accurate than those of "rays" on synthetic dendrites.
+PLUGIN_ENGINE = os.environ.get("DSB_NECK_ENGINE", "rays")
+
+# Whether the plugin refines the cut of suggested neck points (see NeckParams.refine_cut). Set DSB_REFINE_CUT=1 to.
+PLUGIN_REFINE_CUT = os.environ.get("DSB_REFINE_CUT", "0") == "1"
+
+
+@dataclass(frozen=True)
+class NeckParams:
+    """
+    The tunable parameters of neck detection. The defaults are the values used by the plugin.
+    """
+
+    spacing: float = 6  # The distance between radius samples along the skeleton in nm
+    n_rays: int = 150  # The number of rays cast around each sample of the radius profile
+    head_rays: int = 500  # The number of rays cast in a sphere to measure the head radius
+    degree: int = 15  # The degree of the polynomial the radius profile is smoothed with
+    alpha: float = 0.001  # The ridge regularization of the smoothing
+    x_points: int = 600  # The number of points the smoothed profile is evaluated at
+    peak_distance: int = 10  # The minimum distance between peaks of the smoothed profile, in samples
+    head_radius_factor: float = 1.25  # The neck point is this many head radii from the head center
+
+    # Adaptive mode samples the radius profile coarsely, refines it around the head and the neck, and only casts as
+    #  many rays at each profile sample as its radius needs to converge (up to n_rays). All rays come from fixed
+    #  direction sets, so the result is deterministic. The head sphere always casts all head_rays, since its 99th
+    #  percentile needs on the order of a hundred rays to be meaningful.
+    adaptive: bool = False
+    coarse_factor: int = 4  # The coarse samples are this many times spacing apart
+    min_rays: int = 32  # The number of rays in the first round at each profile sample
+    ray_tolerance: float = 0.02  # A radius has converged once another round of rays changes it by less than this
+
+    # The "rays" engine measures the radius profile by ray casting and places the neck from the head radius, as above.
+    #  The "cross_section" engine slices the mesh perpendicular to the skeleton every `spacing` nm instead, and puts
+    #  the neck where the narrowest part of the spine widens into the head. Its profile holds the radius of a circle
+    #  with the same area as each section. n_rays, the smoothing and the adaptive settings only apply to "rays".
+    #  The "distance_field" engine reads the profile and the head radius from the distance field saved in the
+    #  preprocessing file (see pipeline/distance_field.py) without casting any rays, and places the neck like "rays".
+    engine: str = "rays"
+    crop_margin: float = 750  # The mesh is only sliced within this distance of each section's center, in nm
+    neck_widening: float = 1.25  # The neck ends where the section radius exceeds the narrowest one by this factor
+
+    # Refining the cut replaces the skeleton tangent at the neck point with the plane of smallest cross-section among
+    #  planes tilted up to cut_max_tilt degrees from it, through points up to cut_offset nm along the skeleton from
+    #  the neck point. The skeleton tangent tilts the cut on bent necks, which adds to the head volume. Only applies
+    #  to the engines in REFINED_ENGINES.
+    refine_cut: bool = False
+    cut_max_tilt: float = 30
+    cut_offset: float = 60
+
+    def __post_init__(self):
+        if self.engine not in ENGINES:
+            raise ValueError(f"Unknown neck detection engine {self.engine!r}, expected one of {', '.join(ENGINES)}")
+
+    @property
+    def profile_key(self) -> tuple:
+        """The parameters the radius profile depends on. Params with the same key can share a profile."""
+        if self.engine == "cross_section":
+            return self.engine, self.spacing, self.crop_margin
+
+        if self.engine == "distance_field":
+            return self.engine, self.spacing
+
+        if self.adaptive:
+            return self.spacing, self.n_rays, self.coarse_factor, self.min_rays, self.ray_tolerance
+
+        return self.spacing, self.n_rays
+
+
+def _powers(x: np.ndarray, degree: int) -> np.ndarray:
+    """
+    :return: x, x², ..., x^degree stacked along a new second-to-last axis, shape (..., degree, N)
+    """
+
+    powers = np.empty((*x.shape[:-1], degree, x.shape[-1]))
+    powers[..., 0, :] = x
+    for i in range(1, degree):
+        np.multiply(powers[..., i - 1, :], x, out=powers[..., i, :])
+
+    return powers
+
+
+def _ridge_poly_fit(x: np.ndarray, y: np.ndarray, mask: np.ndarray, x_eval: np.ndarray, degree: int,
+                    alpha: float) -> np.ndarray:
+    """
+    Fits a ridge-regularized polynomial to each row of a batch of padded profiles and evaluates it.
+
+    The fit is the same as scikit-learn's PolynomialFeatures(degree) -> StandardScaler -> Ridge(alpha) pipeline: the
+    powers x, x², ..., x^degree are standardized over the valid samples, and the ridge normal equations are solved
+    with an unpenalized intercept. Standardizing makes the fit invariant to scaling x, so each row is divided by its
+    largest magnitude first to keep the high powers in range. The standardized features are never built; the normal
+    equations are assembled from the raw feature moments instead.
+
+    :param x: The x-coordinates, shape (B, N)
+    :param y: The y-coordinates, shape (B, N)
+    :param mask: True for valid samples, shape (B, N)
+    :param x_eval: The x-coordinates to evaluate each fit at, shape (B, M)
+    :param degree: The degree of the polynomial
+    :param alpha: The regularization strength
+    :return: The fitted values at x_eval, shape (B, M)
+    """
+
+    x = np.where(mask, x, 0)  # Padding then contributes nothing to the feature moments below
+    y = np.where(mask, y, 0)
+    counts = mask.sum(axis=1)[:, np.newaxis]
+
+    x_scale = np.abs(x).max(axis=1, keepdims=True)
+    x_scale[x_scale == 0] = 1
+
+    features = _powers(x / x_scale, degree)  # (B, degree, N)
+    mean = features.sum(axis=2) / counts
+    y_mean = y.sum(axis=1, keepdims=True) / counts
+
+    # Population covariance of the features, then the ridge system on the standardized features:
+    #  (Zᵀ Z + alpha I) w = Zᵀ (y - ȳ) where Z = (F - mean) / std
+    second_moment = features @ features.transpose(0, 2, 1) / counts[..., np.newaxis]
+    cov = second_moment - mean[:, :, np.newaxis] * mean[:, np.newaxis, :]
+    std = np.sqrt(np.clip(np.diagonal(cov, axis1=1, axis2=2), 0, None))
+    std[std == 0] = 1
+
+    gram = counts[..., np.newaxis] * cov / (std[:, :, np.newaxis] * std[:, np.newaxis, :]) + alpha * np.eye(degree)
+    rhs = ((features @ y[..., np.newaxis])[..., 0] - counts * mean * y_mean) / std
+    coefs = np.linalg.solve(gram, rhs[..., np.newaxis])[..., 0] / std
+
+    eval_features = _powers(x_eval / x_scale, degree)
+    return y_mean + (coefs[:, np.newaxis, :] @ eval_features)[:, 0, :] - (coefs * mean).sum(axis=1, keepdims=True)
 
 
 def smooth(x, y, x_points: np.ndarray | int | None = None, degree=15, alpha=0.01) -> tuple[np.ndarray, np.ndarray]:
@@ -22,7 +168,8 @@ def smooth(x, y, x_points: np.ndarray | int | None = None, degree=15, alpha=0.01
     :return: A tuple of (x_points, y_points) where y_points are the smoothed y-coordinates.
     """
 
-    ridge_poly = make_pipeline(PolynomialFeatures(degree), StandardScaler(), Ridge(alpha=alpha))
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
 
     if x_points is None:
         x_points = x
@@ -31,22 +178,61 @@ def smooth(x, y, x_points: np.ndarray | int | None = None, degree=15, alpha=0.01
     elif not isinstance(x_points, np.ndarray):
         raise ValueError(f"x_points must be None, an integer, or a numpy array, not {type(x_points)}")
 
-    ridge_poly.fit(x.reshape(-1, 1), y)
-
-    smoothed_y = ridge_poly.predict(x_points.reshape(-1, 1))
+    smoothed_y = _ridge_poly_fit(
+        x[np.newaxis], y[np.newaxis], np.ones((1, len(x)), dtype=bool), x_points[np.newaxis], degree, alpha
+    )[0]
 
     return x_points, smoothed_y
 
 
-def rightmost_local_max_idx(y_values: np.ndarray) -> int:
+def smooth_batch(xs: list[np.ndarray], ys: list[np.ndarray], x_points: int = 600, degree=15,
+                 alpha=0.01) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Smooth many profiles of different lengths at once. Equivalent to calling smooth on each profile with an integer
+    x_points, but the fits are solved together as one batched linear system.
+
+    :param xs: The x-coordinates of each profile.
+    :param ys: The y-coordinates of each profile.
+    :param x_points: The number of evenly spaced points between the first and last x-coordinate of each profile to
+                    evaluate the polynomial at.
+    :param degree: The degree of the polynomial to fit.
+    :param alpha: The regularization parameter for Ridge regression.
+    :return: A tuple of (x_points, y_points), each with shape (len(xs), x_points)
+    """
+
+    if len(xs) != len(ys):
+        raise ValueError(f"Got {len(xs)} x arrays but {len(ys)} y arrays")
+
+    if len(xs) == 0:
+        return np.empty((0, x_points)), np.empty((0, x_points))
+
+    lengths = np.array([len(x) for x in xs])
+    mask = np.arange(lengths.max()) < lengths[:, np.newaxis]
+
+    x = np.zeros(mask.shape)
+    y = np.zeros(mask.shape)
+    x[mask] = np.concatenate(xs)
+    y[mask] = np.concatenate(ys)
+
+    starts = np.array([x_row[0] for x_row in xs], dtype=np.float64)
+    stops = np.array([x_row[-1] for x_row in xs], dtype=np.float64)
+    x_eval = np.linspace(starts, stops, x_points, axis=1)
+
+    return x_eval, _ridge_poly_fit(x, y, mask, x_eval, degree, alpha)
+
+
+def rightmost_local_max_idx(y_values: np.ndarray, distance: int = 10) -> int:
     """
     Finds the index of the rightmost local maximum. Used for finding the center of the dendritic spine head.
 
     :param y_values: The y-values of the signal.
+    :param distance: The minimum distance between local maxima in samples.
     :return: The index of the rightmost local maximum.
     """
 
-    local_maxima, _ = find_peaks(y_values, distance=10)
+    from scipy.signal import find_peaks
+
+    local_maxima, _ = find_peaks(y_values, distance=distance)
     local_maxima = sorted(local_maxima, reverse=True)
 
     if len(local_maxima) == 0:
@@ -55,18 +241,370 @@ def rightmost_local_max_idx(y_values: np.ndarray) -> int:
     return local_maxima[0]
 
 
-def find_neck_point_from_head_radius(polyline: np.ndarray, dendrite_mesh, cumulative_len: np.ndarray, radii_tangents) -> float:
-    smoothed_x, smoothed_y = smooth(cumulative_len, radii_tangents[1:], degree=15, alpha=0.001, x_points=600)
+def find_neck_point_from_head_radius(polyline: np.ndarray, dendrite_mesh, cumulative_len: np.ndarray, radii_tangents,
+                                     params: NeckParams = NeckParams()) -> float:
+    smoothed_x, smoothed_y = smooth(
+        cumulative_len, radii_tangents[1:], degree=params.degree, alpha=params.alpha, x_points=params.x_points
+    )
 
     # Find the local max (center point of the head) then subtract by the radius to get the start of the neck
-    head_center_idx = rightmost_local_max_idx(smoothed_y)
+    head_center_idx = rightmost_local_max_idx(smoothed_y, distance=params.peak_distance)
     head_point_1d = smoothed_x[head_center_idx]
 
     head_point_3d, _ = geom.point_and_tangent_along_polyline(polyline, head_point_1d)
 
-    # head_radius_spheres should be the radii_spheres radius at distance head_point_1d
-    head_radius_spheres = skel_helper.get_radius_point(head_point_3d, dendrite_mesh, n_rays=500, aggregate="percentile99", projection="sphere")[0]
+    if params.engine == "distance_field":
+        head_radius_spheres = _distance_field(dendrite_mesh).thickness(head_point_3d)
+    else:
+        # head_radius_spheres should be the radii_spheres radius at distance head_point_1d
+        head_radius_spheres = skel_helper.get_radius_point(head_point_3d, dendrite_mesh, n_rays=params.head_rays, aggregate="percentile99", projection="sphere")[0]
 
-    neck_point = head_point_1d - head_radius_spheres * 1.25
+    neck_point = head_point_1d - head_radius_spheres * params.head_radius_factor
 
     return cumulative_len[-1] - neck_point
+
+
+def _fine_distances(polyline: np.ndarray, params: NeckParams) -> np.ndarray:
+    """The distances along the polyline that the non-adaptive radius profile samples at."""
+    return np.arange(0, geom.accumulate(polyline)[-1], params.spacing)
+
+
+def _coarse_indices(n_fine: int, params: NeckParams) -> np.ndarray:
+    """
+    The indices into _fine_distances that the adaptive profile samples first: every coarse_factor-th sample, the
+    second sample since it is the first one the smoothing fit uses, and every sample near the tip of the head, where
+    the rightmost peak of the smoothed profile is most sensitive to the samples.
+    """
+    tip = np.arange(max(n_fine - 2 * params.coarse_factor, 0), n_fine)
+    return np.union1d(np.arange(0, n_fine, params.coarse_factor), np.concatenate(([min(1, n_fine - 1)], tip)))
+
+
+def _find_neck_point_adaptive(polyline: np.ndarray, dendrite_mesh, coarse_radii: np.ndarray,
+                              params: NeckParams, max_refinements: int = 3) -> float:
+    """
+    Adaptive version of find_neck_point_from_head_radius. Starts from the coarse profile, then measures every fine
+    position within two coarse steps of the head peak and the neck point, and repeats until both are inside the
+    measured region.
+
+    :param polyline: The spine's skeleton polyline, from the dendrite to the tip of the head
+    :param dendrite_mesh: The dendrite mesh
+    :param coarse_radii: The radii of the adaptive radius_profile
+    :param params: The neck detection parameters
+    :param max_refinements: The maximum number of refinement passes
+    :return: The neck point's distance from the tip of the head along the skeleton, as in
+             find_neck_point_from_head_radius
+    """
+
+    fine = _fine_distances(polyline, params)
+    samples = dict(zip(_coarse_indices(len(fine), params).tolist(), coarse_radii))
+    head_radii = {}
+    window = 2 * params.coarse_factor
+
+    for refinement in range(max_refinements + 1):
+        # Fill in the fine positions that haven't been measured by linear interpolation, then fit the full fine
+        #  profile the same way as find_neck_point_from_head_radius, leaving out the sample at the base of the spine
+        indices = np.array(sorted(samples))
+        radii = np.interp(np.arange(len(fine)), indices, [samples[i] for i in indices])
+
+        smoothed_x, smoothed_y = smooth(
+            fine[1:], radii[1:], degree=params.degree, alpha=params.alpha, x_points=params.x_points
+        )
+        head_point_1d = smoothed_x[rightmost_local_max_idx(smoothed_y, distance=params.peak_distance)]
+
+        if head_point_1d not in head_radii:
+            head_point_3d, _ = geom.point_and_tangent_along_polyline(polyline, head_point_1d)
+            head_radii[head_point_1d], _ = skel_helper.get_radius_point_adaptive(
+                head_point_3d, dendrite_mesh, max_rays=params.head_rays, min_rays=params.head_rays,
+                tolerance=params.ray_tolerance
+            )
+
+        neck_point = head_point_1d - head_radii[head_point_1d] * params.head_radius_factor
+
+        wanted = set()
+        for center in (head_point_1d, neck_point):
+            center_idx = int(round(center / params.spacing))
+            wanted.update(range(max(center_idx - window, 0), min(center_idx + window + 1, len(fine))))
+
+        missing = sorted(wanted - samples.keys())
+        if not missing or refinement == max_refinements:
+            break
+
+        _, new_radii, _ = skel_helper.get_radius_polyline_adaptive(
+            polyline, dendrite_mesh, max_rays=params.n_rays, min_rays=params.min_rays, tolerance=params.ray_tolerance,
+            distances=fine[missing], tangent_spacing=params.spacing
+        )
+        samples.update(zip(missing, new_radii))
+
+    return fine[-1] - neck_point
+
+
+def cross_section_profile(polyline: np.ndarray, dendrite_mesh,
+                          params: NeckParams = NeckParams()) -> tuple[np.ndarray, np.ndarray]:
+    """
+    The radius profile of the "cross_section" engine: the mesh is sliced perpendicular to the skeleton every
+    params.spacing nm, all planes at once, and each section's area is turned into the radius of a circle with the same
+    area.
+
+    :param polyline: The spine's skeleton polyline, from the dendrite to the tip of the head
+    :param dendrite_mesh: The dendrite mesh
+    :param params: The neck detection parameters
+    :return: (sample points, equivalent radius at each sample). The radius is NaN where the skeleton is outside the
+             mesh, and inf where the section reaches past params.crop_margin.
+    """
+
+    points, areas = cross_section.area_profile(polyline, dendrite_mesh, params.spacing, params.crop_margin)
+    return points, np.sqrt(areas / np.pi)
+
+
+def _distance_field(dendrite_mesh) -> dfield.DistanceField:
+    field = dfield.get(dendrite_mesh)
+    if field is None:
+        raise ValueError("The preprocessing file has no distance field. Preprocess it again with "
+                         "\"Save Distance Field\" checked, or use another neck detection engine.")
+
+    return field
+
+
+def distance_field_profile(polyline: np.ndarray, dendrite_mesh,
+                           params: NeckParams = NeckParams()) -> tuple[np.ndarray, np.ndarray]:
+    """
+    The radius profile of the "distance_field" engine: the inscribed radius every params.spacing nm along the
+    skeleton, interpolated from the distance field saved with the mesh.
+
+    :param polyline: The spine's skeleton polyline, from the dendrite to the tip of the head
+    :param dendrite_mesh: The dendrite mesh, loaded with a distance field
+    :param params: The neck detection parameters
+    :return: (sample points, radius at each sample)
+    :raises ValueError: If the mesh has no distance field
+    """
+
+    field = _distance_field(dendrite_mesh)
+    points, _ = cross_section.resample(polyline, _fine_distances(polyline, params))
+    return points, field.radius(points)
+
+
+def _running_median(values: np.ndarray, window: int) -> np.ndarray:
+    """
+    :return: The median of each sample's window, ignoring NaN. NaN where the whole window is NaN.
+    """
+
+    import warnings
+
+    half = window // 2
+    windows = np.lib.stride_tricks.sliding_window_view(np.pad(values, half, mode="edge"), window)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # All-NaN windows
+        return np.nanmedian(windows, axis=1)
+
+
+def find_neck_point_from_cross_sections(polyline: np.ndarray, radii: np.ndarray,
+                                        params: NeckParams = NeckParams()) -> float:
+    """
+    Finds the neck from a cross_section_profile. The narrowest part of the spine is the sample with the smallest
+    radius relative to the widest sections on both sides of it, which neither the shaft nor the tip of the head can
+    be. The neck point is the last sample between there and the head's widest section that is at most
+    params.neck_widening times as wide, i.e. where the neck widens into the head.
+
+    :param polyline: The spine's skeleton polyline, from the dendrite to the tip of the head
+    :param radii: The radii of the cross_section_profile
+    :param params: The neck detection parameters
+    :return: The neck point's distance from the tip of the head along the skeleton, as in
+             find_neck_point_from_head_radius
+    """
+
+    distances = _fine_distances(polyline, params)
+    length = geom.accumulate(polyline)[-1]
+
+    # A median over a few samples removes single oblique sections, e.g. where the skeleton bends near the tip.
+    #  Sections where the skeleton is outside the mesh (NaN) are left out. Sections reaching past the crop (inf) are
+    #  wide on the shaft side, but can only be oblique sections on the head side, so they are left out there too.
+    radii = _running_median(radii, 5)
+    measured = np.where(np.isinf(radii), np.nan, radii)
+    if np.all(np.isnan(measured)):
+        return length
+
+    widest_before = np.fmax.accumulate(radii)
+    widest_beyond = np.fmax.accumulate(measured[::-1])[::-1]
+    with np.errstate(invalid="ignore"):
+        narrowness = measured / np.fmin(widest_before, widest_beyond)
+
+    narrowest = int(np.nanargmin(narrowness))
+    head = narrowest + int(np.nanargmax(measured[narrowest:]))
+
+    within = np.nonzero(measured[narrowest:head + 1] <= measured[narrowest] * params.neck_widening)[0]
+    return length - distances[narrowest + within[-1]]
+
+
+def radius_profile(spine_skeleton: np.ndarray, dendrite_mesh,
+                   params: NeckParams = NeckParams()) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Measures the radius of the spine along its skeleton: by ray casting, from the areas of cross-sections with the
+    "cross_section" engine (see cross_section_profile), or from the saved distance field with the "distance_field"
+    engine (see distance_field_profile). This is the expensive part of neck detection and only depends on
+    params.profile_key.
+
+    :param spine_skeleton: The spine's skeleton polyline, from the tip of the head to the dendrite
+    :param dendrite_mesh: The dendrite mesh
+    :param params: The neck detection parameters
+    :return: (sample points, radius at each sample), from the dendrite to the tip of the head
+    """
+
+    if params.engine == "cross_section":
+        return cross_section_profile(spine_skeleton[::-1], dendrite_mesh, params)
+
+    if params.engine == "distance_field":
+        return distance_field_profile(spine_skeleton[::-1], dendrite_mesh, params)
+
+    if params.adaptive:
+        polyline = spine_skeleton[::-1]
+        fine = _fine_distances(polyline, params)
+        points, radii, _ = skel_helper.get_radius_polyline_adaptive(
+            polyline, dendrite_mesh, max_rays=params.n_rays, min_rays=params.min_rays,
+            tolerance=params.ray_tolerance, distances=fine[_coarse_indices(len(fine), params)],
+            tangent_spacing=params.spacing
+        )
+        return points, radii
+
+    return skel_helper.get_radius_polyline(
+        spine_skeleton[::-1], dendrite_mesh, n_rays=params.n_rays, aggregate='percentile99',
+        projection='tangents', path_interpolation_spacing=params.spacing
+    )
+
+
+def radius_profiles(spine_skeletons: list[np.ndarray], dendrite_mesh,
+                    params: NeckParams = NeckParams()) -> list[tuple[np.ndarray, np.ndarray]]:
+    """
+    radius_profile for many spines. With the default "rays" engine and without params.adaptive, the rays of every
+    spine are cast in one batch, which is much faster than one spine at a time when precomputing many profiles.
+
+    :param spine_skeletons: The spines' skeleton polylines, each from the tip of the head to the dendrite
+    :param dendrite_mesh: The dendrite mesh
+    :param params: The neck detection parameters
+    :return: (sample points, radius at each sample) of each spine, as returned by radius_profile
+    """
+
+    if params.engine != "rays" or params.adaptive:
+        return [radius_profile(spine_skeleton, dendrite_mesh, params) for spine_skeleton in spine_skeletons]
+
+    return skel_helper.get_radius_polylines(
+        [spine_skeleton[::-1] for spine_skeleton in spine_skeletons], dendrite_mesh, n_rays=params.n_rays,
+        aggregate='percentile99', projection='tangents', path_interpolation_spacing=params.spacing
+    )
+
+
+def neck_point_from_profile(spine_skeleton: np.ndarray, dendrite_mesh, points: np.ndarray, radii: np.ndarray,
+                            params: NeckParams = NeckParams()) -> tuple[np.ndarray, np.ndarray, float]:
+    """
+    Finds the neck point of a spine from its radius profile.
+
+    :param spine_skeleton: The spine's skeleton polyline, from the tip of the head to the dendrite
+    :param dendrite_mesh: The dendrite mesh
+    :param points: The sample points of the radius profile, as returned by radius_profile
+    :param radii: The radius at each sample point, as returned by radius_profile
+    :param params: The neck detection parameters
+    :return: (neck point 3D, neck tangent vector, neck point 1D)
+    """
+
+    if params.engine == "cross_section":
+        neck_point_1d = find_neck_point_from_cross_sections(spine_skeleton[::-1], radii, params)
+    elif params.adaptive:
+        neck_point_1d = _find_neck_point_adaptive(spine_skeleton[::-1], dendrite_mesh, radii, params)
+    else:
+        neck_point_1d = find_neck_point_from_head_radius(
+            spine_skeleton[::-1], dendrite_mesh, geom.accumulate(points), radii, params
+        )
+
+    if params.refine_cut and params.engine in REFINED_ENGINES:
+        with telemetry.stage("refine_cut"):
+            return refine_cut(spine_skeleton, dendrite_mesh, neck_point_1d, params)
+
+    neck_point_3d, neck_tangent = geom.point_and_tangent_along_polyline(spine_skeleton, neck_point_1d)
+    return neck_point_3d, neck_tangent, neck_point_1d
+
+
+def refine_cut(spine_skeleton: np.ndarray, dendrite_mesh, neck_point_1d: float,
+               params: NeckParams = NeckParams()) -> tuple[np.ndarray, np.ndarray, float]:
+    """
+    Finds the cut near a neck point with the smallest cross-section. The candidate planes are tilted from the skeleton
+    tangent and moved along the skeleton (see NeckParams.refine_cut), and are all sliced at once against the mesh
+    cropped around the neck point.
+
+    :param spine_skeleton: The spine's skeleton polyline, from the tip of the head to the dendrite
+    :param dendrite_mesh: The dendrite mesh
+    :param neck_point_1d: The neck point's distance from the tip of the head along the skeleton
+    :param params: The neck detection parameters
+    :return: (cut point 3D, cut normal pointing from the head towards the dendrite, cut point 1D), as
+             neck_point_from_profile. The unrefined cut if no candidate has a closed section.
+    """
+
+    length = geom.accumulate(spine_skeleton)[-1]
+    positions = np.clip(neck_point_1d + np.linspace(-params.cut_offset, params.cut_offset, _CUT_OFFSETS), 0, length)
+    on_skeleton = [geom.point_and_tangent_along_polyline(spine_skeleton, position) for position in positions]
+
+    points = np.array([point for point, _ in on_skeleton])
+    normals = [cross_section.tilted_normals(tangent, params.cut_max_tilt, _CUT_TILTS, _CUT_AZIMUTHS)
+               for _, tangent in on_skeleton]
+    per_point = len(normals[0])
+
+    vertices, faces, edges, face_edges = cross_section.crop(dendrite_mesh, points, params.crop_margin)
+    areas = cross_section.section_areas(
+        vertices, faces, np.repeat(points, per_point, axis=0), np.concatenate(normals), params.crop_margin, edges,
+        face_edges
+    )
+
+    closed = np.isfinite(areas)
+    if not closed.any():
+        point, tangent = on_skeleton[_CUT_OFFSETS // 2]
+        return point, tangent, neck_point_1d
+
+    # Candidates are ordered by point then tilt, so the first of each point is untilted
+    smallest = np.flatnonzero(closed & (areas <= areas[closed].min() * (1 + _CUT_AREA_TOLERANCE)))
+    point_idx, normal_idx = np.divmod(smallest, per_point)
+    best = smallest[np.lexsort((normal_idx, np.abs(point_idx - _CUT_OFFSETS // 2)))[0]]
+
+    point_idx, normal_idx = divmod(int(best), per_point)
+    return points[point_idx], normals[point_idx][normal_idx], float(positions[point_idx])
+
+
+def compute_neck_point_and_tangent(spine_skeleton: np.ndarray, dendrite_mesh,
+                                   params: NeckParams = NeckParams()) -> tuple[np.ndarray, np.ndarray, float]:
+    """
+    Computes the suggested neck point of a spine.
+
+    :param spine_skeleton: The spine's skeleton polyline, from the tip of the head to the dendrite
+    :param dendrite_mesh: The dendrite mesh
+    :param params: The neck detection parameters
+    :return: (neck point 3D, neck tangent vector, neck point 1D)
+    """
+
+    points, radii = radius_profile(spine_skeleton, dendrite_mesh, params)
+    return neck_point_from_profile(spine_skeleton, dendrite_mesh, points, radii, params)
+
+
+def behead(dendrite_mesh, neck_point: np.ndarray, neck_tangent: np.ndarray):
+    """
+    Cuts the dendrite mesh at the neck point and returns the piece containing the spine head.
+
+    :param dendrite_mesh: The dendrite mesh
+    :param neck_point: The point to cut at
+    :param neck_tangent: The skeleton tangent at the neck point, pointing from the head towards the dendrite
+    :return: The spine head mesh, or None if the cut produced no components
+    """
+
+    import trimesh
+
+    with telemetry.stage("slice", faces=len(dendrite_mesh.faces)):
+        beheaded = dendrite_mesh.slice_plane(neck_point, -neck_tangent, cap=True)
+
+    closest_component = None
+    closest_component_dist = np.inf
+
+    with telemetry.stage("split", faces=len(beheaded.faces)):
+        for component in beheaded.split(only_watertight=False):
+            dist = trimesh.proximity.closest_point(component, [neck_point])[1][0]
+
+            if dist < closest_component_dist:
+                closest_component = component
+                closest_component_dist = dist
+
+    return closest_component
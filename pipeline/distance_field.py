@@ -0,0 +1,185 @@
+"""
+A Euclidean distance transform of the dendrite ROI, saved in the preprocessing file when preprocessing is run with
+"Save Distance Field". Every voxel inside the ROI holds its distance to the closest voxel outside it, which is the
+radius of the largest sphere centered there that fits inside the dendrite. Neck detection can then read the spine
+radius along the skeleton by interpolating the field instead of casting rays against the mesh.
+
+The field is computed on the voxels marching cubes sampled to build the mesh, so it describes the same surface as
+the mesh, and is cropped to the ROI's bounding box.
+"""
+
+import weakref
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+# The distance field of each loaded mesh. Weak keys so meshes can be freed.
+_fields = weakref.WeakKeyDictionary()
+
+
+@dataclass(frozen=True, eq=False)
+class DistanceField:
+    distances: np.ndarray  # float32, indexed [i, j, k]. 0 outside the ROI.
+    origin: np.ndarray  # The position of voxel [0, 0, 0] in nm
+    axes: np.ndarray  # Row n is the step in nm from one voxel to the next along array axis n
+
+    @property
+    def voxel_size(self) -> np.ndarray:
+        return np.linalg.norm(self.axes, axis=1)
+
+    @property
+    def nbytes(self) -> int:
+        return self.distances.nbytes
+
+    def radius(self, points: np.ndarray) -> np.ndarray:
+        """
+        The inscribed radius at each point, by trilinear interpolation. The mesh surface lies halfway between the
+        voxels inside and outside the ROI, so half a voxel is taken off the distance to the closest outside voxel.
+
+        :param points: Positions in nm, shape (N, 3)
+        :return: The radius at each point in nm, 0 outside the ROI, shape (N,)
+        """
+
+        from scipy.ndimage import map_coordinates
+
+        indices = np.linalg.solve(self.axes.T, (np.atleast_2d(points) - self.origin).T)
+        distances = map_coordinates(self.distances, indices, order=1, mode="constant", cval=0.0)
+
+        return np.clip(distances - self.voxel_size.min() / 2, 0, None)
+
+    def thickness(self, point: np.ndarray) -> float:
+        """
+        The radius of the largest sphere inside the ROI that overlaps the inscribed sphere at a point. A point that
+        is off the center of a round part of the ROI, like a skeleton point in a spine head that isn't quite at its
+        center, has a smaller inscribed radius than the part, but the inscribed sphere around it contains the
+        center, or comes close to it.
+
+        :param point: A position in nm, shape (3,)
+        :return: The largest radius within the inscribed sphere around the point in nm, 0 outside the ROI
+        """
+
+        point = np.asarray(point, dtype=np.float64)
+        radius = self.radius(point)[0]
+        if radius == 0:
+            return 0.0
+
+        # The voxels within the inscribed sphere, searched in its bounding box
+        center = np.linalg.solve(self.axes.T, point - self.origin)
+        reach = radius / self.voxel_size
+        lo = np.clip(np.floor(center - reach).astype(int), 0, None)
+        hi = np.clip(np.ceil(center + reach).astype(int) + 1, None, self.distances.shape)
+
+        grid = np.meshgrid(*(np.arange(l, h) for l, h in zip(lo, hi)), indexing="ij")
+        offsets = np.stack(grid, axis=-1) @ self.axes + self.origin - point
+        inside = np.einsum("...i,...i->...", offsets, offsets) <= radius ** 2
+
+        window = self.distances[tuple(slice(l, h) for l, h in zip(lo, hi))]
+        return max(float(window[inside].max(initial=0) - self.voxel_size.min() / 2), radius)
+
+    def head_volume(self, neck_point: np.ndarray, neck_tangent: np.ndarray,
+                    window: float = 2000) -> Optional[tuple[float, np.ndarray]]:
+        """
+        Measures the volume of a spine head by counting the ROI voxels on the head side of the cut plane, without
+        slicing the mesh. Like spine_analysis.behead, the head is the connected piece closest to the neck point. The
+        pieces are labelled in a box around the neck point, which is grown until the head fits inside it.
+
+        :param neck_point: The point to cut at, in nm
+        :param neck_tangent: The skeleton tangent at the neck point, pointing from the head towards the dendrite
+        :param window: The half size of the first box the pieces are labelled in, in nm
+        :return: (volume in nm³, centroid in nm) of the head, or None if there are no ROI voxels on the head side
+        """
+
+        from scipy.ndimage import label
+
+        neck_point = np.asarray(neck_point, dtype=np.float64)
+        shape = np.array(self.distances.shape)
+        center = np.linalg.solve(self.axes.T, neck_point - self.origin)
+
+        # The distance of each voxel from the plane is the sum of one term per array axis
+        steps = self.axes @ np.asarray(neck_tangent, dtype=np.float64)
+        offset = (self.origin - neck_point) @ np.asarray(neck_tangent, dtype=np.float64)
+
+        while True:
+            reach = window / self.voxel_size
+            lo = np.clip(np.floor(center - reach).astype(int), 0, shape)
+            hi = np.clip(np.ceil(center + reach).astype(int) + 1, 0, shape)
+            indices = [np.arange(l, h) for l, h in zip(lo, hi)]
+
+            heights = offset + sum(
+                (index * step).reshape([-1 if axis == other else 1 for other in range(3)])
+                for axis, (index, step) in enumerate(zip(indices, steps))
+            )
+            head_side = (self.distances[tuple(slice(l, h) for l, h in zip(lo, hi))] > 0) & (heights < 0)
+
+            labels, n_pieces = label(head_side)
+            if n_pieces == 0:
+                return None
+
+            # The piece with the voxel closest to the neck point
+            voxels = np.argwhere(labels)
+            positions = (voxels + lo) @ self.axes + self.origin
+            closest = labels[tuple(voxels[np.argmin(np.linalg.norm(positions - neck_point, axis=1))])]
+            head = labels[tuple(voxels.T)] == closest
+
+            # Labelled again in a larger box if the head might continue past the edge of this one
+            touches_lo = voxels[head].min(axis=0) == 0
+            touches_hi = voxels[head].max(axis=0) == hi - lo - 1
+            if not np.any((touches_lo & (lo > 0)) | (touches_hi & (hi < shape))):
+                break
+
+            window *= 2
+
+        volume = np.count_nonzero(head) * abs(np.linalg.det(self.axes))
+        return float(volume), positions[head].mean(axis=0)
+
+
+def from_mask(mask: np.ndarray, origin: np.ndarray, axes: np.ndarray) -> DistanceField:
+    """
+    Compute the distance field of a voxel mask.
+
+    :param mask: The ROI's voxels, True inside, indexed [i, j, k]
+    :param origin: The position of voxel [0, 0, 0] in nm
+    :param axes: Row n is the step in nm from one voxel to the next along array axis n. Must be orthogonal.
+    :return: The distance field, cropped to the bounding box of the mask with one voxel of padding
+    """
+
+    from scipy.ndimage import distance_transform_edt
+
+    origin = np.asarray(origin, dtype=np.float64)
+    axes = np.asarray(axes, dtype=np.float64)
+
+    occupied = [np.nonzero(mask.any(axis=tuple(other for other in range(3) if other != axis)))[0] for axis in range(3)]
+    if any(len(indices) == 0 for indices in occupied):
+        return DistanceField(np.zeros((1, 1, 1), dtype=np.float32), origin, axes)
+
+    # One voxel of padding so that the border of the ROI counts as outside
+    lo = np.array([indices[0] for indices in occupied]) - 1
+    hi = np.array([indices[-1] for indices in occupied]) + 2
+    cropped = np.zeros(hi - lo, dtype=bool)
+    src_lo = np.maximum(lo, 0)
+    src_hi = np.minimum(hi, mask.shape)
+    cropped[tuple(slice(s - l, e - l) for s, e, l in zip(src_lo, src_hi, lo))] = \
+        mask[tuple(slice(s, e) for s, e in zip(src_lo, src_hi))]
+
+    distances = distance_transform_edt(cropped, sampling=np.linalg.norm(axes, axis=1)).astype(np.float32)
+    return DistanceField(distances, origin + lo @ axes, axes)
+
+
+def attach(mesh, field: Optional[DistanceField]) -> None:
+    """
+    Remember the distance field of a mesh, so that neck detection can find it from the mesh.
+    """
+
+    if field is None:
+        _fields.pop(mesh, None)
+    else:
+        _fields[mesh] = field
+
+
+def get(mesh) -> Optional[DistanceField]:
+    """
+    :return: The distance field attached to the mesh, or None if its preprocessing file has none
+    """
+
+    return _fields.get(mesh)
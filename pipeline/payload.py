@@ -1,23 +1,31 @@
+import json
 import pickle
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 import zipfile
 import io
 import os
 
 import numpy as np
-import skeletor as sk
-import trimesh
 
-from typing import Optional
+from typing import Optional, TYPE_CHECKING
+
+from . import distance_field as dfield
+from . import telemetry
+
+if TYPE_CHECKING:
+    import skeletor as sk
+    import trimesh
 
 
 @dataclass(frozen=True)
 class Payload:
-    dendrite_mesh: trimesh.Trimesh
-    skeleton: sk.Skeleton
+    dendrite_mesh: "trimesh.Trimesh"
+    skeleton: "sk.Skeleton"
     annotations: list[tuple[np.ndarray, str]] | None
-    psds: Optional[trimesh.Trimesh | None]
+    psds: "Optional[trimesh.Trimesh]"
+    metadata: dict = field(default_factory=dict)  # How the file was made, e.g. the sampling chosen for the memory budget
+    distance_field: Optional[dfield.DistanceField] = None  # Only saved when preprocessing was asked to
 
 
 def pld_save(pld: Payload, filepath: str) -> None:
@@ -27,16 +35,24 @@ def pld_save(pld: Payload, filepath: str) -> None:
     :param filepath: The path to save the payload to
     """
 
-    stl_bytes = pld.dendrite_mesh.export(file_type="stl")
-    skeleton_bytes = pickle.dumps(pld.skeleton)
-    annotations_bytes = pickle.dumps(pld.annotations)
-    psds_stl_bytes = pld.psds.export(file_type="stl") if pld.psds is not None else b""
+    with telemetry.stage("pld_save", faces=len(pld.dendrite_mesh.faces)):
+        stl_bytes = pld.dendrite_mesh.export(file_type="stl")
+        skeleton_bytes = pickle.dumps(pld.skeleton)
+        annotations_bytes = pickle.dumps(pld.annotations)
+        psds_stl_bytes = pld.psds.export(file_type="stl") if pld.psds is not None else b""
+
+        with zipfile.ZipFile(filepath, "w") as zf:
+            zf.writestr("mesh.stl", stl_bytes)
+            zf.writestr("skeleton.pickle", skeleton_bytes)
+            zf.writestr("annotations.pickle", annotations_bytes)
+            zf.writestr("psds.stl", psds_stl_bytes)
+            zf.writestr("metadata.json", json.dumps(pld.metadata))
 
-    with zipfile.ZipFile(filepath, "w") as zf:
-        zf.writestr("mesh.stl", stl_bytes)
-        zf.writestr("skeleton.pickle", skeleton_bytes)
-        zf.writestr("annotations.pickle", annotations_bytes)
-        zf.writestr("psds.stl", psds_stl_bytes)
+            if pld.distance_field is not None:
+                # Compressed, since most of the field is the zeros around the dendrite
+                with zf.open("distance_field.npz", "w") as f:
+                    np.savez_compressed(f, distances=pld.distance_field.distances, origin=pld.distance_field.origin,
+                                        axes=pld.distance_field.axes)
 
 
 def pld_load(filepath: str) -> Payload:
@@ -46,46 +62,34 @@ def pld_load(filepath: str) -> Payload:
     :return: The loaded payload
     """
 
-    with zipfile.ZipFile(filepath, "r") as zf:
-        mesh_bytes = zf.read("mesh.stl")
-        skel_bytes = zf.read("skeleton.pickle")
-        annotations_bytes = zf.read("annotations.pickle")
-        psds_bytes = zf.read("psds.stl")
+    import trimesh
 
-    dendrite_mesh = trimesh.load(io.BytesIO(mesh_bytes), force="mesh", file_type="stl")
-    spine_skeletons = pickle.loads(skel_bytes)
-    annotations = pickle.loads(annotations_bytes)
-    psds = trimesh.load(io.BytesIO(psds_bytes), force="mesh", file_type="stl") if psds_bytes else None
-
-    return Payload(dendrite_mesh=dendrite_mesh,
-                   skeleton=spine_skeletons,
-                   annotations=annotations,
-                   psds=psds)
+    with telemetry.stage("pld_load", file=os.path.basename(filepath)):
+        with zipfile.ZipFile(filepath, "r") as zf:
+            mesh_bytes = zf.read("mesh.stl")
+            skel_bytes = zf.read("skeleton.pickle")
+            annotations_bytes = zf.read("annotations.pickle")
+            psds_bytes = zf.read("psds.stl")
+            # Files from before metadata was saved don't have it
+            metadata = json.loads(zf.read("metadata.json")) if "metadata.json" in zf.namelist() else {}
 
+            distance_field = None
+            if "distance_field.npz" in zf.namelist():
+                with np.load(io.BytesIO(zf.read("distance_field.npz"))) as arrays:
+                    distance_field = dfield.DistanceField(arrays["distances"], arrays["origin"], arrays["axes"])
 
-def csv_save(filepath: str, head_name: str, head_idx: int, head_vol: float, beheading_point: np.ndarray, centroid: np.ndarray) -> bool:
-    """
-    Save the head information to a CSV file.
-    :param filepath: The path to save the CSV file to
-    :param head_name: The head name of the dendritic spine head
-    :param head_idx: The index of the dendritic spine head
-    :param head_vol: The volume of the dendritic spine head in μm³
-    :param beheading_point: The beheading point of the dendritic spine head in nm
-    :param centroid: The centroid of the dendritic spine head in nm
-    :return: True if saved successfully, False otherwise
-    """
+        dendrite_mesh = trimesh.load(io.BytesIO(mesh_bytes), force="mesh", file_type="stl")
+        spine_skeletons = pickle.loads(skel_bytes)
+        annotations = pickle.loads(annotations_bytes)
+        psds = trimesh.load(io.BytesIO(psds_bytes), force="mesh", file_type="stl") if psds_bytes else None
 
-    try:
-        # First check if the file exists, and if it doesn't, create it with the appropriate header
-        if not os.path.isfile(filepath):
-            os.makedirs(os.path.dirname(filepath), exist_ok=True)
-            with open(filepath, "w", encoding="utf-8-sig") as f:
-                f.write("Head Index,Head Name,Head Volume (μm³),Beheading Point X (nm),Beheading Point Y (nm),Beheading Point Z (nm),Head Centroid X (nm),Head Centroid Y (nm),Head Centroid Z (nm)\n")
+    # So that neck detection, which is given the mesh, can find the field
+    dfield.attach(dendrite_mesh, distance_field)
 
-        # Now append the new head information to the CSV file
-        with open(filepath, "a", encoding="utf-8-sig") as f:
-            f.write(f"{head_idx},\"{head_name}\",{head_vol},{beheading_point[0]},{beheading_point[1]},{beheading_point[2]},{centroid[0]},{centroid[1]},{centroid[2]}\n")
-    except (FileNotFoundError, PermissionError, IsADirectoryError, NotADirectoryError, OSError):
-        return False
+    return Payload(dendrite_mesh=dendrite_mesh,
+                   skeleton=spine_skeletons,
+                   annotations=annotations,
+                   psds=psds,
+                   metadata=metadata,
+                   distance_field=distance_field)
 
-    return True
@@ -0,0 +1,218 @@
+"""
+Runs the pure-Python end of preprocessing (skeletonization and writing the .dsb file) in a child process. In a thread
+it would compete with Dragonfly's own Python UI for the GIL for the whole run, and could not be stopped. Only the
+mesh arrays cross the process boundary, through shared memory, and progress messages come back over a pipe.
+Cancelling kills the child process. If the child process can't start, preprocessing runs in the calling thread
+instead.
+"""
+
+import os
+import traceback
+from multiprocessing.connection import Connection
+from typing import Iterator, Optional, TYPE_CHECKING
+
+import numpy as np
+
+from .. import distance_field, payload, processes, shared_mesh, telemetry
+
+if TYPE_CHECKING:
+    import trimesh
+
+
+class PreprocessingFailed(Exception):
+    """
+    Raised when the child process fails. The message is the child's traceback.
+    """
+
+
+class PreprocessingUnavailable(PreprocessingFailed):
+    """
+    Raised when the child process exited before it started preprocessing, e.g. because it could not import this
+    module. Preprocessing can still run in the calling thread with preprocess().
+    """
+
+
+class PreprocessingCancelled(Exception):
+    """
+    Raised when the child process was killed by cancel().
+    """
+
+
+def _partial_path(filepath: str) -> str:
+    # Written to first and moved into place once complete, so a cancelled run never leaves a truncated .dsb behind
+    return filepath + ".partial"
+
+
+def preprocess(mesh: "trimesh.Trimesh", psds: "Optional[trimesh.Trimesh]",
+               annotations: Optional[list[tuple[np.ndarray, str]]], filepath: str, metadata: Optional[dict] = None,
+               distance_mask: Optional[tuple[np.ndarray, np.ndarray, np.ndarray]] = None) -> Iterator[str]:
+    """
+    Skeletonizes the mesh, optionally computes the distance field, and saves the preprocessing file. Runs in the child
+    process, or in the calling thread if the child process can't start. Stopping the iteration early leaves no file
+    behind.
+
+    :param distance_mask: (voxels, origin, axes) of the ROI, or None to save no distance field
+    :return: Yields the name of each stage as it starts
+    """
+
+    from .skeletonization import skeletonize_mesh
+
+    yield "Skeletonizing Mesh"
+    with telemetry.stage("skeletonize", faces=len(mesh.faces)):
+        skeleton = skeletonize_mesh(mesh)
+
+    field = None
+    if distance_mask is not None:
+        yield "Computing Distance Field"
+        with telemetry.stage("distance_field", voxels=int(distance_mask[0].size)):
+            field = distance_field.from_mask(*distance_mask)
+
+    yield "Saving to File"
+    partial_path = _partial_path(filepath)
+    try:
+        payload.pld_save(
+            payload.Payload(
+                dendrite_mesh=mesh, skeleton=skeleton, annotations=annotations, psds=psds, metadata=metadata or {},
+                distance_field=field
+            ),
+            filepath=partial_path
+        )
+        os.replace(partial_path, filepath)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+
+
+def _run(handle: shared_mesh.SharedMeshHandle, annotations: Optional[list[tuple[np.ndarray, str]]], has_psds: bool,
+         field_geometry: Optional[tuple[np.ndarray, np.ndarray]], metadata: dict, filepath: str,
+         record_telemetry: bool, conn: Connection) -> None:
+    """
+    The entry point of the child process.
+    """
+
+    telemetry.set_enabled(record_telemetry)
+
+    try:
+        mesh, extras = shared_mesh.attach(handle)
+        psds = None
+        if has_psds:
+            import trimesh
+            psds = trimesh.Trimesh(vertices=extras["psds_vertices"], faces=extras["psds_faces"], process=False)
+
+        distance_mask = (extras["distance_mask"], *field_geometry) if field_geometry is not None else None
+        for stage in preprocess(mesh, psds, annotations, filepath, metadata, distance_mask):
+            conn.send(("progress", stage))
+
+        # The stages measured here are added to the session of the parent process
+        conn.send(("telemetry", telemetry.drain()))
+        conn.send(("done", None))
+    except BaseException:
+        conn.send(("error", traceback.format_exc()))
+    finally:
+        conn.close()
+
+
+class PreprocessingProcess:
+    """
+    Skeletonizes a dendrite mesh, optionally computes the ROI's distance field, and saves the preprocessing file in a
+    child process.
+    """
+
+    def __init__(self, mesh: "trimesh.Trimesh", psds: "Optional[trimesh.Trimesh]",
+                 annotations: Optional[list[tuple[np.ndarray, str]]], filepath: str, metadata: Optional[dict] = None,
+                 distance_mask: Optional[tuple[np.ndarray, np.ndarray, np.ndarray]] = None):
+        """
+        :param mesh: The dendrite mesh
+        :param psds: The PSD mesh, if any
+        :param annotations: The annotations, if any
+        :param filepath: The path of the .dsb file to write
+        :param metadata: Saved in the payload metadata
+        :param distance_mask: (voxels, origin, axes) of the ROI, as returned by meshhelper.roi_distance_mask, to save
+                              its distance field in the file. None to save no distance field.
+        """
+
+        extras = {}
+        if psds is not None:
+            extras.update(psds_vertices=psds.vertices, psds_faces=psds.faces)
+
+        field_geometry = None
+        if distance_mask is not None:
+            mask, origin, axes = distance_mask
+            extras["distance_mask"] = mask
+            field_geometry = (origin, axes)
+
+        self._shared = shared_mesh.SharedMesh(mesh, extras or None)
+        self.filepath = filepath
+        self._cancelled = False
+
+        context = processes.spawn_context()
+        self._conn, child_conn = context.Pipe(duplex=False)
+        self._process = context.Process(
+            target=_run,
+            args=(self._shared.handle, annotations, psds is not None, field_geometry, metadata or {}, filepath,
+                  telemetry.enabled(), child_conn),
+            daemon=True
+        )
+
+        try:
+            self._process.start()
+        except BaseException:
+            self._shared.close()
+            raise
+        finally:
+            # The child has its own copy of the sending end, so that recv() sees EOF if the child dies
+            child_conn.close()
+
+    def progress(self) -> Iterator[str]:
+        """
+        Wait for the child process, yielding its progress messages as they arrive.
+
+        :return: Yields the name of each stage as it starts
+        :raises PreprocessingCancelled: If cancel() was called
+        :raises PreprocessingUnavailable: If the child process exited before it sent anything
+        :raises PreprocessingFailed: If the child process raised an exception or died
+        """
+
+        started = False
+        try:
+            while True:
+                try:
+                    kind, value = self._conn.recv()
+                except (EOFError, OSError):
+                    if self._cancelled:
+                        raise PreprocessingCancelled()
+
+                    self._process.join()
+                    error = PreprocessingUnavailable if not started else PreprocessingFailed
+                    raise error(f"The preprocessing process exited with code {self._process.exitcode}")
+
+                started = True
+
+                if kind == "progress":
+                    yield value
+                elif kind == "telemetry":
+                    telemetry.add_records(value)
+                elif kind == "error":
+                    raise PreprocessingFailed(value)
+                else:
+                    return
+        finally:
+            self._close()
+
+    def cancel(self) -> None:
+        """
+        Kill the child process. Safe to call from another thread while progress() is waiting.
+        """
+
+        self._cancelled = True
+        if self._process.is_alive():
+            self._process.kill()
+
+    def _close(self) -> None:
+        self._process.join()
+        self._conn.close()
+        self._shared.close()
+
+        partial_path = _partial_path(self.filepath)
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
@@ -0,0 +1,244 @@
+"""
+Estimates the peak memory of preprocessing before it starts, and picks coarser marching cubes sampling if the estimate
+is over the memory budget, so that a large ROI doesn't run the machine out of memory halfway through a long run.
+
+The peak is set by the number of mesh faces: the skeletonization process needs about 1 kB per face on top of what
+Python and its libraries take. Marching cubes makes about
+FACES_PER_VOXEL_SURFACE faces per (sampled voxel count)^(2/3) for dendrite-shaped ROIs, which is how the face count is
+estimated from the ROI before meshing. The constants were measured on synthetic dendrites with
+benchmarks/bench_memory_budget.py.
+"""
+
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+FACES_PER_VOXEL_SURFACE = 40  # Mesh faces per (sampled voxel count)^(2/3). Measured: 37
+SKELETONIZE_BYTES_PER_FACE = 1000  # Peak of skeletonization and saving, including the mesh itself. Measured: 820
+SKELETONIZE_BASE_MB = 200  # The skeletonization process with trimesh and skeletor imported. Measured: 180
+MESHING_BYTES_PER_FACE = 400  # Peak of converting the Dragonfly mesh to trimesh. Measured: 340-380
+MESHING_BYTES_PER_CELL = 1  # The sampled grid marching cubes runs over
+
+DEFAULT_Z_SAMPLE = 2
+MAX_Z_SAMPLE = 8
+BUDGET_FRACTION = 0.8  # Of the memory available when preprocessing starts, if DSB_MEMORY_BUDGET_MB isn't set
+
+
+@dataclass(frozen=True)
+class Sampling:
+    """
+    Marching cubes sampling factors: the mesh is built from every x-th, y-th and z-th voxel.
+    """
+
+    x: int
+    y: int
+    z: int
+
+    @property
+    def factor(self) -> int:
+        return self.x * self.y * self.z
+
+
+@dataclass(frozen=True)
+class RoiGrid:
+    """
+    The size of an ROI, read from Dragonfly before meshing.
+    """
+
+    shape: tuple[int, int, int]  # Voxels along x, y and z
+    spacing: tuple[float, float, float]  # Voxel size along x, y and z
+    voxel_count: int  # Voxels inside the ROI
+
+
+@dataclass(frozen=True)
+class MemoryEstimate:
+    sampling: Sampling
+    faces: int  # Estimated, or the real count once the mesh exists
+    meshing_mb: float
+    skeletonize_mb: float
+
+    @property
+    def peak_mb(self) -> float:
+        return max(self.meshing_mb, self.skeletonize_mb)
+
+
+@dataclass(frozen=True)
+class SamplingDecision:
+    """
+    The sampling chosen for an ROI and why. Saved in the payload metadata.
+    """
+
+    sampling: Sampling
+    default_sampling: Sampling
+    estimate: MemoryEstimate
+    budget_mb: Optional[float]  # None if there is no budget
+
+    @property
+    def downsampled(self) -> bool:
+        return self.sampling != self.default_sampling
+
+    @property
+    def within_budget(self) -> bool:
+        return self.budget_mb is None or self.estimate.peak_mb <= self.budget_mb
+
+    def metadata(self) -> dict:
+        return {
+            "sampling": [self.sampling.x, self.sampling.y, self.sampling.z],
+            "default_sampling": [self.default_sampling.x, self.default_sampling.y, self.default_sampling.z],
+            "downsampled": self.downsampled,
+            "memory_budget_mb": self.budget_mb,
+            "estimated_peak_mb": round(self.estimate.peak_mb, 1),
+            "faces": self.estimate.faces,
+            "within_budget": self.within_budget,
+        }
+
+
+def sampling_for_spacing(spacing: tuple[float, float, float], z_sample: int = DEFAULT_Z_SAMPLE) -> Sampling:
+    """
+    Sampling factors that make the sampled voxels roughly cubic.
+
+    :param spacing: The voxel size along x, y and z
+    :param z_sample: The sampling factor along z. x and y are scaled to match.
+    :return: The sampling factors
+    """
+
+    scale_x, scale_y, scale_z = spacing
+
+    x_sample = int(round(scale_z / scale_x * z_sample))
+    y_sample = int(round(scale_z / scale_y * z_sample))
+
+    # Clamp x_sample and y_sample to [z_sample, 5 * z_sample] ([2, 10] by default) for performance reasons
+    x_sample = max(z_sample, min(x_sample, 5 * z_sample))
+    y_sample = max(z_sample, min(y_sample, 5 * z_sample))
+
+    return Sampling(x_sample, y_sample, z_sample)
+
+
+def estimate(grid: RoiGrid, sampling: Sampling, faces: Optional[int] = None) -> MemoryEstimate:
+    """
+    Estimate the peak memory of preprocessing an ROI.
+
+    :param grid: The ROI
+    :param sampling: The marching cubes sampling factors
+    :param faces: The real number of mesh faces, if the mesh was already built
+    :return: The estimate
+    """
+
+    if faces is None:
+        faces = int(FACES_PER_VOXEL_SURFACE * (grid.voxel_count / sampling.factor) ** (2 / 3))
+
+    cells = (-(-grid.shape[0] // sampling.x)) * (-(-grid.shape[1] // sampling.y)) * (-(-grid.shape[2] // sampling.z))
+
+    return MemoryEstimate(
+        sampling=sampling,
+        faces=faces,
+        meshing_mb=(cells * MESHING_BYTES_PER_CELL + faces * MESHING_BYTES_PER_FACE) / 1024 ** 2,
+        skeletonize_mb=SKELETONIZE_BASE_MB + faces * SKELETONIZE_BYTES_PER_FACE / 1024 ** 2
+    )
+
+
+def choose_sampling(grid: RoiGrid, budget_mb: Optional[float], face_scale: float = 1.0,
+                    min_z_sample: int = DEFAULT_Z_SAMPLE) -> SamplingDecision:
+    """
+    Pick the finest sampling whose estimated peak memory fits the budget. If none fits, the coarsest is picked.
+
+    :param grid: The ROI
+    :param budget_mb: The memory budget, or None for no budget
+    :param face_scale: Corrects the estimated face counts, from a mesh that was already built (real / estimated)
+    :param min_z_sample: The finest z sampling factor to consider
+    :return: The decision
+    """
+
+    default_sampling = sampling_for_spacing(grid.spacing)
+
+    for z_sample in range(min(max(min_z_sample, DEFAULT_Z_SAMPLE), MAX_Z_SAMPLE), MAX_Z_SAMPLE + 1):
+        sampling = sampling_for_spacing(grid.spacing, z_sample)
+        modelled = estimate(grid, sampling)
+        decision = SamplingDecision(
+            sampling, default_sampling, estimate(grid, sampling, int(modelled.faces * face_scale)), budget_mb
+        )
+
+        if decision.within_budget:
+            break
+
+    return decision
+
+
+def checked_mesh(decision: SamplingDecision, grid: RoiGrid, faces: int) -> SamplingDecision:
+    """
+    Recheck a decision once its mesh was built, with the real number of faces.
+
+    :param decision: The decision the mesh was built with
+    :param grid: The ROI
+    :param faces: The number of faces of the mesh
+    :return: The same decision with the real face count, or a coarser one if the mesh is over the budget after all
+    """
+
+    checked = SamplingDecision(
+        decision.sampling, decision.default_sampling, estimate(grid, decision.sampling, faces), decision.budget_mb
+    )
+
+    if checked.within_budget or decision.sampling.z >= MAX_Z_SAMPLE:
+        return checked
+
+    face_scale = faces / max(estimate(grid, decision.sampling).faces, 1)
+    return choose_sampling(grid, decision.budget_mb, face_scale, decision.sampling.z + 1)
+
+
+def available_memory_mb() -> Optional[float]:
+    """
+    :return: The physical memory available to new allocations, or None if it can't be measured
+    """
+
+    if os.name == "nt":
+        import ctypes
+        from ctypes import wintypes
+
+        class MemoryStatusEx(ctypes.Structure):
+            _fields_ = [
+                ("dwLength", wintypes.DWORD),
+                ("dwMemoryLoad", wintypes.DWORD),
+                ("ullTotalPhys", ctypes.c_ulonglong),
+                ("ullAvailPhys", ctypes.c_ulonglong),
+                ("ullTotalPageFile", ctypes.c_ulonglong),
+                ("ullAvailPageFile", ctypes.c_ulonglong),
+                ("ullTotalVirtual", ctypes.c_ulonglong),
+                ("ullAvailVirtual", ctypes.c_ulonglong),
+                ("ullAvailExtendedVirtual", ctypes.c_ulonglong),
+            ]
+
+        status = MemoryStatusEx()
+        status.dwLength = ctypes.sizeof(status)
+        if not ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return None
+
+        return status.ullAvailPhys / 1024 ** 2
+
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def memory_budget_mb() -> Optional[float]:
+    """
+    The memory budget of preprocessing: DSB_MEMORY_BUDGET_MB if set (0 for no budget), otherwise BUDGET_FRACTION of
+    the available memory.
+
+    :return: The budget, or None for no budget
+    """
+
+    configured = os.environ.get("DSB_MEMORY_BUDGET_MB")
+    if configured is not None:
+        return float(configured) if float(configured) > 0 else None
+
+    available = available_memory_mb()
+    return available * BUDGET_FRACTION if available is not None else None
@@ -1,51 +1,67 @@
 import numpy as np
-import skeletor as sk
-import trimesh
 
 from ORSModel.ors import ROI, FaceVertexMesh, Progress
 import ORSModel
 
+from typing import Optional, TYPE_CHECKING
 
-def ors_to_trimesh(ors_mesh: FaceVertexMesh) -> trimesh.Trimesh:
+from .memorybudget import RoiGrid, Sampling, sampling_for_spacing
+
+if TYPE_CHECKING:
+    import trimesh
+
+
+def ors_to_trimesh(ors_mesh: FaceVertexMesh) -> "trimesh.Trimesh":
     """
     Converts a Dragonfly ORS mesh to a trimesh mesh.
     :param ors_mesh: The ORS mesh to convert
     :return: The trimesh mesh
     """
+
+    import trimesh
+
     vertices = ors_mesh.getVertices(0).getNDArray().reshape(-1, 3) * 1e9  # Convert from m to nm
     edges = ors_mesh.getEdges(0).getNDArray().reshape(-1, 3)
 
     return trimesh.Trimesh(vertices=vertices, faces=edges)
 
 
-def roi_to_mesh(roi: ROI, cubic=False, smooth=True):
+def roi_grid(roi: ROI) -> RoiGrid:
+    """
+    Reads the size of a Dragonfly ROI, for estimating the memory preprocessing it needs.
+    :param roi: The ROI
+    :return: The ROI's grid size, voxel spacing and voxel count
+    """
+
+    return RoiGrid(
+        shape=(roi.getXSize(), roi.getYSize(), roi.getZSize()),
+        spacing=(roi.getXSpacing(), roi.getYSpacing(), roi.getZSpacing()),
+        voxel_count=int(roi.getVoxelCount(0))
+    )
+
+
+def roi_to_mesh(roi: ROI, cubic=False, smooth=True, sampling: Optional[Sampling] = None):
     """
     Does all the preprocessing required to convert a Dragonfly ROI to a trimesh mesh with smoothing applied.
+    :param sampling: The marching cubes sampling factors. By default, zSample = 2 and xSample and ySample are adjusted
+                     to match the voxel spacing.
     :return: The Trimesh mesh
     """
 
-    if not cubic:
-        scale_x = roi.getXSpacing()
-        scale_y = roi.getYSpacing()
-        scale_z = roi.getZSpacing()
+    import trimesh
 
-        # Aim to have zSample = 2 and adjust xSample and ySample accordingly
-        z_sample = 2
-        x_sample = int(round(scale_z / scale_x * z_sample))
-        y_sample = int(round(scale_z / scale_y * z_sample))
-
-        # Clamp x_sample and y_sample to [2, 10] for performance reasons
-        x_sample = max(2, min(x_sample, 10))
-        y_sample = max(2, min(y_sample, 10))
+    if not cubic:
+        if sampling is None:
+            sampling = sampling_for_spacing((roi.getXSpacing(), roi.getYSpacing(), roi.getZSpacing()))
 
         dragonfly_mesh = roi.getAsMarchingCubesMesh(
             isovalue=0.5,
             bSnapToContour=False,
             flipNormal=False,
             timeStep=0,
-            xSample=x_sample,
-            ySample=y_sample,
-            zSample=z_sample,
+            xSample=sampling.x,
+            ySample=sampling.y,
+            zSample=sampling.z,
             pNearest=False,
             pWorld=True,
             IProgress=None,
@@ -68,7 +84,35 @@ def roi_to_mesh(roi: ROI, cubic=False, smooth=True):
     return mesh
 
 
-def mesh_to_ors(mesh: trimesh.Trimesh) -> FaceVertexMesh:
+def roi_distance_mask(roi: ROI, sampling: Sampling) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Reads the voxels of a Dragonfly ROI at the sampling marching cubes used, for computing its distance field.
+    :param roi: The ROI
+    :param sampling: The marching cubes sampling factors
+    :return: (The sampled voxels, True inside the ROI, indexed [x, y, z], the center of voxel [0, 0, 0] in nm,
+             the step in nm from one sampled voxel to the next along each array axis as rows)
+    """
+
+    step = np.array([sampling.x, sampling.y, sampling.z])
+    spacing = np.array([roi.getXSpacing(), roi.getYSpacing(), roi.getZSpacing()]) * 1e9  # Convert from m to nm
+
+    # Dragonfly's arrays are indexed [z, y, x]
+    voxels = roi.getNDArray(0)
+    mask = voxels[::sampling.z, ::sampling.y, ::sampling.x].transpose(2, 1, 0) > 0
+
+    box = roi.getBox()
+    directions = np.array([
+        vector3_to_np(box.getDirection0()), vector3_to_np(box.getDirection1()), vector3_to_np(box.getDirection2())
+    ])
+
+    # The box origin is the corner of the first voxel
+    origin = vector3_to_np(box.getOrigin()) * 1e9 + (spacing / 2) @ directions
+    axes = directions * (spacing * step)[:, np.newaxis]
+
+    return mask, origin, axes
+
+
+def mesh_to_ors(mesh: "trimesh.Trimesh") -> FaceVertexMesh:
     """
     Converts a processing.mesh.Mesh object to a Dragonfly ORS mesh. Used for displaying the final mesh to the user.
     Precondition: The mesh is not none
@@ -118,13 +162,15 @@ def annotations_to_list(annotations: ORSModel.Annotation) -> list[tuple[np.array
     return output
 
 
-def multiroi_to_mesh(multiroi: ORSModel.MultiROI) -> trimesh.Trimesh:
+def multiroi_to_mesh(multiroi: ORSModel.MultiROI) -> "trimesh.Trimesh":
     """
     Converts a Dragonfly MultiROI to a trimesh mesh.
     :param multiroi: The MultiROI to convert
     :return: The trimesh mesh
     """
 
+    import trimesh
+
     meshes = []
 
     for label in range(1, multiroi.getLabelCount() + 1):
@@ -135,13 +181,3 @@ def multiroi_to_mesh(multiroi: ORSModel.MultiROI) -> trimesh.Trimesh:
         meshes.append(roi_to_mesh(copy_roi, True, False))
 
     return trimesh.util.concatenate(meshes, trimesh.Trimesh())
-
-
-def skeletonize_mesh(mesh: trimesh.Trimesh) -> sk.Skeleton:
-    skel = sk.skeletonize.by_wavefront(mesh, origins=None, waves=1, step_size=1, radius_agg="percentile25")
-    sk.post.remove_bristles(skel, los_only=False, inplace=True)
-    sk.post.clean_up(skel, inplace=True, theta=1)
-    sk.post.despike(skel, inplace=True)
-
-    return skel
-
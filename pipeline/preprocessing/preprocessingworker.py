@@ -1,53 +1,126 @@
 import ORSModel
 from PyQt6.QtCore import QThread, pyqtSignal
 
-from typing import Optional
+import threading
+import traceback
+from typing import Optional, TYPE_CHECKING
 
-from . import meshhelper
-from .. import payload
+from . import childprocess, memorybudget, meshhelper
+from .. import telemetry
+
+if TYPE_CHECKING:
+    import trimesh
 
 class PreprocessingWorker(QThread):
     update_label: pyqtSignal = pyqtSignal(str)
     finished: pyqtSignal = pyqtSignal()
 
     def __init__(self, filepath: str, selected_roi: ORSModel.ors.ROI, psds: Optional[ORSModel.ors.MultiROI],
-                 annotations: Optional[ORSModel.ors.Annotation]):
+                 annotations: Optional[ORSModel.ors.Annotation], distance_field: bool = False):
         super().__init__()
 
         self.selected_roi = selected_roi
         self.psds = psds
         self.annotations = annotations
         self.filepath = filepath
+        self.distance_field = distance_field
+
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._process: Optional[childprocess.PreprocessingProcess] = None
+
+    def cancel(self):
+        """
+        Stop preprocessing. The Dragonfly conversions can't be interrupted, so they are allowed to finish, but the
+        skeletonization process is killed straight away. No file is written.
+        """
+
+        with self._lock:
+            self._cancelled = True
+            if self._process is not None:
+                self._process.cancel()
+
+    def mesh_roi(self) -> tuple["trimesh.Trimesh", memorybudget.SamplingDecision]:
+        """
+        Convert the ROI to a mesh, with coarser sampling than the default if the default is estimated to need more
+        memory than the budget. The estimate is checked again with the real face count, and the ROI is meshed again
+        more coarsely if it was too low.
+
+        :return: (The mesh, the sampling decision it was made with)
+        """
+
+        grid = meshhelper.roi_grid(self.selected_roi)
+        decision = memorybudget.choose_sampling(grid, memorybudget.memory_budget_mb())
+
+        while True:
+            status = "Converting ROI to Mesh"
+            if not decision.within_budget:
+                status += f" (estimated {decision.estimate.peak_mb:.0f} MB, over the memory budget at any sampling)"
+            elif decision.downsampled:
+                x, y, z = decision.sampling.x, decision.sampling.y, decision.sampling.z
+                status += f" (sampling {x}×{y}×{z} to stay within the memory budget)"
+
+            self.update_label.emit(status)
+            sampling = decision.sampling
+            with telemetry.stage("roi_to_mesh", sampling=[sampling.x, sampling.y, sampling.z]):
+                mesh = meshhelper.roi_to_mesh(self.selected_roi, sampling=sampling)
+
+            checked = memorybudget.checked_mesh(decision, grid, len(mesh.faces))
+            if checked.sampling == decision.sampling or self._cancelled:
+                return mesh, checked
+
+            decision = checked
 
     def run(self):
         try:
-            self.update_label.emit("Converting ROI to Mesh")
-            mesh = meshhelper.roi_to_mesh(self.selected_roi)
+            # The conversions need Dragonfly, so they run here. The rest runs in a child process.
+            mesh, sampling_decision = self.mesh_roi()
 
             annotations_pcd = None
-            if self.annotations is not None:
+            if self.annotations is not None and not self._cancelled:
                 self.update_label.emit("Saving Annotations")
-                annotations_pcd = meshhelper.annotations_to_list(self.annotations)
+                with telemetry.stage("annotations_to_list"):
+                    annotations_pcd = meshhelper.annotations_to_list(self.annotations)
 
             psds_mesh = None
-            if self.psds is not None:
+            if self.psds is not None and not self._cancelled:
                 self.update_label.emit("Saving MultiROI")
-                psds_mesh = meshhelper.multiroi_to_mesh(self.psds)
-
-            self.update_label.emit("Skeletonizing Mesh")
-            skeleton = meshhelper.skeletonize_mesh(mesh)
-
-            self.update_label.emit("Saving to File")
-            payload.pld_save(
-                payload.Payload(
-                    dendrite_mesh=mesh,
-                    skeleton=skeleton,
-                    annotations=annotations_pcd,
-                    psds=psds_mesh
-                ),
-                filepath=self.filepath
+                with telemetry.stage("multiroi_to_mesh"):
+                    psds_mesh = meshhelper.multiroi_to_mesh(self.psds)
+
+            distance_mask = None
+            if self.distance_field and not self._cancelled:
+                self.update_label.emit("Reading ROI Voxels")
+                with telemetry.stage("roi_distance_mask"):
+                    distance_mask = meshhelper.roi_distance_mask(self.selected_roi, sampling_decision.sampling)
+
+            arguments = (
+                mesh, psds_mesh, annotations_pcd, self.filepath, {"memory_budget": sampling_decision.metadata()},
+                distance_mask
             )
+
+            try:
+                with self._lock:
+                    if self._cancelled:
+                        raise childprocess.PreprocessingCancelled()
+
+                    self._process = childprocess.PreprocessingProcess(*arguments)
+
+                for stage in self._process.progress():
+                    self.update_label.emit(stage)
+            except (childprocess.PreprocessingUnavailable, OSError):
+                # Without a child process, preprocessing still works here, but competes with Dragonfly for the GIL
+                #  and can only be cancelled between stages
+                traceback.print_exc()
+                for stage in childprocess.preprocess(*arguments):
+                    if self._cancelled:
+                        raise childprocess.PreprocessingCancelled()
+
+                    self.update_label.emit(f"{stage} (the preprocessing process could not start)")
+
             self.update_label.emit("Saved!")
+        except childprocess.PreprocessingCancelled:
+            self.update_label.emit("Preprocessing cancelled")
         except Exception as e:
             self.update_label.emit(f"An unexpected error occurred while preprocessing")
             raise e
@@ -0,0 +1,24 @@
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import skeletor as sk
+    import trimesh
+
+
+def skeletonize_mesh(mesh: "trimesh.Trimesh") -> "sk.Skeleton":
+    """
+    Skeletonizes the dendrite mesh. Kept separate from meshhelper since it does not need Dragonfly, so it can also run
+    in the benchmarks.
+
+    :param mesh: The dendrite mesh
+    :return: The cleaned-up skeleton
+    """
+
+    import skeletor as sk
+
+    skel = sk.skeletonize.by_wavefront(mesh, origins=None, waves=1, step_size=1, radius_agg="percentile25")
+    sk.post.remove_bristles(skel, los_only=False, inplace=True)
+    sk.post.clean_up(skel, inplace=True, theta=1)
+    sk.post.despike(skel, inplace=True)
+
+    return skel
@@ -0,0 +1,50 @@
+"""
+Process pools that work the same from a standalone Python interpreter and from inside Dragonfly. Inside Dragonfly,
+sys.executable is Dragonfly itself rather than Python, so worker processes would start a second copy of Dragonfly.
+Workers are therefore always started with the spawn method (forking a Qt application is not safe either) from the
+interpreter of the Python environment Dragonfly runs.
+"""
+
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Optional
+
+
+def python_executable() -> str:
+    """
+    :return: The path of the Python interpreter of the running environment
+    """
+
+    if os.path.basename(sys.executable).lower().startswith("python"):
+        return sys.executable
+
+    if os.name == "nt":
+        return os.path.join(sys.exec_prefix, "python.exe")
+
+    return os.path.join(sys.exec_prefix, "bin", "python3")
+
+
+def spawn_context() -> multiprocessing.context.SpawnContext:
+    """
+    :return: A multiprocessing context that spawns processes with the interpreter from python_executable()
+    """
+
+    context = multiprocessing.get_context("spawn")
+    context.set_executable(python_executable())
+    return context
+
+
+def process_pool(max_workers: int, initializer: Optional[Callable] = None, initargs: tuple = ()) -> ProcessPoolExecutor:
+    """
+    Create a pool of spawned worker processes.
+
+    :param max_workers: The number of worker processes
+    :param initializer: Called in each worker process when it starts
+    :param initargs: The arguments of the initializer
+    :return: The process pool
+    """
+
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=spawn_context(), initializer=initializer,
+                               initargs=initargs)
@@ -0,0 +1,271 @@
+import csv
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+from typing import Iterable, Optional
+
+
+CSV_HEADER = [
+    "Dataset", "Head Index", "Head Name", "Head Volume (μm³)",
+    "Beheading Point X (nm)", "Beheading Point Y (nm)", "Beheading Point Z (nm)",
+    "Head Centroid X (nm)", "Head Centroid Y (nm)", "Head Centroid Z (nm)", "Voxel Head Volume (μm³)",
+    "Legacy Head Index"
+]
+
+LEGACY_DATASET = "legacy"  # The dataset of the rows imported from a CSV without a Dataset column
+
+_COLUMNS = [
+    "dataset", "head_idx", "head_name", "head_vol",
+    "point_x", "point_y", "point_z", "centroid_x", "centroid_y", "centroid_z", "head_vol_voxels",
+    "legacy_head_idx"
+]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS heads (
+    dataset TEXT NOT NULL,
+    head_idx INTEGER NOT NULL,
+    head_name TEXT NOT NULL,
+    head_vol REAL NOT NULL,
+    point_x REAL NOT NULL, point_y REAL NOT NULL, point_z REAL NOT NULL,
+    centroid_x REAL NOT NULL, centroid_y REAL NOT NULL, centroid_z REAL NOT NULL,
+    head_vol_voxels REAL,
+    legacy_head_idx INTEGER,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (dataset, head_idx)
+)
+"""
+
+_UPSERT = f"""
+INSERT INTO heads ({", ".join(_COLUMNS)}, updated_at) VALUES ({", ".join("?" * (len(_COLUMNS) + 1))})
+ON CONFLICT(dataset, head_idx) DO UPDATE SET
+    {", ".join(f"{col} = excluded.{col}" for col in _COLUMNS[2:])},
+    updated_at = excluded.updated_at
+"""
+
+
+@dataclass(frozen=True)
+class HeadResult:
+    dataset: str
+    head_idx: int
+    head_name: str
+    head_vol: float
+    beheading_point: np.ndarray
+    centroid: np.ndarray
+    head_vol_voxels: Optional[float] = None  # Counted from the distance field's voxels, if the file has one
+    # The head index of a row imported from an older version of DSB, which numbered heads by their position among the
+    #  spines that passed the filter instead of by skeleton segment. None for heads saved by this version.
+    legacy_head_idx: Optional[int] = None
+
+    def as_row(self) -> tuple:
+        return (
+            self.dataset, int(self.head_idx), self.head_name, float(self.head_vol),
+            *(float(v) for v in self.beheading_point), *(float(v) for v in self.centroid),
+            float(self.head_vol_voxels) if self.head_vol_voxels is not None else None,
+            int(self.legacy_head_idx) if self.legacy_head_idx is not None else None
+        )
+
+
+def store_path_for_csv(csv_path: str) -> str:
+    """
+    Get the path of the results database that backs a CSV output file.
+    :param csv_path: The path of the CSV file
+    :return: The path of the SQLite file stored next to it
+    """
+
+    return os.path.splitext(csv_path)[0] + ".sqlite"
+
+
+class ResultsStore:
+    """
+    SQLite-backed store of beheaded spine heads, keyed by (dataset, head index). Saving a head that already exists
+    replaces its row instead of appending a duplicate. Rows are buffered and written in batches, with each batch being
+    a single transaction, so several proofreaders can safely share one file.
+    """
+
+    def __init__(self, filepath: str, batch_size: int = 32, timeout: float = 30.0):
+        """
+        :param filepath: The path of the SQLite file. Created if it does not exist.
+        :param batch_size: The number of pending rows that triggers a commit
+        :param timeout: How long to wait, in seconds, for another writer to release the file
+        """
+
+        directory = os.path.dirname(filepath)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.filepath = filepath
+        self.batch_size = batch_size
+        self._pending: dict[tuple[str, int], tuple] = {}
+
+        # isolation_level=None so that transactions are controlled explicitly with BEGIN IMMEDIATE, which takes the
+        #  write lock up front instead of failing halfway through a batch
+        self._conn = sqlite3.connect(filepath, timeout=timeout, isolation_level=None, check_same_thread=False)
+        self._conn.execute(_SCHEMA)
+
+        # Files from before voxel head volumes or legacy head indices were saved don't have their columns
+        columns = [column[1] for column in self._conn.execute("PRAGMA table_info(heads)")]
+        if "head_vol_voxels" not in columns:
+            self._conn.execute("ALTER TABLE heads ADD COLUMN head_vol_voxels REAL")
+        if "legacy_head_idx" not in columns:
+            self._conn.execute("ALTER TABLE heads ADD COLUMN legacy_head_idx INTEGER")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def upsert(self, result: HeadResult) -> None:
+        """
+        Queue a head to be inserted or updated. Commits once `batch_size` rows are pending.
+        :param result: The head to save
+        """
+
+        row = result.as_row()
+        self._pending[(row[0], row[1])] = row
+
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def upsert_many(self, results: Iterable[HeadResult]) -> None:
+        """
+        Insert or update many heads in a single transaction.
+        :param results: The heads to save
+        """
+
+        for result in results:
+            row = result.as_row()
+            self._pending[(row[0], row[1])] = row
+
+        self.flush()
+
+    def flush(self) -> None:
+        """
+        Commit all pending rows in one transaction.
+        """
+
+        if not self._pending:
+            return
+
+        now = time.time()
+        rows = [(*row, now) for row in self._pending.values()]
+
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.executemany(_UPSERT, rows)
+        except sqlite3.Error:
+            self._conn.execute("ROLLBACK")
+            raise
+
+        self._conn.execute("COMMIT")
+        self._pending.clear()
+
+    def rows(self, dataset: Optional[str] = None) -> list[tuple]:
+        """
+        Get the saved rows, ordered by dataset and head index. Pending rows are committed first.
+        :param dataset: If given, only return rows for this dataset
+        :return: A list of tuples in the same order as `CSV_HEADER`
+        """
+
+        self.flush()
+
+        query = f"SELECT {', '.join(_COLUMNS)} FROM heads"
+        params: tuple = ()
+        if dataset is not None:
+            query += " WHERE dataset = ?"
+            params = (dataset,)
+
+        return self._conn.execute(query + " ORDER BY dataset, head_idx", params).fetchall()
+
+    def import_csv(self, csv_path: str) -> int:
+        """
+        Import the rows of an existing CSV. A CSV written by an older version of DSB has no Dataset column, and was
+        appended to once per save, possibly for several datasets, so the same head index can belong to different heads.
+        Its head indices also count the spines that passed the filter rather than skeleton segments, so they can't be
+        compared with the head indices saved now. Its rows are kept apart under LEGACY_DATASET, keyed by their row
+        number, with their original head index in legacy_head_idx, and the CSV is copied to a .bak file first, since
+        the next export replaces it.
+        :param csv_path: The path of the CSV file
+        :return: The number of rows read
+        """
+
+        with open(csv_path, "r", encoding="utf-8-sig", newline="") as f:
+            reader = csv.DictReader(f)
+            records = list(reader)
+            legacy = "Dataset" not in (reader.fieldnames or [])
+
+        if legacy:
+            shutil.copy2(csv_path, csv_path + ".bak")
+
+        self.upsert_many(
+            HeadResult(
+                dataset=LEGACY_DATASET if legacy else record["Dataset"],
+                head_idx=row if legacy else int(record["Head Index"]),
+                head_name=record["Head Name"],
+                head_vol=float(record["Head Volume (μm³)"]),
+                beheading_point=np.array([float(record[f"Beheading Point {axis} (nm)"]) for axis in "XYZ"]),
+                centroid=np.array([float(record[f"Head Centroid {axis} (nm)"]) for axis in "XYZ"]),
+                head_vol_voxels=float(record["Voxel Head Volume (μm³)"]) if record.get("Voxel Head Volume (μm³)")
+                else None,
+                legacy_head_idx=int(record["Head Index"]) if legacy
+                else int(record["Legacy Head Index"]) if record.get("Legacy Head Index") else None
+            )
+            for row, record in enumerate(records, start=1)
+        )
+
+        return len(records)
+
+    def export_csv(self, csv_path: str, dataset: Optional[str] = None) -> bool:
+        """
+        Write the saved rows to a CSV file. The file is written to a temporary file first and then moved into place,
+        so readers never see a partially written file.
+        :param csv_path: The path to write the CSV file to
+        :param dataset: If given, only export rows for this dataset
+        :return: True if saved successfully, False otherwise
+        """
+
+        rows = self.rows(dataset)
+        directory = os.path.dirname(csv_path) or "."
+
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(suffix=".csv", dir=directory)
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8-sig", newline="") as f:
+                    writer = csv.writer(f)
+                    writer.writerow(CSV_HEADER)
+                    writer.writerows(rows)
+
+                os.replace(tmp_path, csv_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        except (FileNotFoundError, PermissionError, IsADirectoryError, NotADirectoryError, OSError):
+            return False
+
+        return True
+
+    def export_parquet(self, parquet_path: str, dataset: Optional[str] = None) -> None:
+        """
+        Write the saved rows to a Parquet file. Requires pandas and pyarrow.
+        :param parquet_path: The path to write the Parquet file to
+        :param dataset: If given, only export rows for this dataset
+        """
+
+        import pandas as pd
+
+        pd.DataFrame(self.rows(dataset), columns=CSV_HEADER).to_parquet(parquet_path, index=False)
+
+    def close(self) -> None:
+        """
+        Commit any pending rows and close the database.
+        """
+
+        self.flush()
+        self._conn.close()
@@ -0,0 +1,504 @@
+"""
+An optional local analysis service, for several Dragonfly sessions working on the same preprocessing files. It keeps
+the files it was asked about loaded, along with their ray casting indices, radius profiles and neck points, and
+answers neck point, head volume and head mesh requests from any session of the same user on the machine.
+
+Start it from the plugin folder, with the Python environment Dragonfly uses:
+    python -m pipeline.service
+
+It listens on localhost and writes its port and a random key to DSB_SERVICE_INFO, or ~/.dsb/service.json by default.
+Only clients that can read that file can connect. The plugin uses the service if that file points to a running
+service, and otherwise computes everything itself, as it does when a request to the service fails.
+
+Requests and replies only hold numbers, strings and NumPy arrays, since the plugin's classes have a different module
+name inside Dragonfly than in the service.
+"""
+
+import argparse
+import dataclasses
+import json
+import os
+import secrets
+import signal
+import sys
+import threading
+import traceback
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from multiprocessing.connection import AuthenticationError, Client, Connection, Listener
+from typing import Any, Callable, Iterator, Optional, TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    import trimesh
+    from .beheading import bulk, profile_cache, spine_analysis
+
+REQUEST_TIMEOUT_S = 300  # Beyond this, a request is treated as failed and the service is no longer used
+PING_TIMEOUT_S = 5  # A service that doesn't answer a ping within this is treated as not running
+
+# Bump when a request or reply changes shape. A client only uses a service with the same version, so a service still
+#  running an older version of the code is computed around instead of answering in a shape the client can't read.
+PROTOCOL_VERSION = 2
+
+
+class ServiceError(Exception):
+    """
+    Raised by ServiceClient when the service fails to answer a request.
+    """
+
+
+class ServiceUnavailable(ServiceError):
+    """
+    Raised by ServiceClient when the connection to the service is lost. The client is not used again.
+    """
+
+
+def info_path() -> str:
+    """
+    :return: The path of the file the running service writes its port and key to
+    """
+
+    return os.environ.get("DSB_SERVICE_INFO") or os.path.join(os.path.expanduser("~"), ".dsb", "service.json")
+
+
+@dataclass(eq=False)
+class _Dataset:
+    """
+    A preprocessing file loaded by the service.
+    """
+
+    mesh: "trimesh.Trimesh"
+    spine_skeletons: list[np.ndarray]
+    profiles: "profile_cache.ProfileCache"
+    neck_points: dict = field(default_factory=dict)  # (spine index, NeckParams) -> (3D point, tangent, 1D point)
+    lock: threading.Lock = field(default_factory=threading.Lock)  # Held while the dataset is used
+
+
+class Service:
+    """
+    Answers requests about preprocessing files, keeping the most recently used ones loaded. Can be used directly,
+    without a server, to test clients in the same process.
+    """
+
+    def __init__(self, max_datasets: int = 4):
+        """
+        :param max_datasets: The number of preprocessing files to keep loaded
+        """
+
+        self.max_datasets = max_datasets
+
+        self._datasets: OrderedDict[str, _Dataset] = OrderedDict()
+        self._loading: dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def dataset(self, path: str, payload_hash: str) -> _Dataset:
+        """
+        Get a loaded preprocessing file, loading it if needed.
+
+        :param path: The path of the .dsb file
+        :param payload_hash: The hash of the file the client has open, from profile_cache.payload_hash
+        :return: The dataset
+        :raises ValueError: If the file at the path has a different hash
+        """
+
+        with self._lock:
+            if payload_hash in self._datasets:
+                self._datasets.move_to_end(payload_hash)
+                return self._datasets[payload_hash]
+
+            loading = self._loading.setdefault(payload_hash, threading.Lock())
+
+        # Load outside the service lock, so that requests about other files aren't held up, but only once
+        with loading:
+            with self._lock:
+                if payload_hash in self._datasets:
+                    return self._datasets[payload_hash]
+
+            dataset = self._load(path, payload_hash)
+
+            with self._lock:
+                self._datasets[payload_hash] = dataset
+                self._loading.pop(payload_hash, None)
+
+                evicted = []
+                while len(self._datasets) > self.max_datasets:
+                    evicted.append(self._datasets.popitem(last=False)[1])
+
+        for old in evicted:
+            with old.lock:
+                old.profiles.close()
+
+        return dataset
+
+    @staticmethod
+    def _load(path: str, payload_hash: str) -> _Dataset:
+        from . import payload
+        from .beheading import polyline_utils, profile_cache
+
+        if profile_cache.payload_hash(path) != payload_hash:
+            raise ValueError(f"{path} is not the file the client has open")
+
+        pld = payload.pld_load(path)
+        return _Dataset(
+            mesh=pld.dendrite_mesh,
+            spine_skeletons=polyline_utils.build_segment_table(pld.skeleton).polylines,
+            profiles=profile_cache.ProfileCache(payload_hash, profile_cache.sidecar_path_for_payload(path))
+        )
+
+    def neck_point(self, path: str, payload_hash: str, spine_idx: int,
+                   params: dict) -> tuple[np.ndarray, np.ndarray, float]:
+        """
+        :param params: The fields of spine_analysis.NeckParams
+        :return: (neck point 3D, neck tangent vector, neck point 1D), as spine_analysis.compute_neck_point_and_tangent
+        """
+
+        from .beheading import spine_analysis
+
+        dataset = self.dataset(path, payload_hash)
+        neck_params = spine_analysis.NeckParams(**params)
+        key = (spine_idx, neck_params)
+
+        with dataset.lock:
+            if key not in dataset.neck_points:
+                spine_skeleton = dataset.spine_skeletons[spine_idx]
+                points, radii = dataset.profiles.get_or_compute(
+                    spine_idx, neck_params,
+                    lambda: spine_analysis.radius_profile(spine_skeleton, dataset.mesh, neck_params)
+                )
+                dataset.neck_points[key] = spine_analysis.neck_point_from_profile(
+                    spine_skeleton, dataset.mesh, points, radii, neck_params
+                )
+
+            return dataset.neck_points[key]
+
+    def _behead(self, path: str, payload_hash: str, neck_point: np.ndarray, neck_tangent: np.ndarray):
+        from .beheading import spine_analysis
+
+        dataset = self.dataset(path, payload_hash)
+        with dataset.lock:
+            return spine_analysis.behead(dataset.mesh, neck_point, neck_tangent)
+
+    def head_volume(self, path: str, payload_hash: str, neck_point: np.ndarray,
+                    neck_tangent: np.ndarray) -> Optional[tuple[float, np.ndarray]]:
+        """
+        :return: (volume in nm³, centroid) of the head cut off at the neck point, or None if the cut produced no
+                 components
+        """
+
+        component = self._behead(path, payload_hash, neck_point, neck_tangent)
+        return (float(component.volume), np.array(component.centroid)) if component is not None else None
+
+    def head_mesh(self, path: str, payload_hash: str, neck_point: np.ndarray, neck_tangent: np.ndarray) \
+            -> Optional[tuple[np.ndarray, np.ndarray, float, np.ndarray, Optional[float]]]:
+        """
+        :return: (vertices, faces, volume in nm³, centroid, volume in nm³ counted from the distance field's voxels or
+                 None if the file has no distance field) of the head cut off at the neck point, or None if the cut
+                 produced no components
+        """
+
+        from .beheading import bulk
+
+        component = self._behead(path, payload_hash, neck_point, neck_tangent)
+        if component is None:
+            return None
+
+        voxel_volume = bulk.voxel_volume(self.dataset(path, payload_hash).mesh, neck_point, neck_tangent)
+        return (np.asarray(component.vertices), np.asarray(component.faces), float(component.volume),
+                np.array(component.centroid), voxel_volume)
+
+    def handle(self, request: tuple) -> Any:
+        """
+        Answer a request sent by a ServiceClient.
+
+        :param request: (request kind, arguments...)
+        :return: The reply
+        """
+
+        kind, *args = request
+        handlers = {
+            "ping": lambda client_version: PROTOCOL_VERSION,
+            "neck_point": self.neck_point,
+            "head_volume": self.head_volume,
+            "head_mesh": self.head_mesh,
+        }
+
+        if kind not in handlers:
+            raise ValueError(f"Unknown request: {kind}")
+
+        return handlers[kind](*args)
+
+    def close(self) -> None:
+        with self._lock:
+            datasets = list(self._datasets.values())
+            self._datasets.clear()
+
+        for dataset in datasets:
+            with dataset.lock:
+                dataset.profiles.close()
+
+
+class ServiceServer:
+    """
+    Serves a Service on localhost, one thread per client.
+    """
+
+    def __init__(self, service: Service, port: int = 0, info_file: Optional[str] = None):
+        """
+        :param service: The service to answer requests with
+        :param port: The port to listen on, or 0 for any free port
+        :param info_file: Where to write the port and key for clients, by default info_path()
+        """
+
+        self.service = service
+        self.info_file = info_file or info_path()
+
+        authkey = secrets.token_bytes(32)
+        self._listener = Listener(("127.0.0.1", port), authkey=authkey)
+        self.port = self._listener.address[1]
+
+        os.makedirs(os.path.dirname(self.info_file), exist_ok=True)
+        # Readable by this user only, since the key is what keeps other users out
+        fd = os.open(self.info_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump({"port": self.port, "authkey": authkey.hex(), "pid": os.getpid()}, f)
+
+    def serve_forever(self) -> None:
+        """
+        Accept clients until close() is called.
+        """
+
+        while True:
+            try:
+                conn = self._listener.accept()
+            except AuthenticationError:
+                continue
+            except OSError:
+                return  # Closed
+
+            threading.Thread(target=self._serve_client, args=(conn,), daemon=True).start()
+
+    def _serve_client(self, conn: Connection) -> None:
+        with conn:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    return
+
+                try:
+                    reply = ("ok", self.service.handle(request))
+                except Exception:
+                    reply = ("error", traceback.format_exc())
+
+                try:
+                    conn.send(reply)
+                except OSError:
+                    return
+
+    def close(self) -> None:
+        self._listener.close()
+
+        try:
+            with open(self.info_file) as f:
+                ours = json.load(f).get("pid") == os.getpid()
+        except (OSError, ValueError):
+            ours = False
+
+        # Another service may have been started since
+        if ours:
+            os.remove(self.info_file)
+
+
+class ServiceClient:
+    """
+    A connection to the service. Thread-safe, but requests are answered one at a time.
+    """
+
+    def __init__(self, port: int, authkey: bytes, timeout: float = REQUEST_TIMEOUT_S):
+        """
+        :raises OSError: If the service can't be reached
+        :raises AuthenticationError: If the key is wrong
+        """
+
+        self.timeout = timeout
+        self.available = True
+
+        self._conn = Client(("127.0.0.1", port), authkey=authkey)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def connect(cls, info_file: Optional[str] = None) -> Optional["ServiceClient"]:
+        """
+        Connect to the running service.
+
+        :param info_file: The file the service wrote its port and key to, by default info_path()
+        :return: The client, or None if no service is running
+        """
+
+        try:
+            with open(info_file or info_path()) as f:
+                info = json.load(f)
+
+            client = cls(int(info["port"]), bytes.fromhex(info["authkey"]))
+        except (OSError, ValueError, KeyError, AuthenticationError):
+            return None
+
+        try:
+            client.ping(PING_TIMEOUT_S)
+            return client
+        except ServiceError:
+            client.close()
+            return None
+
+    def _request(self, *request, timeout: Optional[float] = None) -> Any:
+        """
+        :param request: (request kind, arguments...)
+        :param timeout: How long to wait for the reply in seconds, by default the client's timeout
+        """
+
+        timeout = timeout if timeout is not None else self.timeout
+
+        with self._lock:
+            if not self.available:
+                raise ServiceUnavailable()
+
+            try:
+                self._conn.send(request)
+                if not self._conn.poll(timeout):
+                    raise TimeoutError(f"The service did not answer {request[0]} within {timeout} s")
+
+                status, reply = self._conn.recv()
+            except (EOFError, OSError) as e:
+                self._close()
+                raise ServiceUnavailable() from e
+
+        if status == "error":
+            raise ServiceError(reply)
+
+        return reply
+
+    def ping(self, timeout: Optional[float] = None) -> None:
+        """
+        :raises ServiceError: If the service doesn't answer, or speaks a different protocol version
+        """
+
+        # Services from before the protocol had versions fail on the version argument
+        version = self._request("ping", PROTOCOL_VERSION, timeout=timeout)
+        if version != PROTOCOL_VERSION:
+            raise ServiceError(f"The service speaks protocol version {version}, not {PROTOCOL_VERSION}")
+
+    def neck_point(self, path: str, payload_hash: str, spine_idx: int,
+                   params: "spine_analysis.NeckParams") -> tuple[np.ndarray, np.ndarray, float]:
+        """
+        :return: (neck point 3D, neck tangent vector, neck point 1D), as spine_analysis.compute_neck_point_and_tangent
+        """
+
+        reply = self._request("neck_point", path, payload_hash, int(spine_idx), dataclasses.asdict(params))
+        with _reply_shape("neck_point"):
+            point, tangent, point_1d = reply
+
+        return point, tangent, point_1d
+
+    def head_volume(self, path: str, payload_hash: str,
+                    accepted: "bulk.AcceptedHead") -> Optional[tuple[float, np.ndarray]]:
+        """
+        :return: (volume in nm³, centroid), or None if the cut produced no components
+        """
+
+        reply = self._request("head_volume", path, payload_hash, accepted.neck_point, accepted.neck_tangent)
+        if reply is None:
+            return None
+
+        with _reply_shape("head_volume"):
+            volume, centroid = reply
+
+        return volume, centroid
+
+    def head_mesh(self, path: str, payload_hash: str, accepted: "bulk.AcceptedHead") -> "Optional[bulk.Head]":
+        """
+        :return: The head, or None if the cut produced no components
+        """
+
+        from .beheading import bulk
+
+        reply = self._request("head_mesh", path, payload_hash, accepted.neck_point, accepted.neck_tangent)
+        if reply is None:
+            return None
+
+        with _reply_shape("head_mesh"):
+            vertices, faces, volume, centroid, voxel_volume = reply
+
+        return bulk.Head(accepted=accepted, vertices=vertices, faces=faces, volume=volume, centroid=centroid,
+                         voxel_volume=voxel_volume)
+
+    def _close(self) -> None:
+        self.available = False
+        try:
+            self._conn.close()
+        except OSError:
+            pass
+
+    def close(self) -> None:
+        with self._lock:
+            self._close()
+
+
+@contextmanager
+def _reply_shape(kind: str) -> Iterator[None]:
+    """
+    Turn a reply that can't be unpacked in the `with` block into a ServiceError, so that the request falls back to
+    computing locally.
+    """
+
+    try:
+        yield
+    except (TypeError, ValueError) as e:
+        raise ServiceError(f"Unexpected {kind} reply from the service") from e
+
+
+def call_or_fallback(client: Optional[ServiceClient], request: Callable[[ServiceClient], Any],
+                     local: Callable[[], Any]) -> Any:
+    """
+    Ask the service, or compute locally if there is no service or it fails.
+
+    :param client: The service client, or None
+    :param request: Makes the request with the client
+    :param local: Computes the same thing in this process
+    :return: The result
+    """
+
+    if client is not None and client.available:
+        try:
+            return request(client)
+        except ServiceError:
+            pass
+
+    return local()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=0, help="The port to listen on. By default, any free port.")
+    parser.add_argument("--max-datasets", type=int, default=4, help="The number of preprocessing files kept loaded")
+    args = parser.parse_args()
+
+    service = Service(args.max_datasets)
+    server = ServiceServer(service, args.port)
+    print(f"DSB service listening on 127.0.0.1:{server.port} (connection details in {server.info_file})")
+
+    # Clean up on being terminated too, not only on Ctrl+C
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Shares a dendrite mesh with worker processes without pickling it. The owning process copies the vertex and face arrays
+(and any other arrays the workers need, such as prebuilt spatial index inputs) into multiprocessing.shared_memory once,
+and sends workers a small picklable SharedMeshHandle instead of the mesh. Workers attach to the segments zero-copy:
+the trimesh mesh they get is backed by the shared memory itself, read-only, so every worker reads the same pages.
+
+The owner unlinks the segments when the dataset is closed (SharedMesh.close, or leaving its with block). Workers
+should be shut down first: on Linux, workers that are still attached keep the memory alive until they exit, but can
+no longer be attached to; on Windows the memory is freed once every process has closed it.
+"""
+
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Optional, TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:
+    import trimesh
+
+# The segments this process has attached to, keyed by segment name. The arrays returned by attach() point into these,
+#  so they must stay open for as long as the process might use the arrays.
+_attached: dict[str, shared_memory.SharedMemory] = {}
+
+
+@dataclass(frozen=True)
+class SharedArraySpec:
+    """
+    Where to find one array in shared memory.
+    """
+
+    segment: str
+    shape: tuple[int, ...]
+    dtype: str
+
+
+@dataclass(frozen=True)
+class SharedMeshHandle:
+    """
+    A picklable reference to a SharedMesh, to send to worker processes in place of the mesh.
+    """
+
+    vertices: SharedArraySpec
+    faces: SharedArraySpec
+    extras: tuple[tuple[str, SharedArraySpec], ...] = ()
+
+
+def _share_array(array: np.ndarray) -> tuple[shared_memory.SharedMemory, SharedArraySpec]:
+    array = np.ascontiguousarray(array)
+
+    # Zero-size segments are not allowed
+    segment = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[...] = array
+
+    return segment, SharedArraySpec(segment.name, array.shape, array.dtype.str)
+
+
+def _attach_array(spec: SharedArraySpec) -> np.ndarray:
+    segment = _attached.get(spec.segment)
+    if segment is None:
+        segment = shared_memory.SharedMemory(name=spec.segment)
+        _attached[spec.segment] = segment
+
+    array = np.ndarray(spec.shape, dtype=np.dtype(spec.dtype), buffer=segment.buf)
+    array.flags.writeable = False
+    return array
+
+
+class SharedMesh:
+    """
+    Owns the shared memory segments holding one mesh. Use as a context manager, or call close() when the dataset is
+    closed.
+    """
+
+    def __init__(self, mesh: "trimesh.Trimesh", extras: Optional[dict[str, np.ndarray]] = None):
+        """
+        :param mesh: The mesh to share. Its vertices (float64) and faces (int64) are copied into shared memory once.
+        :param extras: Other arrays to share alongside the mesh, keyed by name, e.g. the inputs of a spatial index
+        """
+
+        self._segments: list[shared_memory.SharedMemory] = []
+
+        try:
+            vertices = self._share(mesh.vertices)
+            faces = self._share(mesh.faces)
+            shared_extras = tuple((name, self._share(array)) for name, array in (extras or {}).items())
+        except BaseException:
+            self.close()
+            raise
+
+        self.handle = SharedMeshHandle(vertices, faces, shared_extras)
+
+    def _share(self, array: np.ndarray) -> SharedArraySpec:
+        segment, spec = _share_array(array)
+        self._segments.append(segment)
+        return spec
+
+    @property
+    def nbytes(self) -> int:
+        """
+        The total size of the shared segments.
+        """
+
+        return sum(segment.size for segment in self._segments)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self) -> None:
+        """
+        Unlink the shared memory segments. Safe to call more than once.
+        """
+
+        while self._segments:
+            segment = self._segments.pop()
+            segment.close()
+            try:
+                segment.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def attach(handle: SharedMeshHandle) -> "tuple[trimesh.Trimesh, dict[str, np.ndarray]]":
+    """
+    Attach to a mesh shared by another process, without copying it. Attaching to the same handle again in one process
+    reuses the open segments.
+
+    :param handle: The SharedMesh.handle of the owning process
+    :return: (the mesh, whose read-only vertices and faces point into shared memory, the extra arrays by name)
+    """
+
+    import trimesh
+
+    # process=False keeps trimesh from merging vertices, which would copy them
+    mesh = trimesh.Trimesh(vertices=_attach_array(handle.vertices), faces=_attach_array(handle.faces), process=False)
+    extras = {name: _attach_array(spec) for name, spec in handle.extras}
+
+    return mesh, extras
@@ -0,0 +1,303 @@
+"""
+Lightweight per-stage telemetry. Each instrumented stage records its wall time, CPU time and the peak RSS of the
+process. Off by default: set the environment variable DSB_TELEMETRY=1 or call set_enabled(True). When off, a stage
+costs one flag check.
+
+The stages of a session are written as a Chrome trace (open it in chrome://tracing or https://ui.perfetto.dev) to
+DSB_TELEMETRY_DIR, or ~/dsb_telemetry by default, when the plugin window is closed or Python exits. Its "otherData"
+holds the machine details and a per-stage summary, for comparing sessions across datasets and machines.
+"""
+
+import atexit
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Iterator, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_enabled = os.environ.get("DSB_TELEMETRY", "0") == "1"
+
+_lock = threading.Lock()
+_records: list["StageRecord"] = []
+_listeners: list[Callable[["StageRecord"], None]] = []
+_session_start = datetime.now()
+
+
+@dataclass(frozen=True)
+class StageRecord:
+    """
+    The measurements of one run of a stage.
+    """
+
+    name: str
+    start_us: int  # Wall clock time the stage started, in μs since the epoch, so that processes can be merged
+    wall_s: float
+    cpu_s: float  # CPU time of the whole process, including any threads the stage's libraries start
+    peak_rss_mb: Optional[float]  # Peak RSS of the process so far, or None if it can't be measured
+    peak_rss_growth_mb: Optional[float]  # How much the peak RSS grew during the stage
+    pid: int
+    thread_id: int
+    thread_name: str
+    args: dict = field(default_factory=dict)  # Details such as the spine index or mesh size
+
+    def summary(self) -> str:
+        text = f"{self.name}: {self.wall_s:.2f} s wall, {self.cpu_s:.2f} s CPU"
+        if self.peak_rss_mb is not None:
+            text += f", {self.peak_rss_mb:.0f} MB peak RSS"
+
+        return text
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def set_enabled(enabled: bool) -> None:
+    """
+    Turn recording on or off, overriding DSB_TELEMETRY.
+    """
+
+    global _enabled
+    _enabled = enabled
+
+
+def _peak_rss_mb() -> Optional[float]:
+    if resource is not None:
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        scale = 1 / 1024 ** 2 if sys.platform == "darwin" else 1 / 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+    if os.name == "nt":
+        return _windows_peak_working_set_mb()
+
+    return None
+
+
+def _windows_peak_working_set_mb() -> Optional[float]:
+    import ctypes
+    from ctypes import wintypes
+
+    class ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [
+            ("cb", wintypes.DWORD),
+            ("PageFaultCount", wintypes.DWORD),
+            ("PeakWorkingSetSize", ctypes.c_size_t),
+            ("WorkingSetSize", ctypes.c_size_t),
+            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+            ("PagefileUsage", ctypes.c_size_t),
+            ("PeakPagefileUsage", ctypes.c_size_t),
+        ]
+
+    get_current_process = ctypes.windll.kernel32.GetCurrentProcess
+    get_current_process.restype = wintypes.HANDLE
+    get_process_memory_info = ctypes.windll.psapi.GetProcessMemoryInfo
+    get_process_memory_info.argtypes = [wintypes.HANDLE, ctypes.POINTER(ProcessMemoryCounters), wintypes.DWORD]
+    get_process_memory_info.restype = wintypes.BOOL
+
+    counters = ProcessMemoryCounters()
+    counters.cb = ctypes.sizeof(counters)
+    if not get_process_memory_info(get_current_process(), ctypes.byref(counters), counters.cb):
+        return None
+
+    return counters.PeakWorkingSetSize / 1024 ** 2
+
+
+def add_listener(listener: Callable[[StageRecord], None]) -> None:
+    """
+    Call listener with every stage record from now on. It is called on the thread the stage ran on.
+    """
+
+    with _lock:
+        _listeners.append(listener)
+
+
+def remove_listener(listener: Callable[[StageRecord], None]) -> None:
+    with _lock:
+        if listener in _listeners:
+            _listeners.remove(listener)
+
+
+def add_records(records: list[StageRecord]) -> None:
+    """
+    Add records measured elsewhere, e.g. in a child process, to this session.
+    """
+
+    with _lock:
+        _records.extend(records)
+        listeners = list(_listeners)
+
+    for record in records:
+        for listener in listeners:
+            listener(record)
+
+
+def drain() -> list[StageRecord]:
+    """
+    :return: The records of this session so far, removing them from the session
+    """
+
+    with _lock:
+        records = list(_records)
+        _records.clear()
+
+    return records
+
+
+@contextmanager
+def stage(name: str, min_wall_s: float = 0.0, **args) -> Iterator[None]:
+    """
+    Record the code in the `with` block as a stage, if telemetry is enabled. A stage that raises is still recorded.
+
+    :param name: The name of the stage. Runs of the same stage are summarized together.
+    :param min_wall_s: Runs faster than this aren't recorded, for stages that run too often to keep every run
+    :param args: Details to record with the stage, such as the spine index. Must be JSON serializable.
+    """
+
+    if not _enabled:
+        yield
+        return
+
+    rss_start = _peak_rss_mb()
+    start_us = time.time_ns() // 1000
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+
+    try:
+        yield
+    finally:
+        wall = time.perf_counter() - wall_start
+        if wall >= min_wall_s:
+            cpu = time.process_time() - cpu_start
+            rss_end = _peak_rss_mb()
+
+            thread = threading.current_thread()
+            add_records([StageRecord(
+                name=name,
+                start_us=start_us,
+                wall_s=wall,
+                cpu_s=cpu,
+                peak_rss_mb=rss_end,
+                peak_rss_growth_mb=rss_end - rss_start if rss_end is not None else None,
+                pid=os.getpid(),
+                thread_id=threading.get_native_id(),
+                thread_name=thread.name,
+                args=args
+            )])
+
+
+def summarize(records: list[StageRecord]) -> dict:
+    """
+    :return: The number of runs, total and maximum wall time, total CPU time and peak RSS of each stage
+    """
+
+    summary = {}
+    for record in records:
+        stats = summary.setdefault(record.name, {
+            "count": 0, "wall_s": 0.0, "max_wall_s": 0.0, "cpu_s": 0.0, "peak_rss_mb": None
+        })
+        stats["count"] += 1
+        stats["wall_s"] += record.wall_s
+        stats["max_wall_s"] = max(stats["max_wall_s"], record.wall_s)
+        stats["cpu_s"] += record.cpu_s
+        if record.peak_rss_mb is not None:
+            stats["peak_rss_mb"] = max(stats["peak_rss_mb"] or 0.0, record.peak_rss_mb)
+
+    return summary
+
+
+def chrome_trace(records: list[StageRecord]) -> dict:
+    """
+    :return: The records in the Chrome trace event format, with the machine details and summary in "otherData"
+    """
+
+    events = []
+    threads = {}
+
+    for record in sorted(records, key=lambda record: record.start_us):
+        threads[(record.pid, record.thread_id)] = record.thread_name
+        events.append({
+            "name": record.name,
+            "cat": "dsb",
+            "ph": "X",
+            "ts": record.start_us,
+            "dur": round(record.wall_s * 1e6),
+            "pid": record.pid,
+            "tid": record.thread_id,
+            "args": {
+                "cpu_s": record.cpu_s,
+                "peak_rss_mb": record.peak_rss_mb,
+                "peak_rss_growth_mb": record.peak_rss_growth_mb,
+                **record.args
+            }
+        })
+
+    for (pid, thread_id), thread_name in threads.items():
+        events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": thread_id, "args": {"name": thread_name}})
+
+    return {
+        "traceEvents": events,
+        "displayTimeUnit": "ms",
+        "otherData": {
+            "session_start": _session_start.isoformat(timespec="seconds"),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "python": platform.python_version(),
+            "env": {name: value for name, value in os.environ.items() if name.startswith("DSB_")},
+            "summary": summarize(records)
+        }
+    }
+
+
+def session_path() -> str:
+    """
+    :return: The path the trace of this session is written to
+    """
+
+    directory = os.environ.get("DSB_TELEMETRY_DIR") or os.path.join(os.path.expanduser("~"), "dsb_telemetry")
+    return os.path.join(directory, f"dsb-{_session_start:%Y%m%d-%H%M%S}-{os.getpid()}.json")
+
+
+def write_session() -> Optional[str]:
+    """
+    Write the trace of this session, replacing the file written by an earlier call.
+
+    :return: The path written to, or None if nothing was recorded
+    """
+
+    with _lock:
+        records = list(_records)
+
+    if not records:
+        return None
+
+    path = session_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(chrome_trace(records), f)
+
+    return path
+
+
+def _write_at_exit() -> None:
+    # Worker processes send their records to the parent rather than writing their own sessions
+    if multiprocessing.parent_process() is None:
+        write_session()
+
+
+atexit.register(_write_at_exit)
@@ -74,6 +74,9 @@ class Ui_MainFormDsb(object):
         self.chk_vis_multiroi = QtWidgets.QCheckBox(self.preprocessing)
         self.chk_vis_multiroi.setObjectName("chk_vis_multiroi")
         self.formLayout.setWidget(2, QtWidgets.QFormLayout.ItemRole.LabelRole, self.chk_vis_multiroi)
+        self.chk_distance_field = QtWidgets.QCheckBox(self.preprocessing)
+        self.chk_distance_field.setObjectName("chk_distance_field")
+        self.formLayout.setWidget(4, QtWidgets.QFormLayout.ItemRole.SpanningRole, self.chk_distance_field)
         self.verticalLayout_2.addLayout(self.formLayout)
         self.horizontalLayout_2 = QtWidgets.QHBoxLayout()
         self.horizontalLayout_2.setObjectName("horizontalLayout_2")
@@ -81,6 +84,10 @@ class Ui_MainFormDsb(object):
         self.btn_preprocessing_run = QtWidgets.QPushButton(self.preprocessing)
         self.btn_preprocessing_run.setObjectName("btn_preprocessing_run")
         self.verticalLayout_2.addWidget(self.btn_preprocessing_run)
+        self.btn_preprocessing_cancel = QtWidgets.QPushButton(self.preprocessing)
+        self.btn_preprocessing_cancel.setEnabled(False)
+        self.btn_preprocessing_cancel.setObjectName("btn_preprocessing_cancel")
+        self.verticalLayout_2.addWidget(self.btn_preprocessing_cancel)
         spacerItem = QtWidgets.QSpacerItem(20, 40, QtWidgets.QSizePolicy.Policy.Minimum, QtWidgets.QSizePolicy.Policy.Expanding)
         self.verticalLayout_2.addItem(spacerItem)
         self.tabWidget.addTab(self.preprocessing, "")
@@ -100,10 +107,80 @@ class Ui_MainFormDsb(object):
         self.btn_select_preprocessing_file = QtWidgets.QPushButton(self.beheading)
         self.btn_select_preprocessing_file.setObjectName("btn_select_preprocessing_file")
         self.main_vertical_layout.addWidget(self.btn_select_preprocessing_file)
-        self.vis_widget = QtInteractor(self.beheading)
-        self.vis_widget.setMinimumSize(QtCore.QSize(0, 26))
-        self.vis_widget.setObjectName("vis_widget")
-        self.main_vertical_layout.addWidget(self.vis_widget)
+        self.grp_spine_filter = QtWidgets.QGroupBox(self.beheading)
+        self.grp_spine_filter.setObjectName("grp_spine_filter")
+        self.gridLayout = QtWidgets.QGridLayout(self.grp_spine_filter)
+        self.gridLayout.setObjectName("gridLayout")
+        self.label_3 = QtWidgets.QLabel(self.grp_spine_filter)
+        self.label_3.setObjectName("label_3")
+        self.gridLayout.addWidget(self.label_3, 0, 0, 1, 1)
+        self.spn_min_nodes = QtWidgets.QSpinBox(self.grp_spine_filter)
+        self.spn_min_nodes.setKeyboardTracking(False)
+        self.spn_min_nodes.setMaximum(100000)
+        self.spn_min_nodes.setProperty("value", 15)
+        self.spn_min_nodes.setObjectName("spn_min_nodes")
+        self.gridLayout.addWidget(self.spn_min_nodes, 0, 1, 1, 1)
+        self.label_4 = QtWidgets.QLabel(self.grp_spine_filter)
+        self.label_4.setObjectName("label_4")
+        self.gridLayout.addWidget(self.label_4, 0, 2, 1, 1)
+        self.spn_max_nodes = QtWidgets.QSpinBox(self.grp_spine_filter)
+        self.spn_max_nodes.setKeyboardTracking(False)
+        self.spn_max_nodes.setMaximum(100000)
+        self.spn_max_nodes.setProperty("value", 5000)
+        self.spn_max_nodes.setObjectName("spn_max_nodes")
+        self.gridLayout.addWidget(self.spn_max_nodes, 0, 3, 1, 1)
+        self.label_5 = QtWidgets.QLabel(self.grp_spine_filter)
+        self.label_5.setObjectName("label_5")
+        self.gridLayout.addWidget(self.label_5, 1, 0, 1, 1)
+        self.spn_min_length = QtWidgets.QDoubleSpinBox(self.grp_spine_filter)
+        self.spn_min_length.setKeyboardTracking(False)
+        self.spn_min_length.setDecimals(0)
+        self.spn_min_length.setMaximum(1000000.0)
+        self.spn_min_length.setSingleStep(100.0)
+        self.spn_min_length.setProperty("value", 0.0)
+        self.spn_min_length.setObjectName("spn_min_length")
+        self.gridLayout.addWidget(self.spn_min_length, 1, 1, 1, 1)
+        self.label_6 = QtWidgets.QLabel(self.grp_spine_filter)
+        self.label_6.setObjectName("label_6")
+        self.gridLayout.addWidget(self.label_6, 1, 2, 1, 1)
+        self.spn_max_length = QtWidgets.QDoubleSpinBox(self.grp_spine_filter)
+        self.spn_max_length.setKeyboardTracking(False)
+        self.spn_max_length.setDecimals(0)
+        self.spn_max_length.setMaximum(1000000.0)
+        self.spn_max_length.setSingleStep(100.0)
+        self.spn_max_length.setProperty("value", 10000.0)
+        self.spn_max_length.setObjectName("spn_max_length")
+        self.gridLayout.addWidget(self.spn_max_length, 1, 3, 1, 1)
+        self.label_7 = QtWidgets.QLabel(self.grp_spine_filter)
+        self.label_7.setObjectName("label_7")
+        self.gridLayout.addWidget(self.label_7, 2, 0, 1, 1)
+        self.spn_max_end_radius = QtWidgets.QDoubleSpinBox(self.grp_spine_filter)
+        self.spn_max_end_radius.setKeyboardTracking(False)
+        self.spn_max_end_radius.setDecimals(0)
+        self.spn_max_end_radius.setMaximum(1000000.0)
+        self.spn_max_end_radius.setSingleStep(100.0)
+        self.spn_max_end_radius.setProperty("value", 0.0)
+        self.spn_max_end_radius.setObjectName("spn_max_end_radius")
+        self.gridLayout.addWidget(self.spn_max_end_radius, 2, 1, 1, 1)
+        self.label_8 = QtWidgets.QLabel(self.grp_spine_filter)
+        self.label_8.setObjectName("label_8")
+        self.gridLayout.addWidget(self.label_8, 2, 2, 1, 1)
+        self.spn_max_main_branch_dist = QtWidgets.QDoubleSpinBox(self.grp_spine_filter)
+        self.spn_max_main_branch_dist.setKeyboardTracking(False)
+        self.spn_max_main_branch_dist.setDecimals(0)
+        self.spn_max_main_branch_dist.setMaximum(1000000.0)
+        self.spn_max_main_branch_dist.setSingleStep(100.0)
+        self.spn_max_main_branch_dist.setProperty("value", 0.0)
+        self.spn_max_main_branch_dist.setObjectName("spn_max_main_branch_dist")
+        self.gridLayout.addWidget(self.spn_max_main_branch_dist, 2, 3, 1, 1)
+        self.main_vertical_layout.addWidget(self.grp_spine_filter)
+        self.vis_container = QtWidgets.QWidget(self.beheading)
+        self.vis_container.setMinimumSize(QtCore.QSize(0, 26))
+        self.vis_container.setObjectName("vis_container")
+        self.vis_layout = QtWidgets.QVBoxLayout(self.vis_container)
+        self.vis_layout.setContentsMargins(0, 0, 0, 0)
+        self.vis_layout.setObjectName("vis_layout")
+        self.main_vertical_layout.addWidget(self.vis_container)
         self.lbl_spine_idx = QtWidgets.QLabel(self.beheading)
         self.lbl_spine_idx.setObjectName("lbl_spine_idx")
         self.main_vertical_layout.addWidget(self.lbl_spine_idx)
@@ -134,11 +211,39 @@ class Ui_MainFormDsb(object):
         self.btn_save_head = QtWidgets.QPushButton(self.beheading)
         self.btn_save_head.setObjectName("btn_save_head")
         self.horizontalLayout.addWidget(self.btn_save_head)
+        self.btn_accept_head = QtWidgets.QPushButton(self.beheading)
+        self.btn_accept_head.setObjectName("btn_accept_head")
+        self.horizontalLayout.addWidget(self.btn_accept_head)
+        self.btn_save_accepted = QtWidgets.QPushButton(self.beheading)
+        self.btn_save_accepted.setObjectName("btn_save_accepted")
+        self.horizontalLayout.addWidget(self.btn_save_accepted)
         self.main_vertical_layout.addLayout(self.horizontalLayout)
+        self.grp_confidence = QtWidgets.QGroupBox(self.beheading)
+        self.grp_confidence.setObjectName("grp_confidence")
+        self.gridLayout_2 = QtWidgets.QGridLayout(self.grp_confidence)
+        self.gridLayout_2.setObjectName("gridLayout_2")
+        self.label_9 = QtWidgets.QLabel(self.grp_confidence)
+        self.label_9.setObjectName("label_9")
+        self.gridLayout_2.addWidget(self.label_9, 0, 0, 1, 1)
+        self.spn_confidence_threshold = QtWidgets.QDoubleSpinBox(self.grp_confidence)
+        self.spn_confidence_threshold.setKeyboardTracking(False)
+        self.spn_confidence_threshold.setMaximum(1.0)
+        self.spn_confidence_threshold.setSingleStep(0.05)
+        self.spn_confidence_threshold.setProperty("value", 0.8)
+        self.spn_confidence_threshold.setObjectName("spn_confidence_threshold")
+        self.gridLayout_2.addWidget(self.spn_confidence_threshold, 0, 1, 1, 1)
+        self.btn_auto_accept = QtWidgets.QPushButton(self.grp_confidence)
+        self.btn_auto_accept.setObjectName("btn_auto_accept")
+        self.gridLayout_2.addWidget(self.btn_auto_accept, 0, 2, 1, 1)
+        self.chk_review_only = QtWidgets.QCheckBox(self.grp_confidence)
+        self.chk_review_only.setChecked(True)
+        self.chk_review_only.setObjectName("chk_review_only")
+        self.gridLayout_2.addWidget(self.chk_review_only, 1, 0, 1, 3)
+        self.main_vertical_layout.addWidget(self.grp_confidence)
         self.btn_go_to_spine = QtWidgets.QPushButton(self.beheading)
         self.btn_go_to_spine.setObjectName("btn_go_to_spine")
         self.main_vertical_layout.addWidget(self.btn_go_to_spine)
-        self.main_vertical_layout.setStretch(2, 1)
+        self.main_vertical_layout.setStretch(3, 1)
         self.tabWidget.addTab(self.beheading, "")
         self.verticalLayout.addWidget(self.tabWidget)
         self.lbl_status = QtWidgets.QLabel(MainFormDsb)
@@ -157,19 +262,37 @@ class Ui_MainFormDsb(object):
         self.btn_preprocessing_output.setText(_translate("MainFormDsb", "Choose Output File"))
         self.chk_vis_annotations.setText(_translate("MainFormDsb", "Annotations"))
         self.chk_vis_multiroi.setText(_translate("MainFormDsb", "Visualize MultiROI"))
+        self.chk_distance_field.setText(_translate("MainFormDsb", "Save Distance Field"))
         self.btn_preprocessing_run.setText(_translate("MainFormDsb", "Run"))
+        self.btn_preprocessing_cancel.setText(_translate("MainFormDsb", "Cancel"))
         self.tabWidget.setTabText(self.tabWidget.indexOf(self.preprocessing), _translate("MainFormDsb", "Preprocessing"))
         self.btn_select_csv_output.setText(_translate("MainFormDsb", "Select CSV Output"))
         self.btn_select_preprocessing_file.setText(_translate("MainFormDsb", "Select Preprocessing File"))
+        self.grp_spine_filter.setTitle(_translate("MainFormDsb", "Spine Filter"))
+        self.label_3.setText(_translate("MainFormDsb", "Min Nodes"))
+        self.label_4.setText(_translate("MainFormDsb", "Max Nodes"))
+        self.spn_max_nodes.setSpecialValueText(_translate("MainFormDsb", "No limit"))
+        self.label_5.setText(_translate("MainFormDsb", "Min Length (nm)"))
+        self.label_6.setText(_translate("MainFormDsb", "Max Length (nm)"))
+        self.spn_max_length.setSpecialValueText(_translate("MainFormDsb", "No limit"))
+        self.label_7.setText(_translate("MainFormDsb", "Max End Radius (nm)"))
+        self.spn_max_end_radius.setSpecialValueText(_translate("MainFormDsb", "No limit"))
+        self.label_8.setText(_translate("MainFormDsb", "Max Dist. to Dendrite (nm)"))
+        self.spn_max_main_branch_dist.setSpecialValueText(_translate("MainFormDsb", "No limit"))
         self.lbl_spine_idx.setText(_translate("MainFormDsb", "Spine 0/0"))
         self.btn_prev_spine.setText(_translate("MainFormDsb", "Previous Spine"))
         self.btn_next_spine.setText(_translate("MainFormDsb", "Next Spine"))
         self.label_2.setText(_translate("MainFormDsb", "Head Name:"))
         self.btn_save_head.setText(_translate("MainFormDsb", "Save Head"))
+        self.btn_accept_head.setText(_translate("MainFormDsb", "Accept Head"))
+        self.btn_save_accepted.setText(_translate("MainFormDsb", "Save Accepted Heads"))
+        self.grp_confidence.setTitle(_translate("MainFormDsb", "Auto-Accept"))
+        self.label_9.setText(_translate("MainFormDsb", "Confidence Threshold"))
+        self.btn_auto_accept.setText(_translate("MainFormDsb", "Auto-Accept Confident Spines"))
+        self.chk_review_only.setText(_translate("MainFormDsb", "Only Visit Spines Needing Review"))
         self.btn_go_to_spine.setText(_translate("MainFormDsb", "Go to Spine"))
         self.tabWidget.setTabText(self.tabWidget.indexOf(self.beheading), _translate("MainFormDsb", "Beheading"))
 from ORSServiceClass.ORSWidget.orsobjectclasscombobox.orsobjectclasscombobox import OrsObjectClassComboBox
-from pyvistaqt import QtInteractor
 
 
 if __name__ == "__main__":
@@ -7,6 +7,10 @@ import pyvista as pv
 import vtk
 from pyvistaqt import QtInteractor
 
+from ..pipeline import telemetry
+
+SLOW_RENDER_S = 0.1  # Renders faster than this aren't recorded in the telemetry
+
 
 def line_actor(lines, color='w', width=5, connected=False):
     """
@@ -96,7 +100,7 @@ class Visualizer:
             self,
             interactor: QtInteractor,
             mesh: trimesh.Trimesh,
-            spine_polylines: np.ndarray,
+            spine_polylines: list[np.ndarray],
             annotations: typing.Optional[list[tuple[np.ndarray, str]]] = None,
             psds: typing.Optional[trimesh.Trimesh] = None
     ):
@@ -105,11 +109,10 @@ class Visualizer:
 
         self.active_actors = []  # Actors that are currently visible in the plotter and aren't the dendrite mesh actor
 
-        self.spine_polyline_actors = []
-        for polyline in spine_polylines:
-            self.spine_polyline_actors.append(
-                line_actor(polyline, color=(1, 0, 0), connected=True)
-            )
+        # Line actors are created the first time a spine is shown, since the spine list can hold every segment of the
+        #  skeleton and only a filtered subset of them is ever visited
+        self.spine_polylines = spine_polylines
+        self.spine_polyline_actors: dict[int, pv.Actor] = {}
 
         self.annotations_actor = self.plotter.add_point_labels(
             np.array([pt for pt, _ in annotations]),
@@ -123,7 +126,7 @@ class Visualizer:
 
         self.psds_actor = self.plotter.add_mesh(pv.wrap(psds), color=(0.16, 0.16, 0.8)) if psds is not None else None
 
-        self.spine_point_actors: list[typing.Optional[pv.Actor]] = [None for _ in range(len(spine_polylines))]
+        self.spine_point_actors: dict[int, pv.Actor] = {}
 
         self.currently_visualizing: typing.Optional[int] = None
 
@@ -136,6 +139,22 @@ class Visualizer:
             name="rotating_plane"
         )
 
+        # Renders are triggered from many places, including Qt itself, so they are timed by the render window
+        self.render_stage = None
+        if telemetry.enabled():
+            self.plotter.render_window.AddObserver("StartEvent", self.on_render_start)
+            self.plotter.render_window.AddObserver("EndEvent", self.on_render_end)
+
+    def on_render_start(self, *_):
+        # Renders happen on every camera move, so only the slow ones are kept for the whole session
+        self.render_stage = telemetry.stage("render", min_wall_s=SLOW_RENDER_S, spine=self.currently_visualizing)
+        self.render_stage.__enter__()
+
+    def on_render_end(self, *_):
+        if self.render_stage is not None:
+            self.render_stage.__exit__(None, None, None)
+            self.render_stage = None
+
     def transform_plane(self, center, normal):
         # 1) Restore the original point positions
         self.plane.points = self.original_plane_pts.copy()
@@ -204,7 +223,7 @@ class Visualizer:
         :param idx: The index of the point actor to check.
         :return: True if the point actor exists, False otherwise.
         """
-        return self.spine_point_actors[idx] is not None
+        return idx in self.spine_point_actors
 
     def set_spine_point(self, idx: int, point_loc: np.ndarray) -> None:
         """
@@ -232,18 +251,32 @@ class Visualizer:
         self.plotter.render()
 
     def vis_spine_idx(self, idx: int) -> None:
+        """
+        Show the skeleton and neck point of a spine. If its neck point hasn't been set yet, a "computing" placeholder
+        is shown in its place until set_spine_point is called and the spine is shown again.
+        :param idx: The segment index of the spine
+        """
+
         for actor in self.active_actors:
             self.plotter.remove_actor(actor)
 
         self.active_actors.clear()
 
-        if not self.has_spine_point(idx):
-            raise ValueError(f"No point actor exists for index {idx}. Please set the point first using set_point_idx.")
+        if idx not in self.spine_polyline_actors:
+            self.spine_polyline_actors[idx] = line_actor(self.spine_polylines[idx], color=(1, 0, 0), connected=True)
 
         self.currently_visualizing = idx
         self.plotter.add_actor(self.spine_polyline_actors[idx])
         self.active_actors.append(self.spine_polyline_actors[idx])
 
+        if not self.has_spine_point(idx):
+            placeholder = self.plotter.add_text("Computing neck point…", position="upper_left", font_size=10)
+            self.active_actors.append(placeholder)
+
+            polyline = self.spine_polylines[idx]
+            self.focus_camera_on_point(polyline[len(polyline) // 2], distance=8000)
+            return
+
         self.plotter.add_actor(self.spine_point_actors[idx])
         self.active_actors.append(self.spine_point_actors[idx])
 